@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# --- Query Normalization ---
+def normalize_query(query):
+    """Lowercase, drop punctuation and collapse whitespace so trivial rewrites share a key."""
+    text = query.lower().strip()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _numbers(query):
+    return sorted(re.findall(r"\d+", query))
+
+
+class SemanticAnswerCache:
+    """
+    LRU + TTL cache for answers of `answer_user_query`.
+
+    Lookups first try the normalized query text, then (if an embedding function
+    is given) the closest cached query whose cosine similarity is above
+    `similarity_threshold`. Values can be DataFrames or plain text. Only text
+    (semantic) answers are matched by similarity, and only when both questions
+    contain the same numbers: "movies by Christopher Nolan" and "... Christopher
+    Guest", or "released in 1995" and "... 1996", embed almost identically but
+    need different tables.
+
+    With `persist_path`, changes are pickled to disk on a background thread at
+    most once per `save_delay_seconds`, so a miss never waits for the write.
+    """
+
+    def __init__(self, embed_fn=None, max_entries=500, ttl_seconds=24 * 3600,
+                 similarity_threshold=0.97, persist_path=None, save_delay_seconds=2.0):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.persist_path = persist_path
+        self.save_delay_seconds = save_delay_seconds
+
+        # key -> {"query", "answer", "vector", "created"}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if persist_path and os.path.exists(persist_path):
+            self.load()
+
+    # --- Lookup ---
+    def get(self, query, vector=None):
+        """Return the cached answer for `query` or None. `vector` may be passed to skip re-embedding."""
+        answer, _ = self.lookup(query, vector)
+        return answer
+
+    def lookup(self, query, vector=None):
+        """Like get, but also returns the query embedding (if one was computed) so a later put can reuse it."""
+        # Exact match first so repeats never pay for an embedding call
+        key = normalize_query(query)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return self._copy(entry["answer"]), vector
+
+        if self.embed_fn is None or self.similarity_threshold is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None, vector
+
+        if vector is None:
+            vector = self._embed(query)
+        with self._lock:
+            match_key, score = self._nearest(vector, query)
+            if match_key is not None and score >= self.similarity_threshold:
+                self._entries.move_to_end(match_key)
+                self.stats["semantic_hits"] += 1
+                return self._copy(self._entries[match_key]["answer"]), vector
+            self.stats["misses"] += 1
+        return None, vector
+
+    def put(self, query, answer, vector=None):
+        # Error strings from the SQL branch are not worth remembering
+        if isinstance(answer, str) and answer.startswith("SQL Error:"):
+            return
+        if vector is None and self.embed_fn is not None:
+            vector = self._embed(query)
+
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = {
+                "query": query,
+                "answer": self._copy(answer),
+                "vector": vector,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_or_compute(self, query, compute_fn):
+        """Serve `query` from cache, otherwise call `compute_fn(query)` and store its result."""
+        cached, vector = self.lookup(query)
+        if cached is not None:
+            return cached
+        answer = compute_fn(query)
+        self.put(query, answer, vector=vector)
+        self.save_soon()
+        return answer
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def summary(self):
+        total_hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        lookups = total_hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": round(total_hits / lookups, 3) if lookups else 0.0,
+        }
+
+    # --- Persistence ---
+    def save_soon(self):
+        """Schedule a background save; calls within `save_delay_seconds` share one write."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_delay_seconds, self._background_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _background_save(self):
+        with self._lock:
+            self._save_timer = None
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Could not save answer cache to {self.persist_path}: {e}")
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._lock:
+            snapshot = list(self._entries.items())
+        # One writer at a time in this process; the unique temp file keeps other processes' writes apart
+        with self._save_lock:
+            directory = os.path.dirname(os.path.abspath(self.persist_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.persist_path) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.persist_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    def load(self):
+        try:
+            with open(self.persist_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f"Could not load answer cache from {self.persist_path}: {e}")
+            return
+        with self._lock:
+            self._entries = OrderedDict(snapshot)
+            self._expire()
+
+    # --- Internals ---
+    def _embed(self, query):
+        vector = np.asarray(self.embed_fn(query), dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, vector, query):
+        numbers = _numbers(query)
+        # Entries embedded by another model (different size) are not comparable
+        keys = [
+            k for k, e in self._entries.items()
+            if e["vector"] is not None and e["vector"].shape == vector.shape
+            and isinstance(e["answer"], str) and _numbers(e["query"]) == numbers
+        ]
+        if not keys:
+            return None, -1.0
+        matrix = np.stack([self._entries[k]["vector"] for k in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best], float(scores[best])
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        stale = [k for k, e in self._entries.items() if e["created"] < cutoff]
+        for k in stale:
+            del self._entries[k]
+        self.stats["expired"] += len(stale)
+
+    @staticmethod
+    def _copy(answer):
+        # Callers may mutate DataFrames in place; never hand out the cached object itself
+        return answer.copy() if isinstance(answer, pd.DataFrame) else answer
@@ -0,0 +1,278 @@
+"""
+Process-wide resources for working_app_v3.py.
+
+Streamlit re-executes the script on every interaction. Everything expensive
+(engine, embeddings, vector index + filter arrays, LLM client, schema, router
+vocabulary, answer cache) is registered here once per process, built on first
+use and shared by every session. The app keeps the registry itself in
+st.cache_resource, so a rerun only looks resources up.
+
+    python app_bootstrap.py                 # cold-start time of each resource, then the cost of a warm lookup
+    python app_bootstrap.py --output startup.json
+
+Lifetime: a resource lives until the process exits, except the vector index,
+which is reloaded when faiss_index_builder.py swaps in a new index directory.
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+
+
+# Built in the background at startup (slowest first: index + filter arrays, schema, router vocabulary)
+PREWARM_ORDER = ["engine", "embedding_model", "vector_index", "prompt_builder", "query_router", "answer_cache", "llm"]
+
+
+# --- Resources ---
+class LazyResource:
+    """
+    Value built by `factory` on first `get`. If `version` is given it is called
+    on every `get`; a different result rebuilds the value. If that rebuild
+    fails, the previous value keeps being served (and the failed version is
+    not retried until the version changes again).
+    """
+
+    def __init__(self, name, factory, version=None):
+        self.name = name
+        self.factory = factory
+        self.version = version
+        self.state = "pending"
+        self.load_ms = None
+        self.loads = 0
+        self.error = None
+        self._value = None
+        self._loaded_version = None
+        self._failed_version = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def get(self):
+        version = self.version() if self.version else None
+        with self._lock:
+            if self.state == "ready" and version in (self._loaded_version, self._failed_version):
+                return self._value
+            reloading = self.state == "ready"
+            self.state = "loading"
+            start = time.perf_counter()
+            try:
+                value = self.factory()
+            except Exception as e:
+                if reloading:
+                    print(f"Reloading {self.name} failed, keeping the loaded version: {e}")
+                    self.state, self.error, self._failed_version = "ready", e, version
+                    return self._value
+                # The next get() tries again
+                self.state, self.error = "failed", e
+                raise
+            self._value, self._loaded_version, self._failed_version = value, version, None
+            self.load_ms = (time.perf_counter() - start) * 1000
+            self.loads += 1
+            self.state, self.error = "ready", None
+            return value
+
+    def reset(self):
+        with self._lock:
+            self._value, self.state = None, "pending"
+
+
+class AppResources:
+    """Named LazyResources plus startup and rerun timings."""
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.prewarm_ms = None
+        self._resources = {}
+        self._reruns = deque(maxlen=500)
+        self._prewarm_thread = None
+
+    def add(self, name, factory, version=None):
+        self._resources[name] = LazyResource(name, factory, version)
+
+    def get(self, name):
+        return self._resources[name].get()
+
+    def ready(self, *names):
+        return all(self._resources[n].ready for n in (names or self._resources))
+
+    def pending(self, names=None):
+        return [n for n in (names or self._resources) if not self._resources[n].ready]
+
+    def failed(self):
+        return {name: r.error for name, r in self._resources.items() if r.state == "failed"}
+
+    def prewarm(self, names):
+        """Build `names` in order on a daemon thread; failures are left for the foreground get() to report."""
+        def run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Pre-warming {name} failed: {e}")
+            self.prewarm_ms = (time.perf_counter() - self.created) * 1000
+
+        self._prewarm_thread = threading.Thread(target=run, name="app-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def record_rerun(self, elapsed_ms):
+        self._reruns.append(elapsed_ms)
+
+    def summary(self):
+        reruns = np.array(self._reruns) if self._reruns else None
+        return {
+            "cold_start_ms": round(self.prewarm_ms, 1) if self.prewarm_ms is not None else None,
+            "resources": {
+                name: {"state": r.state, "load_ms": round(r.load_ms, 1) if r.load_ms is not None else None,
+                       "loads": r.loads, "error": str(r.error) if r.error else None}
+                for name, r in self._resources.items()
+            },
+            "reruns": len(self._reruns),
+            "rerun_p50_ms": round(float(np.percentile(reruns, 50)), 2) if reruns is not None else None,
+            "rerun_max_ms": round(float(reruns.max()), 2) if reruns is not None else None,
+        }
+
+
+def _index_version(path):
+    # faiss_index_builder.py names a new versioned directory in path/CURRENT on every rebuild
+    from vector_index import resolve_index_dir
+    try:
+        current = resolve_index_dir(path)
+        return current, os.stat(current).st_mtime_ns
+    except OSError:
+        return None
+
+
+# --- App Wiring ---
+def create_app_resources(prewarm=False):
+    """
+    Register the app's resources. Heavy imports (LangChain/OpenAI, FAISS,
+    sentence-transformers) happen inside the factories, not at app import time.
+    """
+    from config import (
+        openai_api_key, DB_URI, LLM_MODEL_NAME, FAISS_INDEX_PATH,
+        ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY,
+        ROUTER_CONFIDENCE_THRESHOLD, PROMPT_SCHEMA_TOKEN_BUDGET, SPECULATION_MAX_INFLIGHT,
+        VECTOR_INDEX_MMAP, VECTOR_INDEX_NPROBE, VECTOR_INDEX_EF_SEARCH, HYBRID_RETRIEVAL_ENABLED,
+        RESULT_PAGE_SIZE, CHAT_HISTORY_SPILL_DIR, CHAT_HISTORY_GLOBAL_MAX_MB, CHAT_HISTORY_PREVIEW_ROWS,
+    )
+    resources = AppResources()
+
+    def engine():
+        from sqlalchemy import create_engine
+        return create_engine(DB_URI)
+
+    def embedding_model():
+        from embedding_providers import get_embedding_provider
+        return get_embedding_provider()
+
+    def vector_index():
+        from vector_index import MovieVectorIndex, load_vector_index
+        from hybrid_retrieval import HybridRetriever, MovieFilterIndex
+        db = resources.get("engine")
+        # Column-built indexes (faiss_index_builder.py) or the older LangChain FAISS store
+        index = load_vector_index(FAISS_INDEX_PATH, resources.get("embedding_model"), db, mmap=VECTOR_INDEX_MMAP,
+                                  nprobe=VECTOR_INDEX_NPROBE, ef_search=VECTOR_INDEX_EF_SEARCH)
+        if HYBRID_RETRIEVAL_ENABLED and isinstance(index, MovieVectorIndex):
+            # Year/genre/language/country/rating filters in a question restrict the FAISS search itself
+            index = HybridRetriever(index, MovieFilterIndex.from_engine(db, index.movie_ids()))
+        return index
+
+    def llm():
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(temperature=0, model_name=LLM_MODEL_NAME, openai_api_key=openai_api_key)
+
+    def prompt_builder():
+        from prompt_builder import get_prompt_builder
+        # Schema is introspected once per process; each question only gets its relevant tables
+        return get_prompt_builder(resources.get("engine"), token_budget=PROMPT_SCHEMA_TOKEN_BUDGET)
+
+    def query_router():
+        from query_router import QueryRouter, load_router_vocabulary
+        try:
+            vocabulary = load_router_vocabulary(resources.get("engine"))
+        except Exception as e:
+            print(f"Router vocabulary unavailable, using keyword rules only: {e}")
+            vocabulary = None
+        return QueryRouter(vocabulary=vocabulary, confidence_threshold=ROUTER_CONFIDENCE_THRESHOLD)
+
+    def answer_cache():
+        from answer_cache import SemanticAnswerCache
+        return SemanticAnswerCache(
+            embed_fn=resources.get("embedding_model").embed_query,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+            persist_path=ANSWER_CACHE_PATH or None,
+        )
+
+    def speculation():
+        from speculative_pipeline import SpeculationLimiter, SpeculationStats
+        return SpeculationLimiter(SPECULATION_MAX_INFLIGHT), SpeculationStats()
+
+    def chat_results():
+        from chat_history import ChatResultStore
+        # Spilled table answers of every session; pages are RESULT_PAGE_SIZE-row Parquet row groups
+        return ChatResultStore(CHAT_HISTORY_SPILL_DIR, max_bytes=CHAT_HISTORY_GLOBAL_MAX_MB * 1024 * 1024,
+                               preview_rows=CHAT_HISTORY_PREVIEW_ROWS, page_rows=RESULT_PAGE_SIZE)
+
+    resources.add("engine", engine)
+    resources.add("embedding_model", embedding_model)
+    resources.add("vector_index", vector_index, version=lambda: _index_version(FAISS_INDEX_PATH))
+    resources.add("llm", llm)
+    resources.add("prompt_builder", prompt_builder)
+    resources.add("query_router", query_router)
+    resources.add("answer_cache", answer_cache)
+    resources.add("speculation", speculation)
+    resources.add("chat_results", chat_results)
+
+    if prewarm:
+        resources.prewarm(PREWARM_ORDER)
+    return resources
+
+
+# --- Startup Measurement ---
+def measure_startup(names=None, warm_lookups=1000):
+    """Cold build time of each resource (in dependency order) and the per-lookup cost once built."""
+    start = time.perf_counter()
+    resources = create_app_resources()
+    names = names or list(resources._resources)
+    report = {"register_ms": round((time.perf_counter() - start) * 1000, 2), "cold_ms": {}}
+    for name in names:
+        begin = time.perf_counter()
+        resources.get(name)
+        # Includes dependencies that were not built yet
+        report["cold_ms"][name] = round((time.perf_counter() - begin) * 1000, 1)
+    report["cold_start_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    begin = time.perf_counter()
+    for _ in range(warm_lookups):
+        for name in names:
+            resources.get(name)
+    report["warm_lookup_us"] = round((time.perf_counter() - begin) * 1e6 / (warm_lookups * len(names)), 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resources", nargs="+", default=None, help="Subset to build (default: all)")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = measure_startup(args.resources)
+    for name, ms in report["cold_ms"].items():
+        print(f"{name:<18}{ms:>10.1f} ms")
+    print(f"{'cold start':<18}{report['cold_start_ms']:>10.1f} ms")
+    print(f"{'warm lookup':<18}{report['warm_lookup_us']:>10.2f} us per resource")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
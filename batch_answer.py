@@ -0,0 +1,364 @@
+"""
+Headless batch answering: a JSONL file of questions in, a JSONL file of answers out.
+
+    python batch_answer.py eval/router_eval.jsonl --output answers.jsonl
+    python batch_answer.py faq.jsonl --output faq_answers.jsonl --llm-concurrency 16 --db-concurrency 4
+    python batch_answer.py faq.jsonl --output faq_answers.jsonl --summary-output summary.json
+
+Each input line needs a "query"; an "id" is passed through (default: the line
+number). Questions take the same routing, text-to-SQL and semantic steps as
+the app (rag_pipeline), with a few changes for volume:
+
+- the local router decides what it can; the remaining questions are
+  classified BATCH_CLASSIFY_SIZE at a time, one LLM call per batch
+- identical questions in flight at the same time, and identical generated SQL
+  (compared after canonicalization), are computed once and shared
+- LLM calls and SQL execution have separate concurrency limits. A limit halves
+  when a call is rate limited (or the connection pool is exhausted) and grows
+  back by one after a run of successes
+
+Answers are written to --output as they complete, so the file is not in input
+order. A throughput summary is printed at the end.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import exc as sa_exc
+
+import pipeline_tracing as tracing
+from prompt_builder import get_prompt_builder
+from embedding_providers import is_rate_limit_error
+from sql_cache import canonicalize_sql
+from rag_pipeline import (
+    classify_query_batch, generate_sql, query_postgres, retrieve_documents, build_semantic_prompt, predict,
+)
+from config import (
+    BATCH_LLM_CONCURRENCY, BATCH_DB_CONCURRENCY, BATCH_CLASSIFY_SIZE, BATCH_MAX_RETRIES,
+)
+
+POOL_ERROR_MARKERS = ("too many connections", "remaining connection slots")
+
+
+def is_pool_error(exc):
+    """Connection pool exhausted or the server refusing more connections: back off instead of failing."""
+    if isinstance(exc, sa_exc.TimeoutError):
+        return True
+    return isinstance(exc, sa_exc.OperationalError) and any(m in str(exc).lower() for m in POOL_ERROR_MARKERS)
+
+
+# --- Concurrency ---
+class AdaptiveLimiter:
+    """
+    Concurrency limit between `minimum` and `maximum` (additive increase,
+    multiplicative decrease). A call failing with `is_retryable(exc)` halves the
+    limit and is retried after an exponential backoff with jitter; `limit`
+    consecutive successes raise it by one.
+    """
+
+    def __init__(self, name, maximum, is_retryable, minimum=1, max_retries=6, base_delay=1.0):
+        self.name = name
+        self.maximum = max(1, maximum)
+        self.minimum = min(minimum, self.maximum)
+        self.limit = self.maximum
+        self.is_retryable = is_retryable
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "peak_active": 0, "lowest_limit": self.limit}
+
+    def _acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+            self.stats["peak_active"] = max(self.stats["peak_active"], self._active)
+
+    def _release(self, throttled):
+        with self._cond:
+            self._active -= 1
+            self.stats["calls"] += 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+                self.stats["throttled"] += 1
+                self.stats["lowest_limit"] = min(self.stats["lowest_limit"], self.limit)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def call(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                result = fn(*args)
+            except Exception as exc:
+                throttled = self.is_retryable(exc)
+                self._release(throttled)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                with self._cond:
+                    self.stats["retries"] += 1
+                time.sleep(self.base_delay * 2 ** attempt * (1 + random.random()))
+                continue
+            self._release(False)
+            return result
+
+    def summary(self):
+        with self._cond:
+            return {"limit": self.limit, "max": self.maximum, **self.stats}
+
+
+class InFlight:
+    """
+    Runs `fn` once per key among concurrent callers; later callers with the same
+    key wait for that run and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.coalesced = 0
+
+    def run(self, key, fn):
+        """Returns (result, shared), where `shared` is True if another caller computed it."""
+        with self._lock:
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = self._pending[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+
+def question_key(query):
+    return " ".join(query.lower().split())
+
+
+# --- Batch Answering ---
+class BatchAnswerer:
+    """Answers many questions with the rag_pipeline steps, sharing limits and in-flight work between them."""
+
+    def __init__(self, llm, engine, faiss_index, router=None, prompt_builder=None,
+                 llm_concurrency=BATCH_LLM_CONCURRENCY, db_concurrency=BATCH_DB_CONCURRENCY,
+                 classify_batch_size=BATCH_CLASSIFY_SIZE, max_retries=BATCH_MAX_RETRIES, max_rows=50):
+        self.llm = llm
+        self.engine = engine
+        self.faiss_index = faiss_index
+        self.router = router
+        self.prompt_builder = prompt_builder or get_prompt_builder(engine)
+        self.classify_batch_size = max(1, classify_batch_size)
+        self.max_rows = max_rows
+        self.llm_limiter = AdaptiveLimiter("llm", llm_concurrency, is_rate_limit_error, max_retries=max_retries)
+        self.db_limiter = AdaptiveLimiter("db", db_concurrency, is_pool_error, max_retries=max_retries)
+        self.questions = InFlight()
+        self.sql = InFlight()
+        self._lock = threading.Lock()
+        self.classification = {"local": 0, "llm": 0, "llm_calls": 0}
+
+    # --- Routing ---
+    def classify(self, queries):
+        """Labels for `queries`: confident local decisions as-is, the rest in one batched LLM call."""
+        labels, unsure = [None] * len(queries), []
+        for i, query in enumerate(queries):
+            decision = self.router.classify(query) if self.router is not None else None
+            if decision is not None and decision.confidence >= self.router.confidence_threshold:
+                labels[i] = decision.label
+            else:
+                unsure.append(i)
+        if unsure:
+            batch = self.llm_limiter.call(classify_query_batch, [queries[i] for i in unsure], self.llm,
+                                          self.prompt_builder)
+            for i, label in zip(unsure, batch):
+                labels[i] = label
+        with self._lock:
+            self.classification["local"] += len(queries) - len(unsure)
+            self.classification["llm"] += len(unsure)
+            self.classification["llm_calls"] += 1 if unsure else 0
+        return labels
+
+    # --- Branches ---
+    def _run_sql(self, sql):
+        try:
+            key = canonicalize_sql(sql)
+        except Exception:
+            key = sql
+        return self.sql.run(key, lambda: self.db_limiter.call(query_postgres, sql, self.engine))
+
+    def _structured(self, query):
+        sql = self.llm_limiter.call(generate_sql, query, self.llm, self.prompt_builder)
+        try:
+            result, shared = self._run_sql(sql)
+        except Exception as e:
+            # Same text the app shows for a failing generated query
+            return {"sql": sql, "error": f"SQL Error: {e}\nGenerated SQL: {sql}"}
+        rows = json.loads(result.head(self.max_rows).to_json(orient="records", date_format="iso"))
+        return {
+            "sql": result.sql, "columns": list(result.columns), "rows": rows, "row_count": len(result),
+            "truncated": result.truncated, "total_rows": result.total_rows, "sql_shared": shared,
+        }
+
+    def _semantic(self, query):
+        # Embedding the question may hit the same API quota as the LLM
+        docs = self.llm_limiter.call(retrieve_documents, query, self.faiss_index)
+        answer = self.llm_limiter.call(predict, self.llm, build_semantic_prompt(query, docs), "answer")
+        return {"answer": answer, "titles": [d.metadata.get("title") for d in docs]}
+
+    def answer(self, item, label):
+        query = item["query"]
+        record = {"id": item["id"], "query": query, "route": label}
+        start = time.perf_counter()
+        with tracing.trace("batch_answer", query=query):
+            tracing.annotate(route=label)
+            try:
+                branch = self._structured if label == "structured" else self._semantic
+                result, shared = self.questions.run((question_key(query), label), lambda: branch(query))
+                record.update(result, shared=shared)
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return record
+
+    # --- Driver ---
+    def run(self, items, out, workers=None):
+        """
+        Answer `items` ({"id", "query"} dicts), writing one JSON line per answer
+        to the file object `out` as each completes. Returns the summary dict.
+        """
+        workers = workers or 2 * (self.llm_limiter.maximum + self.db_limiter.maximum)
+        write_lock = threading.Lock()
+        records = []
+
+        def answer_and_write(item, label):
+            record = self.answer(item, label)
+            with write_lock:
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+                records.append(record)
+
+        def classify_chunk(chunk):
+            try:
+                return self.classify([item["query"] for item in chunk]), None
+            except Exception as e:
+                return [None] * len(chunk), f"classification failed: {type(e).__name__}: {e}"
+
+        start = time.perf_counter()
+        chunks = [items[i:i + self.classify_batch_size] for i in range(0, len(items), self.classify_batch_size)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            classified = [(chunk, pool.submit(classify_chunk, chunk)) for chunk in chunks]
+            answers = []
+            # Chunks are handed on in input order; answering starts as soon as each chunk is classified
+            for chunk, future in classified:
+                labels, error = future.result()
+                for item, label in zip(chunk, labels):
+                    if error is None:
+                        answers.append(pool.submit(answer_and_write, item, label))
+                    else:
+                        with write_lock:
+                            record = {"id": item["id"], "query": item["query"], "route": None, "error": error}
+                            out.write(json.dumps(record) + "\n")
+                            records.append(record)
+            for future in answers:
+                future.result()
+        return self.summary(records, time.perf_counter() - start)
+
+    def summary(self, records, wall_s):
+        answered = [r for r in records if "error" not in r]
+        latencies = np.array([r["elapsed_ms"] for r in answered]) if answered else None
+        routes = {}
+        for r in records:
+            routes[r["route"] or "unrouted"] = routes.get(r["route"] or "unrouted", 0) + 1
+        return {
+            "questions": len(records),
+            "answered": len(answered),
+            "errors": len(records) - len(answered),
+            "wall_s": round(wall_s, 2),
+            "throughput_qps": round(len(answered) / wall_s, 2) if wall_s else 0.0,
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 1) if latencies is not None else None,
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)), 1) if latencies is not None else None,
+            "routes": routes,
+            "classification": dict(self.classification),
+            "coalesced": {"questions": self.questions.coalesced, "sql": self.sql.coalesced},
+            "llm": self.llm_limiter.summary(),
+            "db": self.db_limiter.summary(),
+        }
+
+
+def read_questions(path):
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                row = json.loads(line)
+                items.append({**row, "id": row.get("id", line_number)})
+    return items
+
+
+def print_summary(summary):
+    print(f"\n{summary['answered']:,}/{summary['questions']:,} answered ({summary['errors']} errors) "
+          f"in {summary['wall_s']}s, {summary['throughput_qps']} questions/s, "
+          f"p50 {summary['latency_p50_ms']} ms, p95 {summary['latency_p95_ms']} ms")
+    print(f"routes {summary['routes']}; classified locally {summary['classification']['local']}, "
+          f"by LLM {summary['classification']['llm']} in {summary['classification']['llm_calls']} calls")
+    print(f"coalesced: {summary['coalesced']['questions']} questions, {summary['coalesced']['sql']} SQL queries")
+    for name in ("llm", "db"):
+        s = summary[name]
+        print(f"{name}: {s['calls']} calls, peak {s['peak_active']} concurrent (max {s['max']}), "
+              f"{s['throttled']} throttled, lowest limit {s['lowest_limit']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL file with one {\"query\": ...} per line")
+    parser.add_argument("--output", required=True, help="JSONL file the answers are written to")
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--db-concurrency", type=int, default=BATCH_DB_CONCURRENCY)
+    parser.add_argument("--classify-batch-size", type=int, default=BATCH_CLASSIFY_SIZE)
+    parser.add_argument("--max-rows", type=int, default=50, help="Result rows written per structured answer")
+    parser.add_argument("--no-router", action="store_true", help="Classify every question with the LLM")
+    parser.add_argument("--summary-output", default=None)
+    args = parser.parse_args()
+
+    from app_bootstrap import create_app_resources
+    resources = create_app_resources()
+    items = read_questions(args.questions)
+    answerer = BatchAnswerer(
+        resources.get("llm"), resources.get("engine"), resources.get("vector_index"),
+        router=None if args.no_router else resources.get("query_router"),
+        prompt_builder=resources.get("prompt_builder"),
+        llm_concurrency=args.llm_concurrency, db_concurrency=args.db_concurrency,
+        classify_batch_size=args.classify_batch_size, max_rows=args.max_rows,
+    )
+    print(f"Answering {len(items):,} questions from {args.questions}")
+    with open(args.output, "w", encoding="utf-8") as out:
+        summary = answerer.run(items, out)
+    print_summary(summary)
+    if args.summary_output:
+        with open(args.summary_output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
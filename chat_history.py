@@ -0,0 +1,206 @@
+"""
+Memory-bounded chat history for working_app_v3.py.
+
+Each session keeps a ChatHistory in st.session_state. Text answers are stored
+as they are. Table answers keep only their summary and the first
+CHAT_HISTORY_PREVIEW_ROWS rows; larger results are written to a zstd Parquet
+file with one row group per result page, so showing a page reads just that
+row group back.
+
+Old entries are evicted at two levels:
+- per session (CHAT_HISTORY_MAX_MESSAGES, CHAT_HISTORY_SESSION_MAX_MB of
+  session state plus the session's files): the oldest messages are dropped
+- per process (CHAT_HISTORY_GLOBAL_MAX_MB of files across all sessions): the
+  least recently shown files are deleted and their entries keep the preview
+"""
+import os
+import uuid
+import atexit
+import shutil
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sql_executor import PagedResult
+
+
+class StoredResult:
+    """Preview and summary of one table answer, plus the Parquet file with every row (if it was spilled)."""
+
+    def __init__(self, key, preview, row_count, summary, sql=None, path=None, file_bytes=0):
+        self.key = key
+        self.preview = preview
+        self.columns = list(preview.columns)
+        self.row_count = row_count
+        self.summary = summary
+        self.sql = sql
+        self.path = path
+        self.file_bytes = file_bytes
+        self.preview_bytes = int(preview.memory_usage(deep=True).sum())
+
+    @property
+    def complete(self):
+        """The preview holds every row."""
+        return self.row_count <= len(self.preview)
+
+    @property
+    def nbytes(self):
+        return self.preview_bytes + self.file_bytes
+
+    def __repr__(self):
+        where = "on disk" if self.path else "in memory" if self.complete else "preview only"
+        return f"<StoredResult {self.summary}, {where}>"
+
+
+class ChatResultStore:
+    """
+    Process-wide Parquet spill directory shared by every session's ChatHistory.
+
+    Files go to a subdirectory of `spill_dir` owned by this process, so several
+    app processes can share `spill_dir`; the subdirectory is removed at exit.
+    """
+
+    def __init__(self, spill_dir, max_bytes=512 * 1024 * 1024, preview_rows=20, page_rows=200):
+        self.spill_dir = os.path.join(spill_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.max_bytes = max_bytes
+        self.preview_rows = preview_rows
+        self.page_rows = page_rows
+        self._files = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"spilled": 0, "evictions": 0, "page_reads": 0}
+        os.makedirs(self.spill_dir, exist_ok=True)
+        atexit.register(shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def put(self, answer):
+        """StoredResult for a PagedResult or DataFrame answer; spills it to disk if it is larger than the preview."""
+        if isinstance(answer, PagedResult):
+            frame, summary, sql = answer.to_frame(), answer.summary(), answer.sql
+        else:
+            frame, summary, sql = answer, f"{len(answer):,} rows", None
+        # A copy, so the preview does not keep the full frame alive
+        preview = frame.head(self.preview_rows).reset_index(drop=True).copy()
+        result = StoredResult(uuid.uuid4().hex, preview, len(frame), summary, sql)
+        if result.complete:
+            return result
+        path = os.path.join(self.spill_dir, f"{result.key}.parquet")
+        try:
+            table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+            pq.write_table(table, path, compression="zstd", row_group_size=self.page_rows)
+        except (pa.ArrowException, OSError) as e:
+            print(f"Chat result not spilled, keeping the preview only: {e}")
+            return result
+        result.path, result.file_bytes = path, os.path.getsize(path)
+        with self._lock:
+            self._files[result.key] = result
+            self._bytes += result.file_bytes
+            self.stats["spilled"] += 1
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                _, old = self._files.popitem(last=False)
+                self._remove(old)
+                self.stats["evictions"] += 1
+        return result
+
+    def _remove(self, result):
+        self._bytes -= result.file_bytes
+        path, result.path, result.file_bytes = result.path, None, 0
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def discard(self, result):
+        with self._lock:
+            if self._files.pop(result.key, None) is not None:
+                self._remove(result)
+
+    def page_count(self, result):
+        if result.path is None:
+            return 1
+        return max(1, -(-result.row_count // self.page_rows))
+
+    def read_page(self, result, number):
+        """Rows of page `number` (one Parquet row group), or the preview once the file is gone."""
+        with self._lock:
+            if result.key in self._files:
+                self._files.move_to_end(result.key)
+            path = result.path
+        if path is None:
+            return result.preview
+        try:
+            frame = pq.ParquetFile(path).read_row_group(number).to_pandas()
+        except (OSError, pa.ArrowException):
+            self.discard(result)
+            return result.preview
+        with self._lock:
+            self.stats["page_reads"] += 1
+        return frame
+
+    def summary(self):
+        with self._lock:
+            return {**self.stats, "files": len(self._files), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class ChatHistory:
+    """
+    The chat of one session: a list of {"id", "user", "assistant", "timing"}
+    entries where "assistant" is the answer text or a StoredResult.
+    """
+
+    def __init__(self, store, max_messages=100, max_bytes=16 * 1024 * 1024):
+        self.store = store
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.evicted = 0
+        self._next_id = 0
+
+    def append(self, user, assistant, timing=None):
+        if isinstance(assistant, (PagedResult, pd.DataFrame)):
+            assistant = self.store.put(assistant)
+        self.entries.append({"id": self._next_id, "user": user, "assistant": assistant, "timing": timing or {}})
+        self._next_id += 1
+        # The newest message always stays, even on its own over the cap
+        while len(self.entries) > 1 and (len(self.entries) > self.max_messages or self.nbytes() > self.max_bytes):
+            self._drop(self.entries.pop(0))
+            self.evicted += 1
+
+    def _drop(self, entry):
+        if isinstance(entry["assistant"], StoredResult):
+            self.store.discard(entry["assistant"])
+
+    @staticmethod
+    def entry_bytes(entry):
+        answer = entry["assistant"]
+        size = answer.nbytes if isinstance(answer, StoredResult) else len(str(answer))
+        return size + len(entry["user"])
+
+    def nbytes(self):
+        return sum(self.entry_bytes(e) for e in self.entries)
+
+    def clear(self):
+        for entry in self.entries:
+            self._drop(entry)
+        self.entries = []
+        # "evicted" describes the current conversation, like the other summary fields
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def summary(self):
+        return {
+            "messages": len(self.entries),
+            "evicted": self.evicted,
+            "bytes": self.nbytes(),
+            "file_bytes": sum(e["assistant"].file_bytes for e in self.entries if isinstance(e["assistant"], StoredResult)),
+        }
@@ -0,0 +1,128 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Database Setup ---
+# Defaults match the local development database used by the notebooks
+openai_api_key = os.getenv("OPENAI_API_KEY", "api key")
+db_user = os.getenv("DB_USER", "postgres")
+db_password = os.getenv("DB_PASSWORD", "12345678")
+db_host = os.getenv("DB_HOST", "localhost")
+db_port = os.getenv("DB_PORT", "5432")
+db_name = os.getenv("DB_NAME", "mflix")
+
+DB_URI = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+
+# --- Models & Index ---
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gpt-3.5-turbo")
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_movie_index")
+
+# --- Answer Cache ---
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.pkl")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.97"))
+
+# --- Query Router ---
+# Below this confidence the local router defers to the LLM classifier
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.6"))
+
+# --- Prompt Builder ---
+# Upper bound for the schema section of the text-to-SQL prompt
+PROMPT_SCHEMA_TOKEN_BUDGET = int(os.getenv("PROMPT_SCHEMA_TOKEN_BUDGET", "600"))
+
+# --- Speculative Execution ---
+# Run classification, FAISS retrieval and SQL generation concurrently when the router is unsure
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "4"))
+SPECULATE_SQL = os.getenv("SPECULATE_SQL", "true").lower() == "true"
+
+# --- Streaming ---
+# Render semantic answers token by token instead of behind a spinner (combines with SPECULATION_ENABLED)
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+
+# --- SQL Execution ---
+# Bounds for LLM-generated SQL: rows kept, Postgres statement_timeout, server-side fetch size
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "5000"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "15000"))
+SQL_FETCH_CHUNK_ROWS = int(os.getenv("SQL_FETCH_CHUNK_ROWS", "1000"))
+SQL_COUNT_TRUNCATED = os.getenv("SQL_COUNT_TRUNCATED", "true").lower() == "true"
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "200"))
+
+# --- SQL Result Cache ---
+# Keyed on canonicalized generated SQL; invalidated when a referenced table changes
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_MAX_MB = int(os.getenv("SQL_CACHE_MAX_MB", "256"))
+# Also write entries as Parquet here so they survive a restart (empty = memory only)
+SQL_CACHE_DIR = os.getenv("SQL_CACHE_DIR", "")
+# Oldest spilled files are deleted beyond this
+SQL_CACHE_DISK_MAX_MB = int(os.getenv("SQL_CACHE_DISK_MAX_MB", "1024"))
+SQL_CACHE_VERSION_REFRESH_SECONDS = int(os.getenv("SQL_CACHE_VERSION_REFRESH_SECONDS", "30"))
+
+# --- FAISS Index Build ---
+# Embedding requests per batch and batches in flight when (re)building faiss_movie_index
+FAISS_BUILD_BATCH_SIZE = int(os.getenv("FAISS_BUILD_BATCH_SIZE", "256"))
+FAISS_BUILD_WORKERS = int(os.getenv("FAISS_BUILD_WORKERS", "4"))
+FAISS_BUILD_MAX_RETRIES = int(os.getenv("FAISS_BUILD_MAX_RETRIES", "6"))
+
+# --- Vector Index ---
+# Index structure for column-built indexes: flat (exact), ivf_flat, ivf_pq or hnsw.
+# 0 for NLIST / PQ_M picks a size from the number of vectors / dimensions.
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))
+VECTOR_INDEX_PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", "0"))
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+# Query-time recall/speed knobs (IVF lists probed, HNSW candidate list size)
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64"))
+# Memory-map the index file instead of reading it into RAM
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "true").lower() == "true"
+
+# --- Hybrid Retrieval ---
+# Pull year/genre/language/country/rating filters out of semantic questions and search only matching movies
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+
+# --- Embeddings ---
+# "openai" (network) or "local" (sentence-transformers on CPU). The index must be built with the same model.
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+# Empty picks the provider default: text-embedding-ada-002 / sentence-transformers/all-MiniLM-L6-v2
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_LOCAL_BACKEND = os.getenv("EMBEDDING_LOCAL_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Query embeddings are cached in memory and (if a path is set) on disk
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "query_embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+
+# --- Tracing ---
+# Per-stage wall time / token / row counts for every question. Off by default; near-zero cost when off.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# One JSON object per question (empty = only the "mflix.trace" logger)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+# Prometheus text-format histograms, rewritten after each question (e.g. for the node_exporter textfile collector)
+TRACE_METRICS_PATH = os.getenv("TRACE_METRICS_PATH", "")
+# Stage breakdown of the last question in the sidebar
+TRACE_DEBUG_PANEL = os.getenv("TRACE_DEBUG_PANEL", "true").lower() == "true"
+
+# --- App Startup ---
+# Load the vector index, filter arrays, schema and router vocabulary in a background thread at startup
+APP_PREWARM = os.getenv("APP_PREWARM", "true").lower() == "true"
+
+# --- Batch Answering ---
+# Upper bounds for batch_answer.py; both limits halve on rate-limit / pool errors and creep back up after successes
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+# Questions per classifier call for those the local router is unsure about
+BATCH_CLASSIFY_SIZE = int(os.getenv("BATCH_CLASSIFY_SIZE", "20"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "6"))
+
+# --- Chat History ---
+# Table answers keep this many rows in session state; the rest is spilled to Parquet under CHAT_HISTORY_SPILL_DIR
+CHAT_HISTORY_PREVIEW_ROWS = int(os.getenv("CHAT_HISTORY_PREVIEW_ROWS", "20"))
+CHAT_HISTORY_SPILL_DIR = os.getenv("CHAT_HISTORY_SPILL_DIR", "chat_history_results")
+# Per session: the oldest messages are dropped beyond these
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "100"))
+CHAT_HISTORY_SESSION_MAX_MB = int(os.getenv("CHAT_HISTORY_SESSION_MAX_MB", "16"))
+# Per process: spilled results of all sessions; the least recently shown are deleted (their preview stays)
+CHAT_HISTORY_GLOBAL_MAX_MB = int(os.getenv("CHAT_HISTORY_GLOBAL_MAX_MB", "512"))
@@ -0,0 +1,230 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingModelMismatch(ValueError):
+    """Raised when an index was built with a different embedding model than the one configured."""
+
+
+def is_rate_limit_error(exc):
+    """OpenAI (or other HTTP API) 429, whichever client raised it; callers back off and retry."""
+    return "RateLimit" in type(exc).__name__ or getattr(exc, "status_code", None) == 429
+
+
+# --- Providers ---
+# All providers are LangChain Embeddings, so they also work with the LangChain FAISS store.
+# `model` identifies the vector space and is recorded in index metadata.
+class OpenAIEmbeddingProvider(Embeddings):
+    """OpenAI embeddings over the network (the original setup)."""
+
+    provider = "openai"
+
+    def __init__(self, api_key, model="text-embedding-ada-002"):
+        self.model = model
+        self._api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Deferred: importing langchain_openai pulls in the OpenAI SDK
+        with self._lock:
+            if self._client is None:
+                from langchain_openai import OpenAIEmbeddings
+                self._client = OpenAIEmbeddings(openai_api_key=self._api_key, model=self.model)
+            return self._client
+
+    def embed_documents(self, texts):
+        return self.client.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.client.embed_query(text)
+
+
+class LocalEmbeddingProvider(Embeddings):
+    """
+    CPU embeddings from a small sentence-transformers model, with no network call on the query path.
+
+    `backend="onnx"` runs the ONNX export through onnxruntime (sentence-transformers >= 3.2).
+    The model is shared and its tokenizer is not thread-safe, so each call runs one
+    `encode` (which batches internally and uses every core in torch/onnxruntime)
+    under a lock instead of splitting the work across threads.
+    """
+
+    provider = "local"
+
+    def __init__(self, model="sentence-transformers/all-MiniLM-L6-v2", backend="torch", batch_size=64,
+                 normalize=True):
+        self.model = model
+        self.backend = backend
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self._encoder = None
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        with self._lock:
+            if self._encoder is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError(
+                        "EMBEDDING_PROVIDER=local needs sentence-transformers "
+                        "(pip install sentence-transformers, plus onnxruntime for the onnx backend)"
+                    ) from e
+                self._encoder = SentenceTransformer(self.model, device="cpu", backend=self.backend)
+            return self._encoder
+
+    @property
+    def dim(self):
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def _encode(self, texts):
+        encoder = self.encoder
+        with self._encode_lock:
+            return encoder.encode(texts, batch_size=self.batch_size, normalize_embeddings=self.normalize,
+                                  convert_to_numpy=True, show_progress_bar=False)
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts)).tolist() if texts else []
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+
+# --- Query Embedding Cache ---
+class CachedEmbeddings(Embeddings):
+    """
+    `provider` with an in-process LRU plus an optional on-disk (SQLite) cache of query embeddings.
+
+    Only `embed_query` is cached: questions repeat, documents are embedded once
+    at index build time. Keys include the model name, so switching providers
+    never returns a vector from another vector space.
+    """
+
+    def __init__(self, provider, max_entries=10000, cache_path=None):
+        self.provider = provider
+        self.max_entries = max_entries
+        self.cache_path = cache_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "embed_ms": 0.0}
+        if cache_path:
+            with self._connect() as conn, conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS query_embeddings "
+                             "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)")
+
+    @property
+    def model(self):
+        return self.provider.model
+
+    def __getattr__(self, name):
+        # provider-specific attributes (dim, backend, ...) pass through
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across Streamlit's threads.
+        # sqlite3's own context manager only commits, so closing() is what releases the file handle.
+        return closing(sqlite3.connect(self.cache_path, timeout=5))
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.provider.model}\0{text.strip()}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        return self.provider.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = self._key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return vector.tolist()
+
+        if self.cache_path:
+            with self._connect() as conn:
+                row = conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                self.stats["disk_hits"] += 1
+                return vector.tolist()
+
+        start = time.perf_counter()
+        vector = np.asarray(self.provider.embed_query(text), dtype=np.float32)
+        self.stats["embed_ms"] += (time.perf_counter() - start) * 1000
+        self.stats["misses"] += 1
+        self._remember(key, vector)
+        if self.cache_path:
+            with self._connect() as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                             (key, vector.tobytes(), time.time()))
+        return vector.tolist()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def summary(self):
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "avg_embed_ms": round(self.stats["embed_ms"] / self.stats["misses"], 1) if self.stats["misses"] else 0.0,
+        }
+
+
+# --- Factory ---
+def make_embedding_provider(name, model=None, api_key=None, **kwargs):
+    if name == "openai":
+        return OpenAIEmbeddingProvider(api_key, model=model or "text-embedding-ada-002")
+    if name == "local":
+        return LocalEmbeddingProvider(model=model or "sentence-transformers/all-MiniLM-L6-v2", **kwargs)
+    raise ValueError(f"unknown embedding provider '{name}', expected 'openai' or 'local'")
+
+
+def get_embedding_provider(cached=True):
+    """The provider configured in config.py, wrapped in the query-embedding cache unless `cached=False`."""
+    from config import (
+        openai_api_key, EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_LOCAL_BACKEND, EMBEDDING_BATCH_SIZE,
+        EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES,
+    )
+    local_options = {"backend": EMBEDDING_LOCAL_BACKEND, "batch_size": EMBEDDING_BATCH_SIZE}
+    provider = make_embedding_provider(EMBEDDING_PROVIDER, EMBEDDING_MODEL or None, api_key=openai_api_key,
+                                       **(local_options if EMBEDDING_PROVIDER == "local" else {}))
+    if not cached:
+        return provider
+    return CachedEmbeddings(provider, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, cache_path=EMBEDDING_CACHE_PATH or None)
+
+
+def model_name(embedding_model):
+    """Name of the vector space an embeddings object produces (works for raw LangChain objects too)."""
+    return getattr(embedding_model, "model", None) or type(embedding_model).__name__
+
+
+def check_index_model(index_model, embedding_model, index_path):
+    """Refuse to search an index with query vectors from a different model."""
+    expected = model_name(embedding_model)
+    if index_model and index_model != expected:
+        raise EmbeddingModelMismatch(
+            f"{index_path} was built with '{index_model}' embeddings but the configured provider uses "
+            f"'{expected}'. Rebuild the index (python faiss_index_builder.py) or set EMBEDDING_PROVIDER/"
+            f"EMBEDDING_MODEL to match."
+        )
@@ -0,0 +1,152 @@
+"""
+Compare pre-filtered hybrid retrieval with plain vector search on a labeled set.
+
+    python evaluate_hybrid.py                 # filter extraction accuracy only (offline)
+    python evaluate_hybrid.py --with-index    # + hit quality / latency (needs Postgres, the column-built index, the embedding provider)
+
+Retrieval modes, all returning k hits:
+  plain        similarity_search over every movie
+  post_filter  plain search for k * --overfetch hits, then drop the ones that miss the filters
+  pre_filter   the filter row mask is applied inside FAISS (HybridRetriever)
+
+`constraint_precision` is the share of returned hits that satisfy the filters
+extracted from the question. It is only measured on queries that have filters.
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from hybrid_retrieval import FilterExtractor, MovieFilterIndex
+
+
+FILTER_FIELDS = ("year_min", "year_max", "genres", "languages", "countries", "min_rating")
+
+
+def load_eval_set(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normalized(filters):
+    out = {}
+    for field in FILTER_FIELDS:
+        value = filters.get(field)
+        if isinstance(value, (list, tuple)):
+            value = sorted(value) or None
+        out[field] = value
+    return out
+
+
+def evaluate_extraction(extractor, examples):
+    rows = []
+    for ex in examples:
+        start = time.perf_counter()
+        got = _normalized(extractor.extract(ex["query"])._asdict())
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        expected = _normalized(ex.get("filters", {}))
+        rows.append({"query": ex["query"], "expected": expected, "extracted": got,
+                     "correct": got == expected, "elapsed_ms": elapsed_ms})
+    return rows
+
+
+def _search(vector_index, vector, k, mask=None):
+    start = time.perf_counter()
+    _, rows = vector_index.search_vectors(vector[None, :], k, mask=mask)
+    return [int(r) for r in rows[0] if r >= 0], (time.perf_counter() - start) * 1000
+
+
+def compare_retrieval(vector_index, filter_index, extractor, examples, k=5, overfetch=10):
+    results = {"plain": [], "post_filter": [], "pre_filter": []}
+    for ex in examples:
+        filters = extractor.extract(ex["query"])
+        mask = filter_index.candidate_mask(filters)
+        if mask is None or not mask.any():
+            continue
+        vector = np.asarray(vector_index.embed_query(ex["query"]), dtype=np.float32)
+
+        plain, plain_ms = _search(vector_index, vector, k)
+        wide, wide_ms = _search(vector_index, vector, k * overfetch)
+        post = [r for r in wide if mask[r]][:k]
+        pre, pre_ms = _search(vector_index, vector, k, mask=mask)
+
+        for mode, hits, elapsed_ms in (("plain", plain, plain_ms), ("post_filter", post, wide_ms), ("pre_filter", pre, pre_ms)):
+            results[mode].append({
+                "query": ex["query"], "filters": filters.describe(), "candidates": int(mask.sum()),
+                "hits": len(hits), "matching": int(sum(mask[r] for r in hits)),
+                "titles": [vector_index.title(r) for r in hits], "elapsed_ms": elapsed_ms,
+            })
+    return results
+
+
+def summarize(mode, rows, k):
+    latencies = np.array([r["elapsed_ms"] for r in rows])
+    returned = sum(r["hits"] for r in rows)
+    return {
+        "mode": mode,
+        "queries": len(rows),
+        "constraint_precision": round(sum(r["matching"] for r in rows) / returned, 3) if returned else 0.0,
+        "full_k_rate": round(sum(r["hits"] == k for r in rows) / len(rows), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="eval/hybrid_eval.jsonl")
+    parser.add_argument("--with-index", action="store_true")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--overfetch", type=int, default=10, help="post_filter fetches k * overfetch hits")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    examples = load_eval_set(args.dataset)
+    report = {}
+
+    extractor = FilterExtractor()
+    filter_index = vector_index = None
+    if args.with_index:
+        from sqlalchemy import create_engine
+        from embedding_providers import get_embedding_provider
+        from vector_index import is_vector_index_dir, load_vector_index
+        from config import DB_URI, FAISS_INDEX_PATH, VECTOR_INDEX_NPROBE, VECTOR_INDEX_EF_SEARCH
+
+        if not is_vector_index_dir(FAISS_INDEX_PATH):
+            raise SystemExit(f"{FAISS_INDEX_PATH} is not a column-built index; run faiss_index_builder.py first")
+        engine = create_engine(DB_URI)
+        vector_index = load_vector_index(FAISS_INDEX_PATH, get_embedding_provider(), engine=engine,
+                                         nprobe=VECTOR_INDEX_NPROBE, ef_search=VECTOR_INDEX_EF_SEARCH)
+        start = time.perf_counter()
+        filter_index = MovieFilterIndex.from_engine(engine, vector_index.movie_ids())
+        print(f"Filter index for {filter_index.n_rows:,} rows built in {time.perf_counter() - start:.1f}s\n")
+        extractor = filter_index.extractor()
+
+    extraction = evaluate_extraction(extractor, examples)
+    correct = sum(r["correct"] for r in extraction)
+    latencies = [r["elapsed_ms"] for r in extraction]
+    print(f"Filter extraction: {correct}/{len(extraction)} exact, p50 {np.percentile(latencies, 50):.3f} ms")
+    for r in extraction:
+        if not r["correct"]:
+            got = {k: v for k, v in r["extracted"].items() if v}
+            want = {k: v for k, v in r["expected"].items() if v}
+            print(f"  {r['query']}\n    expected {want}\n    got      {got}")
+    report["extraction"] = extraction
+
+    if args.with_index:
+        results = compare_retrieval(vector_index, filter_index, extractor, examples, args.k, args.overfetch)
+        summary = [summarize(mode, rows, args.k) for mode, rows in results.items() if rows]
+        print(f"\n{'mode':<14}{'queries':>9}{'precision':>11}{'full k':>8}{'p50 ms':>10}{'p95 ms':>10}")
+        for s in summary:
+            print(f"{s['mode']:<14}{s['queries']:>9}{s['constraint_precision']:>11.3f}{s['full_k_rate']:>8.2f}"
+                  f"{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}")
+        report.update(summary=summary, results=results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compare the local query router against the LLM classifier on a labeled set.
+
+The keyword rules were written while looking at eval/router_eval.jsonl, so its
+accuracy is in-sample. eval/router_holdout.jsonl holds questions that were not
+used for the rules; report and compare on that split.
+
+    python evaluate_router.py                      # local router only, keyword rules
+    python evaluate_router.py --vocabulary-from-db # add entity names from Postgres
+    python evaluate_router.py --with-llm           # also time classify_query_type (needs Postgres, costs OpenAI calls)
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from config import ROUTER_CONFIDENCE_THRESHOLD
+from query_router import QueryRouter, load_router_vocabulary
+
+
+def load_eval_set(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(name, split, rows, threshold):
+    latencies = np.array([r["elapsed_ms"] for r in rows])
+    correct = sum(r["predicted"] == r["label"] for r in rows)
+    return {
+        "classifier": name,
+        "split": split,
+        "n": len(rows),
+        "accuracy": round(correct / len(rows), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "llm_calls": sum(r.get("source") == "llm" for r in rows),
+        "below_threshold": sum(r.get("confidence", 1.0) < threshold for r in rows),
+    }
+
+
+def run_router(router, examples, llm_fallback=None):
+    rows = []
+    for ex in examples:
+        decision = router.route(ex["query"], llm_fallback=llm_fallback)
+        rows.append({**ex, "predicted": decision.label, "confidence": decision.confidence,
+                     "source": decision.source, "elapsed_ms": decision.elapsed_ms})
+    return rows
+
+
+def run_llm(classify_fn, examples):
+    rows = []
+    for ex in examples:
+        start = time.perf_counter()
+        predicted = classify_fn(ex["query"])
+        rows.append({**ex, "predicted": predicted, "source": "llm",
+                     "elapsed_ms": (time.perf_counter() - start) * 1000})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="eval/router_eval.jsonl", help="Set the rules were written against")
+    parser.add_argument("--holdout", default="eval/router_holdout.jsonl",
+                        help="Questions not used for the rules ('' to skip)")
+    parser.add_argument("--threshold", type=float, default=ROUTER_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--vocabulary-from-db", action="store_true")
+    parser.add_argument("--with-llm", action="store_true")
+    parser.add_argument("--output", default=None, help="Write the full report (summary + per-query rows) as JSON")
+    args = parser.parse_args()
+
+    splits = {"in-sample": load_eval_set(args.dataset)}
+    if args.holdout:
+        splits["held-out"] = load_eval_set(args.holdout)
+
+    engine = None
+    if args.vocabulary_from_db or args.with_llm:
+        from sqlalchemy import create_engine
+        from config import DB_URI
+        engine = create_engine(DB_URI)
+
+    vocabulary = load_router_vocabulary(engine) if args.vocabulary_from_db else None
+
+    classify_fn = None
+    if args.with_llm:
+        from langchain_openai import ChatOpenAI
+        from config import openai_api_key, LLM_MODEL_NAME
+        from rag_pipeline import classify_query_type
+        from prompt_builder import get_prompt_builder
+
+        llm = ChatOpenAI(temperature=0, model_name=LLM_MODEL_NAME, openai_api_key=openai_api_key)
+        prompt_builder = get_prompt_builder(engine)
+        classify_fn = lambda q: classify_query_type(q, llm, prompt_builder)
+
+    results = {}
+    for split, examples in splits.items():
+        router = QueryRouter(vocabulary=vocabulary, confidence_threshold=args.threshold)
+        results[split] = {"local_only": run_router(router, examples)}
+        if classify_fn is not None:
+            results[split]["llm"] = run_llm(classify_fn, examples)
+            hybrid_router = QueryRouter(vocabulary=vocabulary, confidence_threshold=args.threshold)
+            results[split]["local_with_llm_fallback"] = run_router(hybrid_router, examples, llm_fallback=classify_fn)
+
+    summary = [
+        summarize(name, split, rows, args.threshold)
+        for split, by_classifier in results.items() for name, rows in by_classifier.items()
+    ]
+
+    print(f"{'classifier':<26}{'split':<11}{'n':>5}{'accuracy':>10}{'p50 ms':>10}{'p95 ms':>10}{'llm calls':>11}{'low conf':>10}")
+    for s in summary:
+        print(f"{s['classifier']:<26}{s['split']:<11}{s['n']:>5}{s['accuracy']:>10.3f}{s['p50_ms']:>10.3f}"
+              f"{s['p95_ms']:>10.3f}{s['llm_calls']:>11}{s['below_threshold']:>10}")
+
+    for split, by_classifier in results.items():
+        misses = [r for r in by_classifier["local_only"] if r["predicted"] != r["label"]]
+        if misses:
+            print(f"\nLocal router misclassifications ({split}):")
+            for r in misses:
+                print(f"  [{r['label']} -> {r['predicted']} @ {r['confidence']:.2f}] {r['query']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
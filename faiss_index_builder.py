@@ -0,0 +1,412 @@
+"""
+Incremental, resumable build of the FAISS movie index read by working_app_v3.py.
+
+    python faiss_index_builder.py                          # stored plot_embedding vectors + embed the rest
+    python faiss_index_builder.py --source embed           # LangChain index, re-embed only new/changed movies
+    python faiss_index_builder.py --source embed --full    # ignore the existing index
+    EMBEDDING_PROVIDER=local python faiss_index_builder.py # index for the local embedding model
+    python faiss_index_builder.py --workers 8 --batch-size 128
+    python faiss_index_builder.py --index-type hnsw        # or ivf_flat / ivf_pq (see vector_index_benchmark.py)
+
+`--source column` (default) takes the precomputed movies.plot_embedding vectors
+as they are and only embeds movies that have none. It writes a raw FAISS index
+plus a compact id table (see vector_index.py) instead of a pickled docstore.
+The stored vectors are ada-002 embeddings, so with any other configured model
+(EMBEDDING_PROVIDER / EMBEDDING_MODEL) every movie is embedded instead.
+
+`--source embed` (alias: openai) embeds every movie as "<title>. <plot>" (as in the phase-2.2
+notebook) and stores it under its `_id` in a LangChain FAISS store.
+
+In both modes, content hashes tell the next run which embedded movies changed
+or disappeared. Finished embedding batches are checkpointed, so an interrupted
+run picks up where it stopped. The new index is written to a temporary
+directory and swapped in only when complete.
+"""
+import os
+import re
+import glob
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from embedding_providers import get_embedding_provider, is_rate_limit_error, model_name as embedding_model_name
+from vector_index import (
+    MovieVectorIndex, read_plot_embeddings, make_id_table, is_vector_index_dir, resolve_index_dir, CURRENT_FILE,
+    build_faiss_index, reconstruct_rows, INDEX_TYPES, SOURCE_STORED, SOURCE_EMBEDDED,
+)
+from config import (
+    DB_URI, FAISS_INDEX_PATH,
+    FAISS_BUILD_BATCH_SIZE, FAISS_BUILD_WORKERS, FAISS_BUILD_MAX_RETRIES,
+    VECTOR_INDEX_TYPE, VECTOR_INDEX_NLIST, VECTOR_INDEX_PQ_M, VECTOR_INDEX_HNSW_M,
+)
+
+MANIFEST_FILE = "manifest.json"
+MOVIES_QUERY = "SELECT _id, title, plot FROM movies WHERE plot IS NOT NULL"
+UNEMBEDDED_MOVIES_QUERY = MOVIES_QUERY + " AND plot_embedding IS NULL"
+# Model behind the embedded_movies vectors copied into movies.plot_embedding
+STORED_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+# --- Source Rows ---
+def movie_text(title, plot):
+    return f"{title}. {plot}"
+
+
+def content_hash(text_value):
+    return hashlib.sha1(text_value.encode("utf-8")).hexdigest()
+
+
+def load_movies(engine, query=MOVIES_QUERY, chunk_rows=5000):
+    """_id -> (text, title, hash) for every movie returned by `query`, read in chunks."""
+    movies = {}
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(text(query), conn, chunksize=chunk_rows):
+            ids = chunk["_id"].astype(str)
+            titles = chunk["title"].fillna("").astype(str)
+            texts = titles + ". " + chunk["plot"].astype(str)
+            for movie_id, title, body in zip(ids, titles, texts):
+                movies[movie_id] = (body, title, content_hash(body))
+    return movies
+
+
+# --- Manifest ---
+def read_manifest(index_path):
+    path = os.path.join(resolve_index_dir(index_path), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def plan_changes(movies, manifest, model_name):
+    """
+    Split the current movies into (to_embed, to_delete) against the previous build.
+    Without a usable manifest (first build, or a different embedding model) everything is embedded.
+    """
+    if manifest is None or manifest.get("model") != model_name:
+        return sorted(movies), [], True
+    previous = manifest.get("hashes", {})
+    to_embed = sorted(m for m, (_, _, h) in movies.items() if previous.get(m) != h)
+    # Changed movies are deleted and re-added; removed movies are only deleted
+    to_delete = sorted(m for m in previous if m not in movies or movies[m][2] != previous[m])
+    return to_embed, to_delete, False
+
+
+# --- Checkpoint ---
+class EmbeddingCheckpoint:
+    """
+    Finished embedding batches saved as .npz files in `path`.
+
+    Each batch stores ids, content hashes and vectors, so a resumed build reuses a
+    vector only if the movie text is unchanged since it was embedded.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        meta_path = os.path.join(path, "checkpoint.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                if json.load(f).get("model") != model_name:
+                    self.clear()
+        os.makedirs(path, exist_ok=True)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name}, f)
+
+    def load(self):
+        done = {}
+        for batch_file in sorted(glob.glob(os.path.join(self.path, "batch_*.npz"))):
+            with np.load(batch_file) as batch:
+                for movie_id, digest, vector in zip(batch["ids"], batch["hashes"], batch["vectors"]):
+                    done[str(movie_id)] = (str(digest), vector)
+        return done
+
+    def save_batch(self, ids, hashes, vectors):
+        name = f"batch_{time.time_ns()}_{os.getpid()}"
+        tmp_path = os.path.join(self.path, f"{name}.tmp.npz")
+        np.savez(tmp_path, ids=np.array(ids), hashes=np.array(hashes), vectors=np.asarray(vectors, dtype=np.float32))
+        os.replace(tmp_path, os.path.join(self.path, f"{name}.npz"))
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# --- Embedding ---
+def embed_with_backoff(embed_documents, texts, max_retries=6, base_delay=1.0):
+    """Call `embed_documents`, sleeping with exponential backoff and jitter on rate limits."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embed_documents(texts)
+        except Exception as exc:
+            if not is_rate_limit_error(exc) or attempt == max_retries:
+                raise
+            delay = base_delay * 2 ** attempt * (1 + random.random())
+            print(f"⏳ Rate limited, retrying a batch of {len(texts)} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_movies(movie_ids, movies, embedding_model, checkpoint, batch_size=256, workers=4, max_retries=6):
+    """
+    Embed `movie_ids` in batches on a thread pool, checkpointing each finished batch.
+    Returns _id -> float32 vector, including vectors recovered from the checkpoint.
+    """
+    vectors = {}
+    for movie_id, (digest, vector) in checkpoint.load().items():
+        if movie_id in movies and movies[movie_id][2] == digest:
+            vectors[movie_id] = vector
+    pending = [m for m in movie_ids if m not in vectors]
+    reused = len(movie_ids) - len(pending)
+    if reused:
+        print(f"↩️  Resuming: {reused:,} embeddings recovered from checkpoint")
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    # A local model already uses every core and encodes one batch at a time; the pool only helps network providers
+    if getattr(embedding_model, "provider", None) == "local":
+        workers = 1
+
+    def run(batch):
+        result = embed_with_backoff(embedding_model.embed_documents, [movies[m][0] for m in batch], max_retries)
+        checkpoint.save_batch(batch, [movies[m][2] for m in batch], result)
+        return batch, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, batch) for batch in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            batch, result = future.result()
+            vectors.update(zip(batch, np.asarray(result, dtype=np.float32)))
+            print(f"  batch {done}/{len(batches)} embedded ({time.perf_counter() - start:.1f}s)")
+    return vectors
+
+
+# --- Index Swap ---
+VERSION_DIR_PATTERN = re.compile(r"v\d+")
+
+
+def swap_index_dir(new_path, index_path):
+    """
+    Publish the fully written `new_path` as the index at `index_path`.
+
+    The build is moved to `index_path/v<ms>` and then named in
+    `index_path/CURRENT`, which is rewritten through a temp file and os.replace.
+    Readers resolve it with vector_index.resolve_index_dir and see either the
+    complete old index or the complete new one. Only renames are used, so this
+    works on Windows without symlink rights. The previous version is kept for
+    rollback (and for readers still loading it); older ones are deleted.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    flat_layout = resolve_index_dir(index_path) == index_path
+    version = f"v{int(time.time() * 1000)}"
+    os.replace(new_path, os.path.join(index_path, version))
+
+    fd, tmp_path = tempfile.mkstemp(dir=index_path, prefix=CURRENT_FILE + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(index_path, CURRENT_FILE))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    if flat_layout:
+        # One-time move from the old layout: its files sit next to the version directories and are no longer read
+        for name in os.listdir(index_path):
+            path = os.path.join(index_path, name)
+            if os.path.isfile(path) and name != CURRENT_FILE:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    versions = sorted((n for n in os.listdir(index_path) if VERSION_DIR_PATTERN.fullmatch(n)), key=lambda n: int(n[1:]))
+    for old in versions[:-2]:
+        if old != version:
+            # Files still mapped by a running app cannot be deleted on Windows; the next swap retries
+            shutil.rmtree(os.path.join(index_path, old), ignore_errors=True)
+
+
+# --- Build ---
+def build_index(engine, embedding_model, index_path=FAISS_INDEX_PATH, full=False,
+                batch_size=256, workers=4, max_retries=6):
+    # Deferred: langchain is only needed when an index is actually written
+    from langchain_community.vectorstores import FAISS
+
+    model_name = embedding_model_name(embedding_model)
+    movies = load_movies(engine)
+    manifest = None if full else read_manifest(index_path)
+    to_embed, to_delete, rebuild = plan_changes(movies, manifest, model_name)
+    print(f"🎬 {len(movies):,} movies with plots: {len(to_embed):,} to embed, {len(to_delete):,} to delete"
+          + (" (full build)" if rebuild else ""))
+
+    if not to_embed and not to_delete:
+        print("✅ Index is up to date")
+        return {"embedded": 0, "deleted": 0, "total": len(movies)}
+
+    checkpoint = EmbeddingCheckpoint(f"{index_path}.checkpoint", model_name)
+    vectors = embed_movies(to_embed, movies, embedding_model, checkpoint, batch_size, workers, max_retries)
+
+    def entries(ids):
+        pairs = [(movies[m][0], vectors[m].tolist()) for m in ids]
+        return pairs, [{"_id": m, "title": movies[m][1]} for m in ids]
+
+    if rebuild:
+        pairs, metadatas = entries(to_embed)
+        store = FAISS.from_embeddings(pairs, embedding_model, metadatas=metadatas, ids=to_embed)
+    else:
+        store = FAISS.load_local(resolve_index_dir(index_path), embedding_model, allow_dangerous_deserialization=True)
+        if to_delete:
+            store.delete(to_delete)
+        if to_embed:
+            pairs, metadatas = entries(to_embed)
+            store.add_embeddings(pairs, metadatas=metadatas, ids=to_embed)
+
+    new_path = f"{index_path}.building"
+    shutil.rmtree(new_path, ignore_errors=True)
+    store.save_local(new_path)
+    with open(os.path.join(new_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "provider": getattr(embedding_model, "provider", None), "built_at": time.time(),
+                   "hashes": {m: h for m, (_, _, h) in movies.items()}}, f)
+    swap_index_dir(new_path, index_path)
+    checkpoint.clear()
+    print(f"✅ Index saved to: {index_path} ({store.index.ntotal:,} vectors)")
+    return {"embedded": len(to_embed), "deleted": len(to_delete), "total": store.index.ntotal}
+
+
+def _previous_embedded_vectors(index_path, model_name):
+    """_id -> (hash, vector) for rows we embedded ourselves in the current column-built index."""
+    if not is_vector_index_dir(index_path):
+        return {}
+    try:
+        previous = MovieVectorIndex.load(index_path, embedding_model=None)
+    except Exception as e:
+        print(f"Previous index unreadable, embedding everything again: {e}")
+        return {}
+    if previous.meta.get("model") != model_name:
+        return {}
+    sources = previous.id_table.column("source").to_numpy()
+    hashes = previous.id_table.column("content_hash").to_pylist()
+    rows = np.flatnonzero(sources == SOURCE_EMBEDDED)
+    if not len(rows):
+        return {}
+    vectors = reconstruct_rows(previous.index, rows)
+    if vectors is None:
+        print("Previous index is PQ-compressed; its embedded vectors cannot be reused exactly")
+        return {}
+    return {previous.movie_id(int(r)): (hashes[r], v) for r, v in zip(rows, vectors)}
+
+
+def build_index_from_column(engine, embedding_model, index_path=FAISS_INDEX_PATH,
+                            batch_size=256, workers=4, max_retries=6, index_type="flat", index_params=None):
+    """
+    Build a MovieVectorIndex from two clearly separate sources:
+    1. stored vectors streamed from movies.plot_embedding (no API calls)
+    2. movies with a plot but no stored vector, embedded as "<title>. <plot>"
+
+    Source 1 is skipped when `embedding_model` is not the model that produced
+    the stored vectors; every movie then goes through source 2.
+
+    `index_type` is one of vector_index.INDEX_TYPES; `index_params` holds its
+    build knobs (nlist, pq_m, pq_bits, hnsw_m).
+    """
+    index_params = {k: v for k, v in (index_params or {}).items() if v}
+    model_name = embedding_model_name(embedding_model)
+    start = time.perf_counter()
+    use_stored = model_name == STORED_EMBEDDING_MODEL
+    if use_stored:
+        stored_ids, stored_titles, stored_vectors, skipped = read_plot_embeddings(engine)
+        print(f"📥 Source 1: {len(stored_ids):,} stored plot_embedding vectors read in "
+              f"{time.perf_counter() - start:.1f}s" + (f" ({skipped:,} malformed skipped)" if skipped else ""))
+    else:
+        stored_ids, stored_titles, stored_vectors = [], [], np.empty((0, 0), dtype=np.float32)
+        print(f"📥 Source 1 skipped: plot_embedding holds {STORED_EMBEDDING_MODEL} vectors, "
+              f"the configured model is {model_name}")
+
+    missing = load_movies(engine, UNEMBEDDED_MOVIES_QUERY if use_stored else MOVIES_QUERY)
+    embedded = {}
+    for movie_id, (digest, vector) in _previous_embedded_vectors(index_path, model_name).items():
+        if movie_id in missing and missing[movie_id][2] == digest:
+            embedded[movie_id] = vector
+    to_embed = sorted(m for m in missing if m not in embedded)
+    print(f"🧮 Source 2: {len(missing):,} movies {'without a stored vector' if use_stored else 'with a plot'}: "
+          f"{len(embedded):,} reused from the previous build, {len(to_embed):,} to embed")
+    if to_embed:
+        checkpoint = EmbeddingCheckpoint(f"{index_path}.checkpoint", model_name)
+        embedded.update(embed_movies(to_embed, missing, embedding_model, checkpoint, batch_size, workers, max_retries))
+    embedded_ids = sorted(embedded)
+
+    dim = stored_vectors.shape[1] if len(stored_ids) else len(next(iter(embedded.values()), []))
+    if not dim:
+        raise ValueError("no vectors to index")
+    vectors = stored_vectors
+    if embedded_ids:
+        extra = np.stack([embedded[m] for m in embedded_ids]).astype(np.float32)
+        if extra.shape[1] != dim:
+            raise ValueError(f"embedded vectors have {extra.shape[1]} dimensions, stored ones {dim}")
+        vectors = np.concatenate([stored_vectors, extra]) if len(stored_ids) else extra
+    build_start = time.perf_counter()
+    index, factory = build_faiss_index(vectors, index_type, **index_params)
+    print(f"🏗️  {factory} index built in {time.perf_counter() - build_start:.1f}s")
+
+    id_table = make_id_table(
+        list(stored_ids) + embedded_ids,
+        list(stored_titles) + [missing[m][1] for m in embedded_ids],
+        [SOURCE_STORED] * len(stored_ids) + [SOURCE_EMBEDDED] * len(embedded_ids),
+        [None] * len(stored_ids) + [missing[m][2] for m in embedded_ids],
+    )
+    meta = {
+        "model": model_name, "provider": getattr(embedding_model, "provider", None),
+        "dim": dim, "metric": "l2", "count": index.ntotal,
+        "index_type": index_type, "factory": factory, "params": index_params,
+        "sources": {"plot_embedding": len(stored_ids), "embedded": len(embedded_ids)},
+        "built_at": time.time(),
+    }
+    new_path = f"{index_path}.building"
+    shutil.rmtree(new_path, ignore_errors=True)
+    MovieVectorIndex(index, id_table, embed_query=None, meta=meta).save(new_path)
+    swap_index_dir(new_path, index_path)
+    if to_embed:
+        checkpoint.clear()
+    print(f"✅ Index saved to: {index_path} ({index.ntotal:,} vectors, {time.perf_counter() - start:.1f}s)")
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", default=FAISS_INDEX_PATH)
+    parser.add_argument("--source", choices=["column", "embed", "openai"], default="column",
+                        help="Use stored plot_embedding vectors (column) or embed every movie (embed; openai is an alias)")
+    parser.add_argument("--full", action="store_true", help="With --source embed: re-embed every movie")
+    parser.add_argument("--batch-size", type=int, default=FAISS_BUILD_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=FAISS_BUILD_WORKERS, help="Concurrent embedding requests")
+    parser.add_argument("--max-retries", type=int, default=FAISS_BUILD_MAX_RETRIES)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE,
+                        help="With --source column: FAISS index structure")
+    parser.add_argument("--nlist", type=int, default=VECTOR_INDEX_NLIST, help="IVF lists (0 = ~4*sqrt(n))")
+    parser.add_argument("--pq-m", type=int, default=VECTOR_INDEX_PQ_M, help="PQ sub-quantizers (0 = dim/16)")
+    parser.add_argument("--hnsw-m", type=int, default=VECTOR_INDEX_HNSW_M)
+    args = parser.parse_args()
+
+    # Documents are embedded once per build, so the query-embedding cache is not used here
+    embedding_model = get_embedding_provider(cached=False)
+    print(f"Embedding with {embedding_model.provider}:{embedding_model.model}")
+    engine = create_engine(DB_URI)
+    if args.source == "column":
+        build_index_from_column(engine, embedding_model, index_path=args.index_path,
+                                batch_size=args.batch_size, workers=args.workers, max_retries=args.max_retries,
+                                index_type=args.index_type,
+                                index_params={"nlist": args.nlist, "pq_m": args.pq_m, "hnsw_m": args.hnsw_m})
+    else:
+        build_index(engine, embedding_model, index_path=args.index_path, full=args.full,
+                    batch_size=args.batch_size, workers=args.workers, max_retries=args.max_retries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import re
+import contextlib
+import contextvars
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import pipeline_tracing as tracing
+
+
+# --- Filter Extraction ---
+class RetrievalFilters(namedtuple("RetrievalFilters", "year_min year_max genres languages countries min_rating")):
+    """Structured constraints found in a semantic question. Genres are ANDed, languages/countries ORed."""
+
+    def is_empty(self):
+        return not any([self.year_min, self.year_max, self.genres, self.languages, self.countries, self.min_rating])
+
+    def describe(self):
+        parts = []
+        if self.year_min or self.year_max:
+            parts.append(f"year {self.year_min or '…'}–{self.year_max or '…'}")
+        parts += [f"genre {g}" for g in self.genres]
+        if self.languages:
+            parts.append("language " + " / ".join(self.languages))
+        if self.countries:
+            parts.append("country " + " / ".join(self.countries))
+        if self.min_rating:
+            parts.append(f"imdb ≥ {self.min_rating:g}")
+        return ", ".join(parts)
+
+
+# Genres as stored in the mflix genres table; the filter index replaces these with the live values
+MFLIX_GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Documentary", "Drama", "Family",
+    "Fantasy", "Film-Noir", "History", "Horror", "Music", "Musical", "Mystery", "News", "Romance", "Sci-Fi",
+    "Short", "Sport", "Talk-Show", "Thriller", "War", "Western",
+]
+GENRE_ALIASES = {
+    "sci-fi": "Sci-Fi", "scifi": "Sci-Fi", "science fiction": "Sci-Fi", "science-fiction": "Sci-Fi",
+    "romantic": "Romance", "rom-com": "Romance", "romcom": "Romance", "animated": "Animation",
+    "cartoon": "Animation", "cartoons": "Animation", "documentaries": "Documentary", "noir": "Film-Noir",
+    "biopic": "Biography", "biopics": "Biography", "historical": "History", "comedies": "Comedy",
+    "funny": "Comedy", "scary": "Horror", "mysteries": "Mystery", "fantasies": "Fantasy",
+    "sports": "Sport",
+}
+# Genre names that are ordinary words elsewhere only count when followed by movie/film
+AMBIGUOUS_GENRES = {"War", "Family", "Short", "Music", "News", "History", "Sport", "Talk-Show"}
+
+MFLIX_LANGUAGES = [
+    "English", "French", "Spanish", "German", "Italian", "Japanese", "Russian", "Mandarin", "Cantonese",
+    "Hindi", "Korean", "Portuguese", "Swedish", "Danish", "Norwegian", "Finnish", "Dutch", "Polish", "Arabic",
+    "Turkish", "Greek", "Hebrew", "Persian", "Czech", "Hungarian", "Thai", "Tamil", "Chinese",
+]
+MFLIX_COUNTRIES = [
+    "USA", "UK", "France", "Germany", "Italy", "Spain", "Japan", "Canada", "India", "South Korea", "China",
+    "Hong Kong", "Mexico", "Sweden", "Denmark", "Norway", "Finland", "Russia", "Australia", "Brazil",
+    "Argentina", "Ireland", "Belgium", "Netherlands", "Poland", "Iran", "Turkey", "Israel", "Greece", "Taiwan",
+]
+COUNTRY_ALIASES = {
+    "america": "USA", "united states": "USA", "the us": "USA", "the u.s.": "USA", "hollywood": "USA",
+    "american": "USA", "britain": "UK", "great britain": "UK", "england": "UK", "united kingdom": "UK",
+    "british": "UK", "french": "France", "german": "Germany", "italian": "Italy",
+    "spanish": "Spain", "japanese": "Japan", "canadian": "Canada", "indian": "India", "bollywood": "India",
+    "korean": "South Korea", "chinese": "China", "mexican": "Mexico", "swedish": "Sweden", "danish": "Denmark",
+    "norwegian": "Norway", "finnish": "Finland", "russian": "Russia", "australian": "Australia",
+    "brazilian": "Brazil", "irish": "Ireland", "iranian": "Iran", "turkish": "Turkey", "greek": "Greece",
+    "dutch": "Netherlands", "polish": "Poland", "israeli": "Israel", "taiwanese": "Taiwan",
+}
+
+# "highly rated" without a number
+HIGHLY_RATED_MIN = 7.0
+
+_FILM = r"(?:movies?|films?|pictures?|flicks?)"
+_DECADE_RE = re.compile(r"\b(?:(early|mid|late)[\s-]+)?(?:(19|20)(\d)0|'?(\d)0)'?s\b", re.IGNORECASE)
+_RANGE_RE = re.compile(r"\b(?:between|from)\s+((?:19|20)\d\d)\s+(?:and|to|until|-)\s+((?:19|20)\d\d)\b"
+                       r"|\b((?:19|20)\d\d)\s*[-–]\s*((?:19|20)\d\d)\b", re.IGNORECASE)
+_AFTER_RE = re.compile(r"\b(after|since|post-?)\s*((?:19|20)\d\d)\b", re.IGNORECASE)
+_BEFORE_RE = re.compile(r"\b(before|pre-?|until|up to)\s*((?:19|20)\d\d)\b", re.IGNORECASE)
+_YEAR_RE = re.compile(r"\b(?:in|from|of|released in|made in|circa)\s+((?:19|20)\d\d)\b", re.IGNORECASE)
+_RATING_RE = re.compile(
+    r"\b(?:imdb\s*)?(?:rat(?:ing|ed)|score[ds]?)\s*(?:of\s*)?(?:above|over|at least|higher than|greater than|more than|>=?|≥)\s*"
+    r"(\d+(?:\.\d+)?)"
+    r"|\b(?:above|over|at least|>=?|≥)\s*(\d+(?:\.\d+)?)\s*(?:/\s*10|stars|on imdb|imdb|rating)",
+    re.IGNORECASE,
+)
+_HIGHLY_RATED_RE = re.compile(r"\b(?:highly|well|top)[\s-]rated\b|\bacclaimed\b", re.IGNORECASE)
+
+
+class FilterExtractor:
+    """
+    Rule-based extraction of year range, genres, languages, countries and a
+    minimum imdb_rating from a free-text question. Values are canonicalized
+    to the spelling stored in Postgres.
+    """
+
+    def __init__(self, genres=None, languages=None, countries=None):
+        self.genres = self._alternatives(genres or MFLIX_GENRES, GENRE_ALIASES, plural=True)
+        self.languages = self._alternatives(languages or MFLIX_LANGUAGES, {})
+        self.countries = self._alternatives(countries or MFLIX_COUNTRIES, COUNTRY_ALIASES)
+        # One alternation regex per kind, so extraction cost does not grow with the vocabulary
+        self._genre_re = self._compile(self.genres, r"\b{0}\b")
+        self._ambiguous_genre_re = self._compile(self.genres, r"\b{0}s?\s+" + _FILM)
+        self._language_re = self._compile(self.languages, r"\bin\s+{0}\b|\b{0}[\s-]+(?:language|speaking|dialogue)\b")
+        # "from France", "French films", "French horror movies"
+        self._country_re = self._compile(
+            self.countries, r"\b(?:from|made in|set in|shot in|produced in)\s+{0}\b|\b{0}\s+(?:[\w-]+\s+){0,2}" + _FILM,
+        )
+
+    @staticmethod
+    def _alternatives(values, aliases, plural=False):
+        # spoken form (lowercase) -> canonical value; only keep aliases whose target exists
+        canonical = {v.lower(): v for v in values}
+        forms = dict(canonical)
+        if plural:
+            forms.update({f"{k}s": v for k, v in canonical.items()})
+        forms.update({k: canonical[v.lower()] for k, v in aliases.items() if v.lower() in canonical})
+        return forms
+
+    @staticmethod
+    def _compile(forms, pattern):
+        # Longest forms first so "science fiction" wins over "fiction"
+        alternation = "|".join(re.escape(f) for f in sorted(forms, key=len, reverse=True))
+        parts = pattern.split("{0}")
+        named = "".join(part + (f"(?P<v{i}>{alternation})" if i < len(parts) - 1 else "") for i, part in enumerate(parts))
+        return re.compile(named, re.IGNORECASE)
+
+    @staticmethod
+    def _find(forms, regex, query):
+        found = []
+        for match in regex.finditer(query):
+            form = next(v for v in match.groupdict().values() if v is not None).lower()
+            if forms[form] not in found:
+                found.append(forms[form])
+        return found
+
+    def years(self, query):
+        match = _RANGE_RE.search(query)
+        if match:
+            low, high = sorted(int(y) for y in match.groups() if y)
+            return low, high
+        match = _DECADE_RE.search(query)
+        if match:
+            part, century, decade, short = match.groups()
+            if century:
+                start = int(century + decade + "0")
+            else:
+                start = (2000 if int(short) <= 2 else 1900) + int(short) * 10
+            low, high = {"early": (0, 3), "mid": (4, 6), "late": (7, 9)}.get((part or "").lower(), (0, 9))
+            return start + low, start + high
+        after, before = _AFTER_RE.search(query), _BEFORE_RE.search(query)
+        if after or before:
+            low = int(after.group(2)) + (after.group(1).lower() == "after") if after else None
+            high = int(before.group(2)) - (before.group(1).lower().startswith(("before", "pre"))) if before else None
+            return low, high
+        match = _YEAR_RE.search(query)
+        if match:
+            return int(match.group(1)), int(match.group(1))
+        return None, None
+
+    def min_rating(self, query):
+        match = _RATING_RE.search(query)
+        if match:
+            value = float(match.group(1) or match.group(2))
+            # "above 80" / "over 85%" style scores are on a 100 scale
+            return value / 10 if value > 10 else value
+        return HIGHLY_RATED_MIN if _HIGHLY_RATED_RE.search(query) else None
+
+    def extract(self, query):
+        year_min, year_max = self.years(query)
+        ambiguous_ok = self._find(self.genres, self._ambiguous_genre_re, query)
+        genres = [g for g in self._find(self.genres, self._genre_re, query) if g not in AMBIGUOUS_GENRES or g in ambiguous_ok]
+        languages = self._find(self.languages, self._language_re, query)
+        countries = self._find(self.countries, self._country_re, query)
+        return RetrievalFilters(year_min, year_max, tuple(genres), tuple(languages), tuple(countries),
+                                self.min_rating(query))
+
+
+# --- Metadata Bitmaps ---
+class MovieFilterIndex:
+    """
+    In-memory metadata for every vector-index row, built once from the Postgres child tables.
+
+    year and imdb_rating are dense per-row arrays; genre, language and country
+    values map to sorted row arrays (posting lists). A filter resolves to one
+    boolean row mask with vectorized comparisons and scatter writes only.
+    """
+
+    CHILD_TABLES = {"genre": "genres", "language": "languages", "country": "countries"}
+
+    def __init__(self, n_rows, years, ratings, postings, names):
+        self.n_rows = n_rows
+        self.years = years
+        self.ratings = ratings
+        self.postings = postings
+        self.names = names
+
+    @classmethod
+    def from_engine(cls, engine, movie_ids):
+        """`movie_ids[i]` is the _id of vector-index row i."""
+        position = pd.Index(movie_ids)
+        n_rows = len(position)
+        with engine.connect() as conn:
+            movies = pd.read_sql(text("SELECT _id, year FROM movies"), conn)
+            ratings = pd.read_sql(text("SELECT movie_id, imdb_rating FROM imdb"), conn)
+            children = {
+                kind: pd.read_sql(text(f"SELECT movie_id, {kind} AS value FROM {table} WHERE {kind} IS NOT NULL"), conn)
+                for kind, table in cls.CHILD_TABLES.items()
+            }
+
+        years = np.full(n_rows, -1, dtype=np.int16)
+        rows = position.get_indexer(movies["_id"].astype(str))
+        keep = (rows >= 0) & movies["year"].notna().to_numpy()
+        years[rows[keep]] = movies["year"].to_numpy()[keep].astype(np.int16)
+
+        rating_arr = np.full(n_rows, np.nan, dtype=np.float32)
+        rows = position.get_indexer(ratings["movie_id"].astype(str))
+        keep = rows >= 0
+        rating_arr[rows[keep]] = pd.to_numeric(ratings["imdb_rating"], errors="coerce").to_numpy()[keep]
+
+        postings, names = {}, {}
+        for kind, frame in children.items():
+            rows = position.get_indexer(frame["movie_id"].astype(str))
+            keep = rows >= 0
+            values = frame["value"].astype(str).to_numpy()[keep]
+            codes, uniques = pd.factorize(pd.Series(values).str.lower())
+            order = np.argsort(codes, kind="stable")
+            splits = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+            postings[kind] = {
+                value: np.unique(group)
+                for value, group in zip(uniques, np.split(rows[keep][order].astype(np.int32), splits))
+            }
+            # Most frequent original spelling per lowercase value, for the extractor vocabulary
+            names[kind] = pd.Series(values).groupby(codes).agg(lambda s: s.mode().iat[0]).tolist()
+        return cls(n_rows, years, rating_arr, postings, names)
+
+    def extractor(self):
+        return FilterExtractor(genres=self.names.get("genre"), languages=self.names.get("language"),
+                               countries=self.names.get("country"))
+
+    def _any_of(self, kind, values):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for value in values:
+            rows = self.postings[kind].get(value.lower())
+            if rows is not None:
+                mask[rows] = True
+        return mask
+
+    def candidate_mask(self, filters):
+        """Boolean row mask for `filters`, or None when there is nothing to filter on."""
+        if filters.is_empty():
+            return None
+        mask = np.ones(self.n_rows, dtype=bool)
+        if filters.year_min:
+            mask &= self.years >= filters.year_min
+        if filters.year_max:
+            mask &= (self.years <= filters.year_max) & (self.years >= 0)
+        if filters.min_rating:
+            # NaN ratings compare False, so unrated movies are excluded
+            mask &= self.ratings >= filters.min_rating
+        for genre in filters.genres:
+            mask &= self._any_of("genre", [genre])
+        if filters.languages:
+            mask &= self._any_of("language", filters.languages)
+        if filters.countries:
+            mask &= self._any_of("country", filters.countries)
+        return mask
+
+
+# --- Retriever ---
+# dict the caller wants the filters of its own searches written to (see report_filters_to)
+_filter_report = contextvars.ContextVar("hybrid_filter_report", default=None)
+
+
+@contextlib.contextmanager
+def report_filters_to(target):
+    """
+    Within the block, every HybridRetriever search sets target["filters"] and
+    target["candidates"]. Context-local, so concurrent sessions each get their
+    own; worker threads started with asyncio.to_thread inherit it.
+    """
+    token = _filter_report.set(target)
+    try:
+        yield target
+    finally:
+        _filter_report.reset(token)
+
+
+class HybridRetriever:
+    """
+    `similarity_search` with metadata filters pushed into the vector search.
+
+    Wraps a vector_index.MovieVectorIndex so rag_pipeline can use it unchanged.
+    Filters found in the question become a row mask that FAISS applies during
+    search. A question without filters, or whose filters match nothing, runs a
+    plain search.
+    """
+
+    def __init__(self, vector_index, filter_index, extractor=None):
+        self.vector_index = vector_index
+        self.filter_index = filter_index
+        self.extractor = extractor or filter_index.extractor()
+
+    def __getattr__(self, name):
+        return getattr(self.vector_index, name)
+
+    def __len__(self):
+        return len(self.vector_index)
+
+    def resolve(self, query):
+        filters = self.extractor.extract(query)
+        return filters, self.filter_index.candidate_mask(filters)
+
+    def similarity_search(self, query, k=5):
+        filters, mask = self.resolve(query)
+        candidates = int(mask.sum()) if mask is not None else len(self.vector_index)
+        if mask is not None and not candidates:
+            mask = None
+        # Shared by every session, so what a search used goes to the caller's context, not on self
+        described = filters.describe() or "none"
+        report = _filter_report.get()
+        if report is not None:
+            report.update(filters=described, candidates=candidates)
+        tracing.annotate(filters=described, candidates=candidates, filtered=mask is not None)
+        return self.vector_index.similarity_search(query, k=k, mask=mask)
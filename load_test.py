@@ -0,0 +1,378 @@
+"""
+Offline load test of answer_user_query: stub LLM and embeddings, synthetic mflix data.
+
+    python synthetic_mflix.py --movies 21000                  # once: data + stub-embedded index under bench/
+    python load_test.py                                       # replay eval/router_eval.jsonl with 4 workers
+    python load_test.py --concurrency 16 --requests 2000 --llm-latency-ms 400 --output run.json
+    python load_test.py --speculative --compare run.json      # speculative pipeline vs the earlier run
+
+Nothing leaves the machine. ChatOpenAI and the embeddings are replaced by
+StubLLM / StubEmbeddings, which answer deterministically after a configurable
+delay. The questions are the labeled sets in eval/; the label decides the stub
+classifier's answer, and structured questions get one of STUB_SQL filled in
+from the question, so the same question always produces the same SQL.
+
+Per-stage times come from pipeline_tracing; end-to-end latency is measured
+around each call. Peak memory is the process RSS, sampled every 20 ms.
+The SQL result cache is in-memory only, so every run starts cold.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+from langchain_core.embeddings import Embeddings
+
+from synthetic_mflix import DEFAULT_DB, DEFAULT_INDEX_PATH, FIRST_NAMES, LAST_NAMES, TITLE_ADJECTIVES, TITLE_NOUNS
+
+DEFAULT_QUESTIONS = ["eval/router_eval.jsonl"]
+QUESTION_PATTERN = re.compile(r'Query: "(.*)"', re.DOTALL)
+BATCH_QUESTION_PATTERN = re.compile(r'^\s*\d+\. "(.*)"$', re.MULTILINE)
+SEMANTIC_QUESTION_PATTERN = re.compile(r"Question: (.*?)\n\s*Answer:", re.DOTALL)
+CONTEXT_TITLE_PATTERN = re.compile(r"^\s*Title: (.+)$", re.MULTILINE)
+SEMANTIC_HINTS = ("like", "similar", "recommend", "suggest", "should i", "worth", "feel", "vibe", "about")
+
+# Structured questions map onto these by hash; placeholders come from the synthetic vocabulary
+STUB_SQL = [
+    "SELECT m.title, m.year FROM movies m JOIN directors d ON d.movie_id = m._id WHERE d.director = '{person}'",
+    "SELECT m.title, m.year FROM movies m JOIN \"cast\" c ON c.movie_id = m._id WHERE c.cast_member = '{person}'",
+    "SELECT count(*) AS movies FROM movies WHERE year = {year}",
+    "SELECT m.title, i.imdb_rating FROM movies m JOIN imdb i ON i.movie_id = m._id "
+    "WHERE m.year = {year} ORDER BY i.imdb_rating DESC LIMIT 10",
+    "SELECT g.genre, count(*) AS movies FROM genres g GROUP BY g.genre ORDER BY movies DESC",
+    "SELECT m.title, m.runtime, m.rated FROM movies m WHERE m.title = '{title}'",
+]
+
+
+# --- Stubs ---
+def _hash(value):
+    return zlib.crc32(value.encode("utf-8"))
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Feature-hashed bag of words: texts that share words get similar vectors,
+    so semantic questions still retrieve related synthetic plots.
+    """
+
+    provider = "stub"
+
+    def __init__(self, dim=64, latency_ms=0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.model = f"stub-hash-{dim}"
+
+    def _vector(self, text_value):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9]+", text_value.lower()):
+            h = _hash(word)
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._vector(t).tolist() for t in texts]
+
+    def embed_query(self, text_value):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._vector(text_value).tolist()
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for ChatOpenAI with the methods the pipelines call
+    (predict, apredict, stream). Each reply takes `latency_ms` plus
+    `ms_per_token` per word of the reply.
+    """
+
+    def __init__(self, latency_ms=300.0, ms_per_token=0.0, labels=None):
+        self.latency_ms = latency_ms
+        self.ms_per_token = ms_per_token
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+        self.calls = {"classify": 0, "sql": 0, "answer": 0}
+
+    def _classify(self, question):
+        label = self.labels.get(question)
+        if label is None:
+            label = "semantic" if any(h in question.lower() for h in SEMANTIC_HINTS) else "structured"
+        return label.capitalize()
+
+    @staticmethod
+    def _sql(question):
+        h = _hash(question)
+        person = f"{FIRST_NAMES[h % len(FIRST_NAMES)]} {LAST_NAMES[(h // 7) % len(LAST_NAMES)]}"
+        title = f"The {TITLE_ADJECTIVES[h % len(TITLE_ADJECTIVES)]} {TITLE_NOUNS[(h // 3) % len(TITLE_NOUNS)]}"
+        return STUB_SQL[h % len(STUB_SQL)].format(person=person, year=1910 + h % 106, title=title)
+
+    def _respond(self, prompt):
+        if "Classify each query below as Structured or Semantic" in prompt:
+            questions = BATCH_QUESTION_PATTERN.findall(prompt)
+            kind, reply = "classify", "\n".join(f"{i}: {self._classify(q)}" for i, q in enumerate(questions, 1))
+        elif "Classify the query as Structured or Semantic" in prompt:
+            kind, reply = "classify", self._classify(QUESTION_PATTERN.search(prompt).group(1))
+        elif "write a PostgreSQL query" in prompt:
+            kind, reply = "sql", self._sql(QUESTION_PATTERN.search(prompt).group(1))
+        else:
+            match = SEMANTIC_QUESTION_PATTERN.search(prompt)
+            titles = CONTEXT_TITLE_PATTERN.findall(prompt)[:3]
+            kind = "answer"
+            reply = (f"For '{match.group(1).strip() if match else 'your question'}', consider: "
+                     + "; ".join(f"{t} - a close match to what you asked for." for t in titles))
+        with self._lock:
+            self.calls[kind] += 1
+        return reply
+
+    def _delay_s(self, reply):
+        return (self.latency_ms + self.ms_per_token * len(reply.split())) / 1000
+
+    def predict(self, prompt):
+        reply = self._respond(prompt)
+        time.sleep(self._delay_s(reply))
+        return reply
+
+    async def apredict(self, prompt):
+        reply = self._respond(prompt)
+        await asyncio.sleep(self._delay_s(reply))
+        return reply
+
+    def stream(self, prompt):
+        from langchain_core.messages import AIMessageChunk
+        reply = self._respond(prompt)
+        time.sleep(self.latency_ms / 1000)
+        for word in reply.split(" "):
+            if self.ms_per_token:
+                time.sleep(self.ms_per_token / 1000)
+            yield AIMessageChunk(content=word + " ")
+
+
+# --- Questions ---
+def load_questions(paths):
+    """(query, label) pairs; files without labels (e.g. hybrid_eval.jsonl) count as semantic."""
+    questions = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    questions.append((row["query"], row.get("label", "semantic")))
+    return questions
+
+
+def make_schedule(questions, n_requests, seed=3):
+    """`n_requests` questions in a fixed shuffled order, cycling through the set."""
+    rng = np.random.default_rng(seed)
+    order = np.concatenate([rng.permutation(len(questions)) for _ in range(-(-n_requests // len(questions)))])
+    return [questions[i][0] for i in order[:n_requests]]
+
+
+# --- Measurement ---
+class PeakMemory:
+    """Samples the process RSS on a background thread while the block runs."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 1024 / 1024)
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = self.process.memory_info().rss / 1024 / 1024
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 1024 / 1024)
+        return False
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+    }
+
+
+def run_load(answer, schedule, concurrency):
+    """Call `answer(query)` for every scheduled question on `concurrency` threads."""
+    def one(query):
+        start = time.perf_counter()
+        try:
+            answer(query)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return (time.perf_counter() - start) * 1000, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, schedule))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, traces, wall_s, memory):
+    latencies = [ms for ms, error in results if error is None]
+    errors = [error for _, error in results if error is not None]
+    stages, routes = {}, {}
+    for record in traces:
+        routes.setdefault(record.get("route", "unknown"), []).append(record["elapsed_ms"])
+        for span in record["stages"]:
+            stages.setdefault(span["stage"], []).append(span["elapsed_ms"])
+    return {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:5],
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(latencies) / wall_s, 2) if wall_s else 0.0,
+        "end_to_end": percentiles(latencies),
+        "by_route": {route: percentiles(v) for route, v in sorted(routes.items())},
+        "stages": {stage: percentiles(v) for stage, v in sorted(stages.items())},
+        "tokens": {
+            "prompt": int(sum(r.get("prompt_tokens", 0) for r in traces)),
+            "completion": int(sum(r.get("completion_tokens", 0) for r in traces)),
+        },
+        "memory": {"rss_start_mb": round(memory.start_mb, 1), "rss_peak_mb": round(memory.peak_mb, 1)},
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"\n{report['requests']:,} requests, {report['errors']} errors, {report['wall_s']}s, "
+          f"{report['throughput_rps']} req/s, peak RSS {report['memory']['rss_peak_mb']} MB")
+    for error in report["error_examples"]:
+        print(f"  error: {error}")
+    rows = [("end_to_end", report["end_to_end"])]
+    rows += [(f"route:{k}", v) for k, v in report["by_route"].items()]
+    rows += [(f"stage:{k}", v) for k, v in report["stages"].items()]
+    before = {}
+    if baseline:
+        before = {"end_to_end": baseline["end_to_end"]}
+        before.update({f"route:{k}": v for k, v in baseline.get("by_route", {}).items()})
+        before.update({f"stage:{k}": v for k, v in baseline.get("stages", {}).items()})
+    print(f"{'':<22}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + (f"{'before p95':>12}{'change':>9}" if baseline else ""))
+    for name, p in rows:
+        if not p.get("count"):
+            continue
+        line = f"{name:<22}{p['count']:>7}{p['p50_ms']:>10.1f}{p['p95_ms']:>10.1f}{p['p99_ms']:>10.1f}"
+        if name in before and before[name].get("count"):
+            old = before[name]["p95_ms"]
+            line += f"{old:>12.1f}{(p['p95_ms'] - old) / max(old, 1e-6) * 100:>+8.0f}%"
+        print(line)
+    if baseline:
+        print(f"throughput {baseline['throughput_rps']} -> {report['throughput_rps']} req/s, "
+              f"peak RSS {baseline['memory']['rss_peak_mb']} -> {report['memory']['rss_peak_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--questions", nargs="+", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10, help="Requests run (sequentially) before measuring")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--speculative", action="store_true", help="Use speculative_pipeline instead of rag_pipeline")
+    parser.add_argument("--no-router", action="store_true", help="Classify every question with the (stub) LLM")
+    parser.add_argument("--no-hybrid", action="store_true", help="Plain vector search without metadata filters")
+    parser.add_argument("--no-sql-cache", action="store_true")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    # Read by config.py when the pipeline modules are imported below
+    os.environ["SQL_CACHE_ENABLED"] = "false" if args.no_sql_cache else "true"
+    os.environ["SQL_CACHE_DIR"] = ""
+    from sqlalchemy import create_engine, text
+    import pipeline_tracing as tracing
+    import rag_pipeline
+    from prompt_builder import get_prompt_builder
+    from query_router import QueryRouter, load_router_vocabulary
+    from speculative_pipeline import SpeculationLimiter, SpeculationStats, answer_user_query_speculative
+    from vector_index import MovieVectorIndex, load_vector_index
+    from hybrid_retrieval import HybridRetriever, MovieFilterIndex
+    from config import ROUTER_CONFIDENCE_THRESHOLD, PROMPT_SCHEMA_TOKEN_BUDGET, SPECULATION_MAX_INFLIGHT
+
+    questions = load_questions(args.questions)
+    llm = StubLLM(args.llm_latency_ms, args.llm_ms_per_token, labels=dict(questions))
+    engine = create_engine(args.db)
+
+    start = time.perf_counter()
+    with open(os.path.join(args.index_path, "index_meta.json"), encoding="utf-8") as f:
+        embeddings = StubEmbeddings(dim=json.load(f)["dim"], latency_ms=args.embed_latency_ms)
+    faiss_index = load_vector_index(args.index_path, embeddings, engine)
+    if not args.no_hybrid and isinstance(faiss_index, MovieVectorIndex):
+        faiss_index = HybridRetriever(faiss_index, MovieFilterIndex.from_engine(engine, faiss_index.movie_ids()))
+    prompt_builder = get_prompt_builder(engine, token_budget=PROMPT_SCHEMA_TOKEN_BUDGET)
+    router = None
+    if not args.no_router:
+        router = QueryRouter(vocabulary=load_router_vocabulary(engine), confidence_threshold=ROUTER_CONFIDENCE_THRESHOLD)
+    with engine.connect() as conn:
+        n_movies = conn.execute(text("SELECT count(*) FROM movies")).scalar()
+    setup_s = time.perf_counter() - start
+    print(f"{n_movies:,} movies ({engine.dialect.name}), {faiss_index.index.ntotal:,} vectors, "
+          f"set up in {setup_s:.1f}s; {args.requests} requests at concurrency {args.concurrency}")
+
+    limiter, stats = SpeculationLimiter(SPECULATION_MAX_INFLIGHT), SpeculationStats()
+
+    def answer(query):
+        if args.speculative:
+            return answer_user_query_speculative(query, llm, engine, faiss_index, router=router,
+                                                 prompt_builder=prompt_builder, stats=stats, limiter=limiter)
+        return rag_pipeline.answer_user_query(query, llm, engine, faiss_index, router=router,
+                                              prompt_builder=prompt_builder)
+
+    traces = []
+    tracing.TRACER.enabled = True
+    tracing.TRACER.sinks.append(traces.append)
+    run_load(answer, make_schedule(questions, args.warmup, seed=1), concurrency=1)
+    traces.clear()
+    llm.calls = dict.fromkeys(llm.calls, 0)
+
+    with PeakMemory() as memory:
+        results, wall_s = run_load(answer, make_schedule(questions, args.requests), args.concurrency)
+    report = summarize(results, traces, wall_s, memory)
+    report["config"] = {
+        "movies": n_movies, "dialect": engine.dialect.name, "vectors": faiss_index.index.ntotal,
+        "concurrency": args.concurrency, "llm_latency_ms": args.llm_latency_ms,
+        "llm_ms_per_token": args.llm_ms_per_token, "embed_latency_ms": args.embed_latency_ms,
+        "speculative": args.speculative, "router": not args.no_router, "hybrid": not args.no_hybrid,
+        "sql_cache": not args.no_sql_cache, "setup_s": round(setup_s, 2), "llm_calls": dict(llm.calls),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""
+Streaming MongoDB -> PostgreSQL load for sample_mflix (replaces the phase 1.2/1.3 notebooks).
+
+    python mflix_etl.py --mongo-uri "mongodb+srv://..."          # live Atlas source
+    python mflix_etl.py --dump-dir ./mflix_dump                   # mongoexport JSON files
+    python mflix_etl.py --dump-dir ./mflix_dump --mongomock       # same files through a mongomock cursor
+    python mflix_etl.py --dump-dir ./mflix_dump --dry-run         # transform only, no Postgres needed
+
+Every collection is read in batches, flattened with vectorized pandas and written
+with COPY FROM STDIN. Each collection's tables are truncated and reloaded in one
+transaction, so the load can be re-run at any time.
+"""
+import io
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+
+TABLE_DDL = {
+    "movies": """
+        CREATE TABLE IF NOT EXISTS movies (
+            _id TEXT PRIMARY KEY, plot TEXT, runtime FLOAT, poster TEXT, title TEXT, fullplot TEXT,
+            released DATE, rated TEXT, lastupdated TIMESTAMP, year INT, type TEXT,
+            num_mflix_comments INT, metacritic FLOAT, year_raw TEXT, plot_embedding REAL[]
+        )""",
+    "writers": "CREATE TABLE IF NOT EXISTS writers (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), writer TEXT)",
+    "directors": "CREATE TABLE IF NOT EXISTS directors (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), director TEXT)",
+    "cast": 'CREATE TABLE IF NOT EXISTS "cast" (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), cast_member TEXT)',
+    "genres": "CREATE TABLE IF NOT EXISTS genres (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), genre TEXT)",
+    "languages": "CREATE TABLE IF NOT EXISTS languages (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), language TEXT)",
+    "countries": "CREATE TABLE IF NOT EXISTS countries (id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id), country TEXT)",
+    "tomatoes": """
+        CREATE TABLE IF NOT EXISTS tomatoes (
+            id SERIAL PRIMARY KEY, movie_id TEXT REFERENCES movies(_id),
+            viewer_rating FLOAT, viewer_numreviews INT, viewer_meter INT,
+            critic_rating FLOAT, critic_numreviews INT, critic_meter INT,
+            boxOffice TEXT, consensus TEXT, fresh INT, rotten INT, lastUpdated TIMESTAMP,
+            production TEXT, website TEXT, dvd_release DATE
+        )""",
+    "imdb": "CREATE TABLE IF NOT EXISTS imdb (movie_id TEXT PRIMARY KEY REFERENCES movies(_id), imdb_rating FLOAT, imdb_votes INT, imdb_id TEXT)",
+    "awards": "CREATE TABLE IF NOT EXISTS awards (movie_id TEXT PRIMARY KEY REFERENCES movies(_id), award_wins INT, award_nominations INT, award_text TEXT)",
+    "theaters": """
+        CREATE TABLE IF NOT EXISTS theaters (
+            _id TEXT PRIMARY KEY, "theaterId" TEXT UNIQUE NOT NULL, street1 TEXT, street2 TEXT,
+            state TEXT, city TEXT, zipcode TEXT, type TEXT, "Latitude" DOUBLE PRECISION, "Longitude" DOUBLE PRECISION
+        )""",
+    "users": "CREATE TABLE IF NOT EXISTS users (_id TEXT PRIMARY KEY, name TEXT, email TEXT UNIQUE NOT NULL, password TEXT)",
+    "comments": "CREATE TABLE IF NOT EXISTS comments (_id TEXT PRIMARY KEY, name TEXT, email TEXT, movie_id TEXT NOT NULL, text TEXT, date TIMESTAMP)",
+}
+
+# Collection -> tables it fills, parents first (FK order)
+COLLECTION_TABLES = {
+    "movies": ["movies", "writers", "directors", "cast", "genres", "languages", "countries", "tomatoes", "imdb", "awards"],
+    "comments": ["comments"],
+    "users": ["users"],
+    "theaters": ["theaters"],
+}
+
+NULL_MARKER = "\\N"
+
+
+# --- Sources ---
+def _extended_json_hook(obj):
+    # mongoexport writes ObjectId/Date/number wrappers as {"$oid": ...}, {"$date": ...}, ...
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        if key == "$oid":
+            return value
+        if key == "$date":
+            # Dates before 1970 come as {"$numberLong": ms}, later ones as ISO strings with a zone;
+            # both become naive UTC like the datetimes pymongo returns. A value that does not parse raises.
+            if isinstance(value, dict):
+                value = int(value["$numberLong"])
+            if isinstance(value, (int, float)):
+                return pd.to_datetime(value, unit="ms", utc=True).tz_localize(None)
+            return pd.to_datetime(value, utc=True).tz_localize(None)
+        if key in ("$numberInt", "$numberLong"):
+            return int(value)
+        if key == "$numberDouble":
+            return float(value)
+    return obj
+
+
+def read_dump_file(path):
+    """Yield documents from a mongoexport file (one JSON document per line, or a JSON array)."""
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f, object_hook=_extended_json_hook)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line, object_hook=_extended_json_hook)
+
+
+class DumpSource:
+    """Reads `<collection>.json` files written by mongoexport."""
+
+    def __init__(self, dump_dir):
+        self.dump_dir = dump_dir
+
+    def has(self, collection):
+        return os.path.exists(os.path.join(self.dump_dir, f"{collection}.json"))
+
+    def batches(self, collection, batch_size):
+        batch = []
+        for doc in read_dump_file(os.path.join(self.dump_dir, f"{collection}.json")):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class MongoSource:
+    """Streams a pymongo (or mongomock) database with server-side cursor batches."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def has(self, collection):
+        return collection in self.db.list_collection_names()
+
+    def batches(self, collection, batch_size, projection=None):
+        batch = []
+        for doc in self.db[collection].find({}, projection, batch_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def mongomock_from_dump(dump_dir, db_name="sample_mflix"):
+    """Load a dump directory into an in-memory mongomock database (offline runs and tests)."""
+    import mongomock
+
+    db = mongomock.MongoClient()[db_name]
+    for name in os.listdir(dump_dir):
+        if name.endswith(".json"):
+            docs = list(read_dump_file(os.path.join(dump_dir, name)))
+            if docs:
+                db[name[:-5]].insert_many(docs)
+    return db
+
+
+# --- Transforms ---
+def _col(df, name):
+    return df[name] if name in df.columns else pd.Series(np.nan, index=df.index, dtype="object")
+
+
+def _ints(series, fill=None):
+    values = pd.to_numeric(series, errors="coerce")
+    if fill is not None:
+        values = values.fillna(fill)
+    return values.round().astype("Int64")
+
+
+def _floats(series):
+    return pd.to_numeric(series, errors="coerce")
+
+
+def _timestamps(series):
+    # Mongo dates arrive as datetimes, dump strings or a mix of both; all become naive UTC
+    values = pd.to_datetime(series, errors="coerce", format="mixed", utc=True).dt.tz_localize(None)
+    failed = series[values.isna() & series.notna()]
+    if len(failed):
+        print(f"⚠️  {len(failed):,} {series.name or 'date'} values did not parse and were loaded as NULL, "
+              f"e.g. {failed.astype(str).unique()[:3].tolist()}")
+    return values
+
+
+def _dates(series):
+    return _timestamps(series).dt.strftime("%Y-%m-%d")
+
+
+def _ids(series):
+    return series.astype(str)
+
+
+def _explode(df, column, target, fill="Unknown"):
+    exploded = df[["_id", column]].explode(column) if column in df.columns else df[["_id"]].assign(**{column: np.nan})
+    return pd.DataFrame({"movie_id": _ids(exploded["_id"]), target: exploded[column].fillna(fill).astype(str)})
+
+
+def transform_movies(docs):
+    df = pd.json_normalize(docs)
+    movie_id = _ids(df["_id"])
+    year_raw = _col(df, "year").astype(str)
+
+    tables = {
+        "movies": pd.DataFrame({
+            "_id": movie_id,
+            "plot": _col(df, "plot"),
+            "runtime": _floats(_col(df, "runtime")),
+            "poster": _col(df, "poster"),
+            "title": _col(df, "title").astype("string"),
+            "fullplot": _col(df, "fullplot"),
+            "released": _dates(_col(df, "released")),
+            "rated": _col(df, "rated"),
+            "lastupdated": _timestamps(_col(df, "lastupdated")),
+            # First plausible 4-digit year, e.g. "2007è" or "1995-1998"
+            "year": _ints(year_raw.str.extract(r"((?:18|19|20)\d{2})", expand=False)),
+            "type": _col(df, "type"),
+            "num_mflix_comments": _ints(_col(df, "num_mflix_comments"), fill=0),
+            "metacritic": _floats(_col(df, "metacritic")),
+            "year_raw": year_raw,
+        }),
+        "writers": _explode(df, "writers", "writer"),
+        "directors": _explode(df, "directors", "director"),
+        "cast": _explode(df, "cast", "cast_member"),
+        "genres": _explode(df, "genres", "genre"),
+        "languages": _explode(df, "languages", "language"),
+        "countries": _explode(df, "countries", "country"),
+        "tomatoes": pd.DataFrame({
+            "movie_id": movie_id,
+            "viewer_rating": _floats(_col(df, "tomatoes.viewer.rating")),
+            "viewer_numreviews": _ints(_col(df, "tomatoes.viewer.numReviews"), fill=0),
+            "viewer_meter": _ints(_col(df, "tomatoes.viewer.meter"), fill=0),
+            "critic_rating": _floats(_col(df, "tomatoes.critic.rating")),
+            "critic_numreviews": _ints(_col(df, "tomatoes.critic.numReviews"), fill=0),
+            "critic_meter": _ints(_col(df, "tomatoes.critic.meter"), fill=0),
+            "boxoffice": _col(df, "tomatoes.boxOffice").fillna("Unknown"),
+            "consensus": _col(df, "tomatoes.consensus").fillna("No consensus available"),
+            "fresh": _ints(_col(df, "tomatoes.fresh"), fill=0),
+            "rotten": _ints(_col(df, "tomatoes.rotten"), fill=0),
+            "lastupdated": _timestamps(_col(df, "tomatoes.lastUpdated")),
+            "production": _col(df, "tomatoes.production").fillna("Unknown"),
+            "website": _col(df, "tomatoes.website").fillna("Unknown"),
+            "dvd_release": _dates(_col(df, "tomatoes.dvd")),
+        }),
+        "imdb": pd.DataFrame({
+            "movie_id": movie_id,
+            "imdb_rating": _floats(_col(df, "imdb.rating")),
+            "imdb_votes": _ints(_col(df, "imdb.votes"), fill=0),
+            "imdb_id": _col(df, "imdb.id").astype("string"),
+        }),
+        "awards": pd.DataFrame({
+            "movie_id": movie_id,
+            "award_wins": _ints(_col(df, "awards.wins")),
+            "award_nominations": _ints(_col(df, "awards.nominations")),
+            "award_text": _col(df, "awards.text"),
+        }),
+    }
+    return tables
+
+
+def transform_comments(docs):
+    df = pd.json_normalize(docs)
+    return {"comments": pd.DataFrame({
+        "_id": _ids(df["_id"]),
+        "name": _col(df, "name"),
+        "email": _col(df, "email"),
+        "movie_id": _ids(_col(df, "movie_id")),
+        "text": _col(df, "text"),
+        "date": _timestamps(_col(df, "date")),
+    })}
+
+
+def transform_users(docs):
+    df = pd.json_normalize(docs)
+    # "preferences" is empty in sample_mflix and is dropped, as in phase 1.2
+    return {"users": pd.DataFrame({
+        "_id": _ids(df["_id"]),
+        "name": _col(df, "name"),
+        "email": _col(df, "email"),
+        "password": _col(df, "password"),
+    })}
+
+
+def transform_theaters(docs):
+    df = pd.json_normalize(docs)
+    coordinates = _col(df, "location.geo.coordinates")
+    return {"theaters": pd.DataFrame({
+        "_id": _ids(df["_id"]),
+        "theaterId": _col(df, "theaterId").astype("Int64").astype(str),
+        "street1": _col(df, "location.address.street1"),
+        "street2": _col(df, "location.address.street2"),
+        "state": _col(df, "location.address.state"),
+        "city": _col(df, "location.address.city"),
+        "zipcode": _col(df, "location.address.zipcode"),
+        "type": _col(df, "location.geo.type"),
+        "Latitude": _floats(coordinates.str[0]),
+        "Longitude": _floats(coordinates.str[1]),
+    })}
+
+
+def transform_embedded_movies(docs):
+    df = pd.json_normalize(docs)
+    embeddings = _col(df, "plot_embedding")
+    has_vector = embeddings.map(lambda v: isinstance(v, (list, np.ndarray)) and len(v) > 0)
+    df = df[has_vector]
+    return {"plot_embedding": pd.DataFrame({
+        "_id": _ids(df["_id"]),
+        # Postgres array literal; numpy formats the whole vector at C speed
+        "plot_embedding": [
+            "{" + ",".join(np.asarray(v, dtype="float32").astype(str)) + "}" for v in df["plot_embedding"]
+        ],
+    })}
+
+
+TRANSFORMS = {
+    "movies": transform_movies,
+    "comments": transform_comments,
+    "users": transform_users,
+    "theaters": transform_theaters,
+}
+
+
+# --- Loading ---
+def _quote(name):
+    return f'"{name}"' if name == "cast" or name != name.lower() else name
+
+
+def copy_frame(cursor, table, frame):
+    """COPY one DataFrame into `table` through an in-memory CSV buffer."""
+    if frame.empty:
+        return 0
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+    buffer.seek(0)
+    columns = ", ".join(_quote(c) for c in frame.columns)
+    cursor.copy_expert(f"COPY {_quote(table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')", buffer)
+    return len(frame)
+
+
+def load_collection(connect, source, collection, batch_size=2000, dry_run=False):
+    """
+    Truncate and reload every table filled by `collection`.
+
+    Returns {table: (rows, seconds)} where seconds is the table's COPY time plus
+    the transform time of the batches it came from.
+    """
+    tables = COLLECTION_TABLES[collection]
+    counts = {t: 0 for t in tables}
+    seconds = {t: 0.0 for t in tables}
+
+    conn = None if dry_run else connect()
+    try:
+        cursor = None
+        if conn is not None:
+            cursor = conn.cursor()
+            for table in tables:
+                cursor.execute(TABLE_DDL[table])
+            cursor.execute(f"TRUNCATE {', '.join(_quote(t) for t in tables)} RESTART IDENTITY CASCADE")
+
+        for batch in source.batches(collection, batch_size):
+            t0 = time.perf_counter()
+            frames = TRANSFORMS[collection](batch)
+            transform_seconds = time.perf_counter() - t0
+            for table, frame in frames.items():
+                t0 = time.perf_counter()
+                counts[table] += copy_frame(cursor, table, frame) if cursor else len(frame)
+                seconds[table] += transform_seconds + time.perf_counter() - t0
+
+        if conn is not None:
+            conn.commit()
+    except Exception:
+        if conn is not None:
+            conn.rollback()
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return {t: (counts[t], seconds[t]) for t in tables}
+
+
+def load_plot_embeddings(connect, source, batch_size=500, dry_run=False):
+    """COPY embedded_movies vectors into a temp table and merge them into movies.plot_embedding."""
+    start = time.perf_counter()
+    rows = 0
+    conn = None if dry_run else connect()
+    try:
+        cursor = None
+        if conn is not None:
+            cursor = conn.cursor()
+            cursor.execute("ALTER TABLE movies ADD COLUMN IF NOT EXISTS plot_embedding REAL[]")
+            cursor.execute("CREATE TEMP TABLE staged_plot_embedding (_id TEXT, plot_embedding REAL[]) ON COMMIT DROP")
+        for batch in source.batches("embedded_movies", batch_size):
+            frame = transform_embedded_movies(batch)["plot_embedding"]
+            rows += copy_frame(cursor, "staged_plot_embedding", frame) if cursor else len(frame)
+        if conn is not None:
+            cursor.execute("""
+                UPDATE movies m SET plot_embedding = s.plot_embedding
+                FROM staged_plot_embedding s WHERE s._id = m._id
+            """)
+            conn.commit()
+    except Exception:
+        if conn is not None:
+            conn.rollback()
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+    return {"movies.plot_embedding": (rows, time.perf_counter() - start)}
+
+
+def run_etl(connect, source, collections=None, batch_size=2000, workers=4, dry_run=False, with_embeddings=True):
+    """Load independent collections in parallel and return {table: (rows, seconds)}."""
+    collections = [c for c in (collections or COLLECTION_TABLES) if source.has(c)]
+    report = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(load_collection, connect, source, c, batch_size, dry_run): c for c in collections
+        }
+        for future in as_completed(futures):
+            report.update(future.result())
+
+    # Vectors land on movies rows, so this waits for the movies load
+    if with_embeddings and source.has("embedded_movies"):
+        report.update(load_plot_embeddings(connect, source, dry_run=dry_run))
+    return report
+
+
+def print_report(report, total_seconds):
+    print(f"{'table':<24}{'rows':>10}{'rows/sec':>12}")
+    for table, (rows, seconds) in sorted(report.items()):
+        print(f"{table:<24}{rows:>10,}{rows / seconds if seconds else 0:>12,.0f}")
+    total = sum(r for r, _ in report.values())
+    print(f"{'total':<24}{total:>10,}{total / total_seconds if total_seconds else 0:>12,.0f}  ({total_seconds:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI"))
+    parser.add_argument("--mongo-db", default="sample_mflix")
+    parser.add_argument("--dump-dir", default=None, help="Directory of mongoexport <collection>.json files")
+    parser.add_argument("--mongomock", action="store_true", help="Serve --dump-dir through an in-memory mongomock cursor")
+    parser.add_argument("--collections", nargs="*", default=None, choices=list(COLLECTION_TABLES))
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--skip-embeddings", action="store_true", help="Do not load embedded_movies.plot_embedding")
+    parser.add_argument("--dry-run", action="store_true", help="Read and transform only; nothing is written")
+    args = parser.parse_args()
+
+    if args.dump_dir and args.mongomock:
+        source = MongoSource(mongomock_from_dump(args.dump_dir, args.mongo_db))
+    elif args.dump_dir:
+        source = DumpSource(args.dump_dir)
+    elif args.mongo_uri:
+        from pymongo import MongoClient
+        source = MongoSource(MongoClient(args.mongo_uri)[args.mongo_db])
+    else:
+        parser.error("give --mongo-uri (or MONGO_URI) or --dump-dir")
+
+    def connect():
+        import psycopg2
+        from config import db_host, db_port, db_name, db_user, db_password
+        return psycopg2.connect(host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password)
+
+    start = time.perf_counter()
+    report = run_etl(connect, source, args.collections, args.batch_size, args.workers,
+                     dry_run=args.dry_run, with_embeddings=not args.skip_embeddings)
+    print_report(report, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
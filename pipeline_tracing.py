@@ -0,0 +1,288 @@
+"""
+Per-stage timing and token accounting for answer_user_query.
+
+    with trace("answer_user_query", query=query) as t:   # one per question
+        with stage("retrieve") as span:                  # one per pipeline stage
+            docs = ...
+            span.set(docs=len(docs))
+
+Each finished trace is written as one JSON line (TRACE_LOG_PATH and the
+"mflix.trace" logger) and folded into Prometheus-style histograms
+(`render_prometheus`, optionally rewritten to TRACE_METRICS_PATH for the
+node_exporter textfile collector).
+
+With tracing disabled, or outside a trace, `trace` and `stage` return a shared
+no-op span after a single ContextVar lookup, so instrumented code costs
+next to nothing. Token counts are tiktoken estimates of the prompt and the
+returned text, the same estimate speculative_pipeline uses for wasted tokens.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import contextvars
+
+from config import TRACING_ENABLED, TRACE_LOG_PATH, TRACE_METRICS_PATH
+
+logger = logging.getLogger("mflix.trace")
+
+STAGE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000)
+
+_current = contextvars.ContextVar("pipeline_trace", default=None)
+
+
+# --- Histograms ---
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value, rendered in the Prometheus text format."""
+
+    def __init__(self, name, help_text, buckets, label="stage"):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {k: {**v, "counts": list(v["counts"])} for k, v in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self.snapshot().items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{label}}} {round(series['sum'], 3)}")
+            lines.append(f"{self.name}_count{{{label}}} {series['count']}")
+        return lines
+
+
+# --- Spans ---
+class _NullSpan:
+    """Stand-in returned when nothing is being traced; every method is a no-op."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def tokens(self, prompt, completion=None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.attrs = {}
+        self.start = None
+        self.elapsed_ms = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed_ms = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.add_span(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def tokens(self, prompt, completion=None):
+        from prompt_builder import count_tokens
+        self.attrs["prompt_tokens"] = count_tokens(prompt)
+        if isinstance(completion, str):
+            self.attrs["completion_tokens"] = count_tokens(completion)
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "offset_ms": round((self.start - self.trace.start) * 1000, 2),
+            "elapsed_ms": round(self.elapsed_ms, 2),
+            **self.attrs,
+        }
+
+
+class Trace:
+    """All spans of one question. Spans may be added from worker threads (speculation, asyncio.to_thread)."""
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.start = None
+        self.elapsed_ms = None
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed_ms = (time.perf_counter() - self.start) * 1000
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Generator finished in another context (abandoned stream); just detach
+            _current.set(None)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def tokens(self, prompt, completion=None):
+        pass
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        totals = {"prompt_tokens": 0, "completion_tokens": 0}
+        for span in spans:
+            for key in totals:
+                totals[key] += span.attrs.get(key, 0)
+        return {
+            "trace": self.name,
+            "timestamp": round(self.started_at, 3),
+            "elapsed_ms": round(self.elapsed_ms, 2) if self.elapsed_ms is not None else None,
+            **self.attrs,
+            **totals,
+            "stages": [s.to_dict() for s in spans],
+        }
+
+
+# --- Tracer ---
+class Tracer:
+    def __init__(self, enabled=False, log_path=None, metrics_path=None):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.last = None
+        # Callables that receive every finished trace record (e.g. load_test.py collecting them)
+        self.sinks = []
+        self._write_lock = threading.Lock()
+        self.stage_ms = Histogram("mflix_stage_duration_ms", "Wall time of one answer pipeline stage.", STAGE_BUCKETS_MS)
+        self.request_ms = Histogram("mflix_request_duration_ms", "End-to-end answer time by route.",
+                                    STAGE_BUCKETS_MS, label="route")
+        self.stage_tokens = Histogram("mflix_stage_tokens", "Estimated prompt + completion tokens of one LLM stage.",
+                                      TOKEN_BUCKETS)
+
+    def trace(self, name, **attrs):
+        """A new trace, or (inside one) a no-op: the enclosing trace already times the whole request."""
+        if not self.enabled:
+            return NULL_SPAN
+        # A span here would cover every other stage and land in the stage histograms as one more stage
+        if _current.get() is not None:
+            return NULL_SPAN
+        return Trace(self, name, attrs)
+
+    def finish(self, trace):
+        record = trace.to_dict()
+        self.last = record
+        self.request_ms.observe(record.get("route", "unknown"), record["elapsed_ms"])
+        for span in record["stages"]:
+            self.stage_ms.observe(span["stage"], span["elapsed_ms"])
+            tokens = span.get("prompt_tokens", 0) + span.get("completion_tokens", 0)
+            if tokens:
+                self.stage_tokens.observe(span["stage"], tokens)
+
+        for sink in self.sinks:
+            # A broken sink must not fail the request that produced the trace
+            try:
+                sink(record)
+            except Exception:
+                logger.exception("Trace sink %r failed", sink)
+
+        line = json.dumps(record, default=str)
+        logger.info(line)
+        # Like the sinks: a missing directory or a full disk must not fail the answered request
+        with self._write_lock:
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                except OSError:
+                    logger.exception("Could not append trace to %s", self.log_path)
+            if self.metrics_path:
+                try:
+                    self._write_metrics()
+                except OSError:
+                    logger.exception("Could not write metrics to %s", self.metrics_path)
+
+    def _write_metrics(self):
+        # Unique temp file: several app processes may export to the same textfile-collector path
+        directory = os.path.dirname(os.path.abspath(self.metrics_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.metrics_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, self.metrics_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def render_prometheus(self):
+        lines = self.request_ms.render() + self.stage_ms.render() + self.stage_tokens.render()
+        return "\n".join(lines) + "\n"
+
+
+TRACER = Tracer(TRACING_ENABLED, log_path=TRACE_LOG_PATH or None, metrics_path=TRACE_METRICS_PATH or None)
+
+
+def trace(name, **attrs):
+    return TRACER.trace(name, **attrs)
+
+
+def stage(name):
+    current = _current.get()
+    if current is None:
+        return NULL_SPAN
+    return Span(current, name)
+
+
+def annotate(**attrs):
+    """Attach attributes (route, cached, ...) to the trace of the current question, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def render_prometheus():
+    return TRACER.render_prometheus()
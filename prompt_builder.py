@@ -0,0 +1,290 @@
+import re
+import threading
+
+import numpy as np
+from sqlalchemy import inspect, text
+
+
+# Kept verbatim from the original hand-written prompts; the LLM still needs the reminder
+CAST_QUOTING_NOTE = (
+    'just a note: mention cast inside dounle cots if you have to use the table name or cast as '
+    'postgresql will mistake it to a key word if not used within double cots.'
+)
+
+# Columns that must never reach a prompt, not even as a name with sample values
+SENSITIVE_COLUMNS = {("users", "password"), ("users", "email"), ("comments", "email")}
+
+# Words users say -> tables they mean. Column and table names are matched automatically.
+TABLE_SYNONYMS = {
+    "movies": ["movie", "film", "title", "plot", "runtime", "released", "year", "rated", "poster", "metacritic", "longest", "shortest"],
+    "directors": ["director", "directed", "filmmaker", "by", "made"],
+    "writers": ["writer", "wrote", "written", "screenplay", "screenwriter"],
+    "cast": ["actor", "actress", "actors", "starring", "starred", "star", "stars", "cast", "played"],
+    "genres": ["genre", "comedy", "comedies", "drama", "horror", "thriller", "action", "documentary", "romance", "animation", "western", "crime"],
+    "languages": ["language", "spoken", "english", "french", "spanish", "japanese", "hindi", "german"],
+    "countries": ["country", "countries", "usa", "france", "india", "japan", "uk", "produced"],
+    "imdb": ["imdb", "rating", "ratings", "rated", "votes", "highest", "lowest", "best", "worst", "top"],
+    "tomatoes": ["tomatoes", "rotten", "critic", "critics", "viewer", "fresh", "consensus", "box", "office", "boxoffice", "production", "dvd"],
+    "awards": ["award", "awards", "oscar", "oscars", "won", "wins", "nomination", "nominations", "nominated"],
+    "comments": ["comment", "comments", "review", "reviews", "said"],
+    "users": ["user", "users", "member", "members"],
+    "theaters": ["theater", "theaters", "theatre", "cinema", "cinemas", "city", "state", "zipcode", "street"],
+}
+
+MAX_SAMPLE_CHARS = 40
+# Sample values are picked from the first rows only, so startup never scans a whole table
+SAMPLE_SCAN_ROWS = 1000
+
+
+def count_tokens(text_value, model_name="gpt-3.5-turbo"):
+    """Token count for `text_value`; falls back to ~4 chars/token when tiktoken is unavailable."""
+    encoder = _get_encoder(model_name)
+    if encoder is not None:
+        return len(encoder.encode(text_value))
+    return max(1, len(text_value) // 4)
+
+
+_encoders = {}
+
+def _get_encoder(model_name):
+    if model_name not in _encoders:
+        try:
+            import tiktoken
+            _encoders[model_name] = tiktoken.encoding_for_model(model_name)
+        except Exception:
+            # tiktoken missing or its BPE file cannot be downloaded (offline)
+            _encoders[model_name] = None
+    return _encoders[model_name]
+
+
+def _quote(name):
+    return f'"{name}"' if name.lower() == "cast" or name != name.lower() else name
+
+
+def _words(value):
+    return set(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+# --- Schema Introspection ---
+def introspect_schema(engine, schema=None, sample_rows=3):
+    """
+    Read tables, columns, keys and a few sample values through SQLAlchemy.
+
+    Returns {table: {"columns": [(name, type)], "primary_key": [...],
+    "foreign_keys": [(column, ref_table, ref_column)], "samples": {column: [values]}}}.
+    """
+    inspector = inspect(engine)
+    tables = {}
+    for table in inspector.get_table_names(schema=schema):
+        columns = [
+            (c["name"], str(c["type"]).lower())
+            for c in inspector.get_columns(table, schema=schema)
+            if (table, c["name"]) not in SENSITIVE_COLUMNS
+        ]
+        pk = inspector.get_pk_constraint(table, schema=schema).get("constrained_columns", [])
+        fks = [
+            (fk["constrained_columns"][0], fk["referred_table"], fk["referred_columns"][0])
+            for fk in inspector.get_foreign_keys(table, schema=schema)
+            if fk.get("constrained_columns") and fk.get("referred_columns")
+        ]
+        tables[table] = {"columns": columns, "primary_key": pk, "foreign_keys": fks, "samples": {}}
+
+    if sample_rows:
+        with engine.connect() as conn:
+            for table, info in tables.items():
+                text_columns = [
+                    name for name, type_ in info["columns"]
+                    if ("char" in type_ or "text" in type_) and not name.endswith("_id") and name != "_id"
+                ]
+                for name in text_columns:
+                    rows = conn.execute(text(
+                        f"SELECT DISTINCT {_quote(name)} FROM ("
+                        f"SELECT {_quote(name)} FROM {_quote(table)} "
+                        f"WHERE {_quote(name)} IS NOT NULL LIMIT {SAMPLE_SCAN_ROWS}"
+                        f") AS sample LIMIT {int(sample_rows)}"
+                    )).fetchall()
+                    info["samples"][name] = [str(r[0])[:MAX_SAMPLE_CHARS] for r in rows]
+    return tables
+
+
+class SchemaPromptBuilder:
+    """
+    Builds text-to-SQL and classification prompts from a cached schema description.
+
+    Only the tables relevant to the question (lexical match on table/column names and
+    TABLE_SYNONYMS, optionally embedding similarity) are included, in relevance order,
+    until `token_budget` is reached.
+    """
+
+    def __init__(self, schema, token_budget=600, embed_fn=None, model_name="gpt-3.5-turbo"):
+        self.schema = schema
+        self.token_budget = token_budget
+        self.embed_fn = embed_fn
+        self.model_name = model_name
+
+        # Pre-render two variants per table so per-query work is just selection
+        self.table_text = {t: self._describe(t, with_samples=True) for t in schema}
+        self.table_text_compact = {t: self._describe(t, with_samples=False) for t in schema}
+        self.table_tokens = {t: count_tokens(v, model_name) for t, v in self.table_text.items()}
+        self.table_tokens_compact = {t: count_tokens(v, model_name) for t, v in self.table_text_compact.items()}
+        self.table_words = {t: self._vocabulary(t) for t in schema}
+        self.table_vectors = self._embed_tables() if embed_fn is not None else None
+
+    @classmethod
+    def from_engine(cls, engine, **kwargs):
+        sample_rows = kwargs.pop("sample_rows", 3)
+        return cls(introspect_schema(engine, sample_rows=sample_rows), **kwargs)
+
+    # --- Description ---
+    def _describe(self, table, with_samples):
+        info = self.schema[table]
+        references = {column: f"{_quote(t)}.{_quote(c)}" for column, t, c in info["foreign_keys"]}
+        parts = []
+        for name, type_ in info["columns"]:
+            item = f"{_quote(name)} {type_.split('(')[0]}"
+            if name in info["primary_key"]:
+                item += " pk"
+            if name in references:
+                item += f" -> {references[name]}"
+            samples = info["samples"].get(name) if with_samples else None
+            if samples:
+                item += " e.g. " + " | ".join(repr(s) for s in samples)
+            parts.append(item)
+        return f"{_quote(table)}({', '.join(parts)})"
+
+    def _vocabulary(self, table):
+        words = _words(table) | set(TABLE_SYNONYMS.get(table, []))
+        for name, _ in self.schema[table]["columns"]:
+            words |= _words(name.replace("_", " "))
+        # Keys are shared by every child table and say nothing about relevance
+        generic = {"id"} if table == "movies" else {"id", "movie"}
+        return words - generic
+
+    def _embed_tables(self):
+        vectors = np.array([self.embed_fn(self.table_text_compact[t]) for t in self.schema], dtype="float32")
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # --- Selection ---
+    def rank_tables(self, query):
+        query_words = _words(query)
+        scores = {t: len(query_words & words) for t, words in self.table_words.items()}
+
+        if self.table_vectors is not None:
+            vector = np.asarray(self.embed_fn(query), dtype="float32")
+            vector /= np.linalg.norm(vector) or 1.0
+            for table, similarity in zip(self.schema, self.table_vectors @ vector):
+                scores[table] += float(similarity)
+
+        ranked = [t for t in sorted(scores, key=lambda t: -scores[t]) if scores[t] > 0]
+        # Every movie question joins through movies; keep it right behind the best match
+        if "movies" in self.schema and "movies" not in ranked and not set(ranked) <= {"users", "theaters"}:
+            ranked.insert(1 if ranked else 0, "movies")
+        return ranked
+
+    def select_tables(self, query, token_budget=None):
+        budget = self.token_budget if token_budget is None else token_budget
+        chosen, used = [], 0
+        for table in self.rank_tables(query):
+            full, compact = self.table_tokens[table], self.table_tokens_compact[table]
+            if used + full <= budget:
+                chosen.append((table, self.table_text[table]))
+                used += full
+            elif used + compact <= budget:
+                chosen.append((table, self.table_text_compact[table]))
+                used += compact
+        return chosen
+
+    def schema_overview(self):
+        """Table and column names only; enough for the structured/semantic decision."""
+        return "\n    ".join(self.table_text_compact[t] for t in self.schema)
+
+    # --- Prompts ---
+    def build_sql_prompt(self, query):
+        tables = self.select_tables(query)
+        schema_text = "\n    ".join(description for _, description in tables)
+        return f"""
+    Given this user query, write a PostgreSQL query for the tables in mflix database :
+    understand the user query and use appropriate column names to write the query, example if user mentions movie name in question, you should be able to understand that title column in the movies table is what user could be reffering.
+    Child tables join to movies on movie_id = movies._id.
+    Relevant tables (columns, types and example values):
+
+    {schema_text}
+
+    {CAST_QUOTING_NOTE}
+    Query: "{query}"
+
+    Return only the SQL code, do not explain anything.
+    """
+
+    def build_classifier_prompt(self, query):
+        return f"""
+    You are an intelligent query classifier for a movie database. Classify the query as Structured or Semantic.
+
+    Structured: the answer can be looked up, filtered or aggregated from the tables below (e.g. director of X, actors in Y, movies released in a year, counts, average ratings).
+    Semantic: the question needs meaning-based understanding such as recommendations, similarity, or subjective/open-ended reasoning (e.g. "movies similar to...", "what's a good movie?").
+
+    Tables:
+    {self.schema_overview()}
+
+    {CAST_QUOTING_NOTE}
+    Query: "{query}"
+    Answer with one word:
+    """
+
+    def build_batch_classifier_prompt(self, queries):
+        """Classifier prompt for several questions at once; the schema overview is sent only once."""
+        numbered = "\n    ".join(f'{i}. "{q}"' for i, q in enumerate(queries, 1))
+        return f"""
+    You are an intelligent query classifier for a movie database. Classify each query below as Structured or Semantic.
+
+    Structured: the answer can be looked up, filtered or aggregated from the tables below (e.g. director of X, actors in Y, movies released in a year, counts, average ratings).
+    Semantic: the question needs meaning-based understanding such as recommendations, similarity, or subjective/open-ended reasoning (e.g. "movies similar to...", "what's a good movie?").
+
+    Tables:
+    {self.schema_overview()}
+
+    Queries:
+    {numbered}
+
+    Answer with one line per query, in order, formatted as "<number>: Structured" or "<number>: Semantic".
+    """
+
+    def prompt_stats(self, query):
+        prompt = self.build_sql_prompt(query)
+        return {
+            "tables": [t for t, _ in self.select_tables(query)],
+            "prompt_tokens": count_tokens(prompt, self.model_name),
+            "full_schema_tokens": sum(self.table_tokens.values()),
+        }
+
+
+# --- Process-wide cache ---
+_builders = {}
+_builders_lock = threading.Lock()
+
+def get_prompt_builder(engine, **kwargs):
+    """Introspect once per database URL and reuse the builder afterwards (one per distinct set of options)."""
+    # Options are part of the key, so a caller asking for another token_budget/embed_fn never gets a stale builder
+    key = (str(engine.url), tuple(sorted(kwargs.items())))
+    with _builders_lock:
+        if key not in _builders:
+            _builders[key] = SchemaPromptBuilder.from_engine(engine, **kwargs)
+        return _builders[key]
+
+
+if __name__ == "__main__":
+    # Print per-query prompt sizes for the router evaluation questions
+    import json
+    from sqlalchemy import create_engine
+    from config import DB_URI
+
+    builder = get_prompt_builder(create_engine(DB_URI))
+    with open("eval/router_eval.jsonl", encoding="utf-8") as f:
+        questions = [json.loads(line)["query"] for line in f if line.strip()]
+    sizes = []
+    for q in questions:
+        stats = builder.prompt_stats(q)
+        sizes.append(stats["prompt_tokens"])
+        print(f"{stats['prompt_tokens']:>5} tokens  {','.join(stats['tables']):<40} {q}")
+    print(f"\nfull schema with samples: {stats['full_schema_tokens']} tokens; "
+          f"per-query prompt mean {np.mean(sizes):.0f}, max {max(sizes)}")
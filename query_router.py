@@ -0,0 +1,171 @@
+import re
+import math
+import time
+import threading
+from collections import namedtuple
+
+from sqlalchemy import text
+
+
+RouteDecision = namedtuple("RouteDecision", ["label", "confidence", "source", "elapsed_ms"])
+
+# --- Lexical Signals ---
+# (pattern, weight). Structured cues point at columns/aggregations, semantic cues at similarity and taste.
+STRUCTURED_PATTERNS = [
+    (r"\bwho (directed|wrote|starred|acted|plays?)\b", 2.0),
+    (r"\b(director|directors|writer|writers|cast|actors?|actress(es)?)\b", 1.0),
+    (r"\bhow (many|much|long)\b", 2.0),
+    (r"\b(count|number of|average|avg|total|sum|max(imum)?|min(imum)?)\b", 1.5),
+    (r"\b(list|show|give me|find|which)\b", 0.5),
+    (r"\b(longest|shortest|oldest|newest|latest|earliest)\b", 1.0),
+    (r"\b(top|highest|lowest|best|worst)[ -]?(\d+|rated|grossing|ranked)?\b", 0.75),
+    (r"\b(released|came out|year|runtime|rated|rating|ratings|votes|metacritic)\b", 1.0),
+    (r"\b(imdb|tomatoes|rotten|box ?office|awards?|won|wins|nominations?|oscars?)\b", 1.0),
+    (r"\b(genres?|language|languages|country|countries)\b", 1.0),
+    (r"\b(theaters?|cinemas?|comments?|users?|zip ?code|city|state)\b", 1.5),
+    (r"\b(in|from|before|after|since|between) (18|19|20)\d\d\b", 1.5),
+    (r"\b(18|19|20)\d0s\b", 0.75),
+    # Not "with": "films with a strong female lead" describes taste, not a cast lookup
+    (r"\b(movies|films) (by|starring|directed by|featuring)\b", 1.5),
+    (r"\b(stars?|starred|appears?|appeared) in\b", 1.5),
+    (r"\b(written|directed|produced) by\b", 1.5),
+    (r"\b(films?|movies?)( \w+){1,3} (directed|wrote|produced)\b", 1.5),
+    (r"\b(when (did|was|were)|come out|release date)\b", 1.5),
+    (r"\bwhat (is|was) the (plot|runtime|rating|year|title)\b", 1.5),
+]
+
+SEMANTIC_PATTERNS = [
+    (r"\b(similar|like|resembl\w*|reminds? me of|in the style of|vibe|feel)\b", 2.0),
+    (r"\b(something|anything|films?|movies?) as \w+ as\b", 2.0),
+    (r"\b(recommend\w*|suggest\w*|should i (watch|see)|worth watching|what to watch)\b", 2.5),
+    (r"\b(good|great|fun|feel[- ]good|uplifting|dark|scary|sad|romantic|thought[- ]provoking|mind[- ]bending)\b", 0.75),
+    (r"\b(about|themes?|story of|deals with|explores?)\b", 0.75),
+    (r"\b(make you|makes me|when i('m| am)|for a (date|rainy|family))\b", 1.5),
+    (r"\b(explain|summari[sz]e|why)\b", 1.0),
+]
+
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "by", "for", "and", "or", "is", "it", "me",
+    "my", "i", "you", "what", "who", "which", "with", "movie", "movies", "film", "films", "like",
+}
+
+
+def _compile(patterns):
+    return [(re.compile(p, re.IGNORECASE), w) for p, w in patterns]
+
+
+def _tokens(query):
+    return re.findall(r"[\w'&.-]+", query.lower())
+
+
+# --- Vocabulary ---
+def load_router_vocabulary(engine, max_people=50000):
+    """Load known entity names from Postgres so the router can recognise them in questions."""
+    queries = {
+        "title": "SELECT DISTINCT lower(title) FROM movies WHERE title IS NOT NULL",
+        "person": f"""
+            SELECT name FROM (
+                SELECT lower(director) AS name, count(*) AS n FROM directors GROUP BY 1
+                UNION ALL
+                SELECT lower(cast_member), count(*) FROM "cast" GROUP BY 1
+            ) p WHERE name IS NOT NULL AND name <> 'unknown'
+            ORDER BY n DESC LIMIT {int(max_people)}
+        """,
+        "genre": "SELECT DISTINCT lower(genre) FROM genres WHERE genre IS NOT NULL",
+        "language": "SELECT DISTINCT lower(language) FROM languages WHERE language IS NOT NULL",
+        "country": "SELECT DISTINCT lower(country) FROM countries WHERE country IS NOT NULL",
+    }
+    vocabulary = {}
+    with engine.connect() as conn:
+        for kind, sql in queries.items():
+            vocabulary[kind] = {row[0] for row in conn.execute(text(sql))}
+    return vocabulary
+
+
+class QueryRouter:
+    """
+    Local structured/semantic classifier that replaces the LLM call in the common case.
+
+    Keyword rules and entity matches (titles, people, genres, languages, countries
+    from Postgres) produce a score for each class; when the margin between them is
+    too small the router falls back to the LLM classifier.
+    """
+
+    # How much a recognised entity pushes towards each class
+    ENTITY_WEIGHTS = {
+        "person": ("structured", 1.5),
+        "genre": ("structured", 0.5),
+        "language": ("structured", 1.0),
+        "country": ("structured", 1.0),
+        "title": ("structured", 0.75),
+    }
+
+    def __init__(self, vocabulary=None, confidence_threshold=0.6, max_ngram=6):
+        self.confidence_threshold = confidence_threshold
+        self.max_ngram = max_ngram
+        self.structured_patterns = _compile(STRUCTURED_PATTERNS)
+        self.semantic_patterns = _compile(SEMANTIC_PATTERNS)
+        self.vocabulary = {}
+        for kind, names in (vocabulary or {}).items():
+            # Single short words ("up", "her", "it") collide with ordinary English
+            self.vocabulary[kind] = {
+                n for n in names
+                if n and (" " in n or (len(n) >= 4 and n not in STOPWORDS))
+            }
+        self.stats = {"local": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def record(self, source):
+        """Count one routing decision made by `source` ("local" or "llm"); safe from any thread."""
+        with self._lock:
+            self.stats[source] += 1
+
+    def match_entities(self, query):
+        tokens = _tokens(query)
+        found = {}
+        for size in range(min(self.max_ngram, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                gram = " ".join(tokens[start:start + size])
+                for kind, names in self.vocabulary.items():
+                    if gram in names:
+                        found.setdefault(kind, []).append(gram)
+        return found
+
+    def score(self, query):
+        structured = sum(w for p, w in self.structured_patterns if p.search(query))
+        semantic = sum(w for p, w in self.semantic_patterns if p.search(query))
+
+        entities = self.match_entities(query) if self.vocabulary else {}
+        for kind, matches in entities.items():
+            label, weight = self.ENTITY_WEIGHTS.get(kind, ("structured", 0.5))
+            if kind == "title" and semantic > 0:
+                # "movies like <title>" is the recommendation pattern, not a lookup
+                continue
+            if label == "structured":
+                structured += weight
+            else:
+                semantic += weight
+        return structured, semantic, entities
+
+    def classify(self, query):
+        """Local decision only: returns a RouteDecision with source='local'."""
+        start = time.perf_counter()
+        structured, semantic, _ = self.score(query)
+        margin = structured - semantic
+        label = "structured" if margin > 0 else "semantic"
+        # Squash the margin into 0..1; no evidence at all means no confidence
+        confidence = 1.0 - math.exp(-abs(margin)) if (structured or semantic) else 0.0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return RouteDecision(label, round(confidence, 3), "local", elapsed_ms)
+
+    def route(self, query, llm_fallback=None):
+        """Classify locally and only call `llm_fallback(query)` when confidence is low."""
+        decision = self.classify(query)
+        if decision.confidence >= self.confidence_threshold or llm_fallback is None:
+            self.record("local")
+            return decision
+        start = time.perf_counter()
+        label = llm_fallback(query)
+        self.record("llm")
+        elapsed_ms = decision.elapsed_ms + (time.perf_counter() - start) * 1000
+        return RouteDecision(label, decision.confidence, "llm", elapsed_ms)
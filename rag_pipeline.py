@@ -0,0 +1,205 @@
+import re
+import time
+
+import pipeline_tracing as tracing
+from prompt_builder import get_prompt_builder
+from sql_executor import execute_read_only
+from sql_cache import get_sql_result_cache
+from config import (
+    SQL_MAX_ROWS, SQL_STATEMENT_TIMEOUT_MS, SQL_FETCH_CHUNK_ROWS, SQL_COUNT_TRUNCATED,
+    SQL_CACHE_ENABLED, SQL_CACHE_MAX_MB, SQL_CACHE_DIR, SQL_CACHE_DISK_MAX_MB, SQL_CACHE_VERSION_REFRESH_SECONDS,
+)
+
+BATCH_LABEL_PATTERN = re.compile(r"^\s*(\d+)\s*[:.)-]\s*\**\s*(structured|semantic)", re.IGNORECASE | re.MULTILINE)
+
+
+# --- Helper Functions ---
+def sql_result_cache(engine):
+    if not SQL_CACHE_ENABLED:
+        return None
+    return get_sql_result_cache(
+        engine,
+        max_bytes=SQL_CACHE_MAX_MB * 1024 * 1024,
+        spill_dir=SQL_CACHE_DIR or None,
+        max_disk_bytes=SQL_CACHE_DISK_MAX_MB * 1024 * 1024,
+        chunk_rows=SQL_FETCH_CHUNK_ROWS,
+        refresh_seconds=SQL_CACHE_VERSION_REFRESH_SECONDS,
+    )
+
+def query_postgres(sql, engine):
+    with tracing.stage("sql_execute") as span:
+        # Different questions often produce the same SQL; serve those from the result cache
+        cache = sql_result_cache(engine)
+        if cache is not None:
+            cached = cache.get(sql)
+            if cached is not None:
+                span.set(rows=len(cached), cached=True)
+                return cached
+
+        # Generated SQL is validated as read-only and fetched through a capped server-side cursor
+        result = execute_read_only(
+            sql, engine,
+            max_rows=SQL_MAX_ROWS,
+            statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS,
+            chunk_size=SQL_FETCH_CHUNK_ROWS,
+            count_truncated=SQL_COUNT_TRUNCATED,
+        )
+        span.set(rows=len(result), cached=False, truncated=result.truncated)
+        if cache is not None:
+            cache.put(sql, result)
+        return result
+
+def predict(llm, prompt, stage_name):
+    """llm.predict recorded as pipeline stage `stage_name` (wall time and token estimates)."""
+    with tracing.stage(stage_name) as span:
+        response = llm.predict(prompt)
+        span.tokens(prompt, response)
+    return response
+
+def classify_query_type(query, llm, prompt_builder):
+    prompt = prompt_builder.build_classifier_prompt(query)
+    response = predict(llm, prompt, "classify")
+    return "structured" if "structured" in response.lower() else "semantic"
+
+def classify_query_batch(queries, llm, prompt_builder):
+    """One LLM call for several questions; any the reply leaves out are classified one by one."""
+    prompt = prompt_builder.build_batch_classifier_prompt(queries)
+    response = predict(llm, prompt, "classify_batch")
+    labels = {int(n): label.lower() for n, label in BATCH_LABEL_PATTERN.findall(response)}
+    return [labels.get(i) or classify_query_type(q, llm, prompt_builder) for i, q in enumerate(queries, 1)]
+
+
+# --- Structured Branch ---
+def generate_sql(query, llm, prompt_builder):
+    prompt = prompt_builder.build_sql_prompt(query)
+    return predict(llm, prompt, "generate_sql")
+
+def run_generated_sql(sql, engine):
+    try:
+        df = query_postgres(sql, engine)
+        return df
+        # return df.head(10).to_markdown()
+
+    except Exception as e:
+        return f"SQL Error: {e}\nGenerated SQL: {sql}"
+
+def handle_structured_query(query, llm, engine, prompt_builder):
+    sql = generate_sql(query, llm, prompt_builder)
+    return run_generated_sql(sql, engine)
+
+# --- Semantic Branch ---
+def retrieve_documents(query, faiss_index, k=5):
+    with tracing.stage("retrieve") as span:
+        docs = faiss_index.similarity_search(query, k=k)
+        span.set(docs=len(docs))
+    return docs
+
+def build_semantic_prompt(query, docs):
+    # --- CRITICAL CHANGE HERE ---
+    # Construct the context by explicitly including the title from metadata
+    context_parts = []
+    for doc in docs:
+        movie_title = doc.metadata.get('title', 'Unknown Title')
+        movie_plot = doc.page_content # This is the plot, as you stored it
+        context_parts.append(f"Title: {movie_title}\nPlot: {movie_plot}")
+
+    context = "\n---\n".join(context_parts)
+    # --- END CRITICAL CHANGE ---
+
+    # Extract the movie title from the query if present, for better contextualization
+    movie_in_query_match = re.search(r'movie like "([^"]+)"|movie like (\w[\w\s]*\w)', query, re.IGNORECASE)
+    movie_in_query = None
+    if movie_in_query_match:
+        movie_in_query = movie_in_query_match.group(1) or movie_in_query_match.group(2)
+        if movie_in_query:
+            movie_in_query = movie_in_query.strip().replace('"', '')
+
+    prompt = f"""
+    You are a helpful movie recommendation assistant. Based on the provided movie details (including titles and plot summaries), suggest movies that are similar to the movie mentioned in the user's query.
+
+    Here are some relevant movie details:
+    {context}
+
+    ---
+
+    **Instructions for your answer:**
+    1. If the user explicitly mentioned a movie title in their query (e.g., "Triple Cross"), start your response by acknowledging that movie, like: "For a movie similar to '[Movie Name from Query]', consider these:"
+    2. Then, suggest 1 to 3 movies from the provided context that are similar or relevant.
+    3. For each suggested movie, **extract its exact Title from the "Title: " prefix in the provided details.**
+    4. Present each suggestion with its **Title first**, followed by a brief explanation of why it's a good suggestion, drawing from its plot summary.
+    5. If no relevant suggestions can be made from the provided context, state that clearly.
+
+    Question: {query}
+    Answer:
+    """
+    return prompt
+
+def handle_semantic_query(query, faiss_index, llm):
+    docs = retrieve_documents(query, faiss_index)
+    return predict(llm, build_semantic_prompt(query, docs), "answer")
+
+def stream_semantic_query(query, faiss_index, llm):
+    """Same as handle_semantic_query but yields the answer text chunk by chunk as the LLM produces it."""
+    docs = retrieve_documents(query, faiss_index)
+    prompt = build_semantic_prompt(query, docs)
+    with tracing.stage("answer") as span:
+        parts = []
+        for chunk in llm.stream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        span.tokens(prompt, "".join(parts))
+
+
+# --- Answer Pipeline ---
+def route_query(query, llm, router=None, prompt_builder=None):
+    classify = lambda q: classify_query_type(q, llm, prompt_builder)
+    label = router.route(query, llm_fallback=classify).label if router is not None else classify(query)
+    tracing.annotate(route=label)
+    return label
+
+def answer_user_query(query, llm, engine, faiss_index, router=None, prompt_builder=None):
+    with tracing.trace("answer_user_query", query=query):
+        # Schema is introspected once per database and reused by every later call
+        prompt_builder = prompt_builder or get_prompt_builder(engine)
+        qtype = route_query(query, llm, router, prompt_builder)
+        if qtype == "structured":
+            return handle_structured_query(query, llm, engine, prompt_builder)
+        else:
+            return handle_semantic_query(query, faiss_index, llm)
+
+def answer_user_query_stream(query, llm, engine, faiss_index, router=None, prompt_builder=None):
+    """
+    Generator version of answer_user_query.
+
+    Semantic answers are yielded as text chunks; structured answers are yielded
+    once, as the DataFrame (or SQL error string) from handle_structured_query.
+    """
+    with tracing.trace("answer_user_query", query=query):
+        prompt_builder = prompt_builder or get_prompt_builder(engine)
+        qtype = route_query(query, llm, router, prompt_builder)
+        if qtype == "structured":
+            yield handle_structured_query(query, llm, engine, prompt_builder)
+        else:
+            yield from stream_semantic_query(query, faiss_index, llm)
+
+def timed_stream(chunks, timing):
+    """
+    Pass `chunks` through unchanged while filling `timing` with
+    ttft_ms (time to first chunk), total_ms and the number of chunks.
+    """
+    start = time.perf_counter()
+    timing.update(ttft_ms=None, total_ms=None, chunks=0)
+    for chunk in chunks:
+        if timing["ttft_ms"] is None:
+            timing["ttft_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        timing["chunks"] += 1
+        yield chunk
+    timing["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+def collect_stream(chunks):
+    """Join a streamed answer back into what answer_user_query would have returned."""
+    parts = list(chunks)
+    if len(parts) == 1 and not isinstance(parts[0], str):
+        return parts[0]
+    return "".join(parts)
@@ -0,0 +1,245 @@
+"""
+Versioned schema migrations for the normalized mflix Postgres database.
+
+    python schema_migrations.py status
+    python schema_migrations.py migrate [--with-movie-card]
+    python schema_migrations.py refresh-movie-card
+    python schema_migrations.py benchmark --output before.json
+    python schema_migrations.py benchmark --output after.json --compare before.json
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from config import DB_URI
+
+
+# Child tables created in phase 1.3 with a movie_id foreign key but no index on it.
+# imdb and awards already have movie_id as their primary key.
+MOVIE_CHILD_TABLES = ["writers", "directors", "cast", "genres", "languages", "countries", "tomatoes", "comments"]
+
+# (table, column) pairs searched with ILIKE / fuzzy matching by generated SQL
+TRIGRAM_COLUMNS = [("movies", "title"), ("directors", "director"), ("cast", "cast_member"), ("writers", "writer")]
+
+
+def _q(name):
+    return f'"{name}"' if name == "cast" else name
+
+
+MOVIE_CARD_VIEW = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS movie_card AS
+SELECT
+    m._id AS movie_id,
+    m.title,
+    m.year,
+    m.runtime,
+    m.rated,
+    m.released,
+    m.plot,
+    i.imdb_rating,
+    i.imdb_votes,
+    t.viewer_rating AS tomatoes_viewer_rating,
+    t.critic_rating AS tomatoes_critic_rating,
+    a.award_wins,
+    a.award_nominations,
+    (SELECT string_agg(DISTINCT d.director, ', ') FROM directors d WHERE d.movie_id = m._id) AS directors,
+    (SELECT string_agg(DISTINCT w.writer, ', ') FROM writers w WHERE w.movie_id = m._id) AS writers,
+    (SELECT string_agg(DISTINCT c.cast_member, ', ') FROM "cast" c WHERE c.movie_id = m._id) AS cast_members,
+    (SELECT array_agg(DISTINCT g.genre) FROM genres g WHERE g.movie_id = m._id) AS genres,
+    (SELECT array_agg(DISTINCT l.language) FROM languages l WHERE l.movie_id = m._id) AS languages,
+    (SELECT array_agg(DISTINCT co.country) FROM countries co WHERE co.movie_id = m._id) AS countries
+FROM movies m
+LEFT JOIN imdb i ON i.movie_id = m._id
+LEFT JOIN awards a ON a.movie_id = m._id
+LEFT JOIN LATERAL (
+    SELECT viewer_rating, critic_rating FROM tomatoes tt WHERE tt.movie_id = m._id ORDER BY tt.id LIMIT 1
+) t ON true
+"""
+
+# --- Migrations ---
+# (version, name, statements, optional). Applied in order inside one transaction each.
+MIGRATIONS = [
+    (1, "movie_id btree indexes", [
+        f"CREATE INDEX IF NOT EXISTS idx_{t}_movie_id ON {_q(t)} (movie_id)" for t in MOVIE_CHILD_TABLES
+    ], False),
+    (2, "trigram indexes for fuzzy title and person search", ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+        f"CREATE INDEX IF NOT EXISTS idx_{t}_{c}_trgm ON {_q(t)} USING gin ({c} gin_trgm_ops)" for t, c in TRIGRAM_COLUMNS
+    ], False),
+    (3, "lookup indexes for common filters", [
+        "CREATE INDEX IF NOT EXISTS idx_movies_year ON movies (year)",
+        "CREATE INDEX IF NOT EXISTS idx_genres_genre ON genres (genre)",
+        "CREATE INDEX IF NOT EXISTS idx_imdb_rating ON imdb (imdb_rating)",
+    ], False),
+    (4, "movie_card materialized view", [
+        MOVIE_CARD_VIEW,
+        # Unique index is required for REFRESH ... CONCURRENTLY
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_movie_card_movie_id ON movie_card (movie_id)",
+        "CREATE INDEX IF NOT EXISTS idx_movie_card_title_trgm ON movie_card USING gin (title gin_trgm_ops)",
+    ], True),
+]
+
+
+def ensure_migrations_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        ensure_migrations_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(engine, include_optional=False, target=None):
+    done = applied_versions(engine)
+    for version, name, statements, optional in MIGRATIONS:
+        if version in done or (optional and not include_optional):
+            continue
+        if target is not None and version > target:
+            break
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"), {"v": version, "n": name})
+        print(f"✅ Applied {version:03d} {name} in {time.perf_counter() - start:.1f}s")
+    with engine.begin() as conn:
+        # Fresh indexes are only used well once the planner has statistics
+        conn.execute(text("ANALYZE"))
+
+
+def status(engine):
+    done = applied_versions(engine)
+    for version, name, _, optional in MIGRATIONS:
+        state = "applied" if version in done else ("optional" if optional else "pending")
+        print(f"{version:03d}  {state:<9} {name}")
+
+
+def refresh_movie_card(engine, concurrently=True):
+    """Rebuild movie_card after the base tables change. CONCURRENTLY keeps it readable meanwhile."""
+    start = time.perf_counter()
+    # REFRESH ... CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}movie_card"))
+    print(f"✅ movie_card refreshed in {time.perf_counter() - start:.1f}s")
+
+
+# --- Benchmark ---
+# SQL of the shape the text-to-SQL prompt produces for common questions
+BENCHMARK_QUERIES = {
+    "movies_by_director": """
+        SELECT m.title, m.year FROM movies m JOIN directors d ON d.movie_id = m._id
+        WHERE d.director ILIKE '%Christopher Nolan%' ORDER BY m.year""",
+    "director_of_title": """
+        SELECT d.director FROM directors d JOIN movies m ON m._id = d.movie_id
+        WHERE m.title ILIKE '%godfather%'""",
+    "cast_of_title": """
+        SELECT c.cast_member FROM "cast" c JOIN movies m ON m._id = c.movie_id
+        WHERE m.title ILIKE 'Forrest Gump'""",
+    "movies_with_actor": """
+        SELECT m.title FROM movies m JOIN "cast" c ON c.movie_id = m._id
+        WHERE c.cast_member ILIKE '%Tom Hanks%'""",
+    "genre_year_top_rated": """
+        SELECT m.title, i.imdb_rating FROM movies m
+        JOIN genres g ON g.movie_id = m._id JOIN imdb i ON i.movie_id = m._id
+        WHERE g.genre = 'Comedy' AND m.year = 2010 ORDER BY i.imdb_rating DESC NULLS LAST LIMIT 10""",
+    "title_full_card_joins": """
+        SELECT m.title, i.imdb_rating, t.critic_rating, string_agg(DISTINCT g.genre, ', ') AS genres,
+               string_agg(DISTINCT l.language, ', ') AS languages
+        FROM movies m
+        LEFT JOIN imdb i ON i.movie_id = m._id LEFT JOIN tomatoes t ON t.movie_id = m._id
+        LEFT JOIN genres g ON g.movie_id = m._id LEFT JOIN languages l ON l.movie_id = m._id
+        WHERE m.title ILIKE '%inception%' GROUP BY m.title, i.imdb_rating, t.critic_rating""",
+    "comments_for_title": """
+        SELECT cm.name, cm.text FROM comments cm JOIN movies m ON m._id = cm.movie_id
+        WHERE m.title = 'The Matrix'""",
+    "genre_counts": "SELECT genre, count(*) FROM genres GROUP BY genre ORDER BY 2 DESC",
+}
+
+MOVIE_CARD_QUERIES = {
+    "movie_card_title_lookup": "SELECT * FROM movie_card WHERE title ILIKE '%inception%'",
+}
+
+
+def benchmark(engine, repeats=5):
+    with engine.connect() as conn:
+        has_card = conn.execute(text("SELECT to_regclass('movie_card') IS NOT NULL")).scalar()
+        queries = {**BENCHMARK_QUERIES, **(MOVIE_CARD_QUERIES if has_card else {})}
+        results = {}
+        for name, sql in queries.items():
+            timings = []
+            for _ in range(repeats):
+                plan = conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")).scalar()
+                plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+                timings.append(plan["Execution Time"])
+            node_types = _node_types(plan["Plan"])
+            results[name] = {
+                "median_ms": round(float(np.median(timings)), 3),
+                "min_ms": round(float(np.min(timings)), 3),
+                "seq_scans": node_types.count("Seq Scan"),
+                "index_scans": sum("Index" in n or "Bitmap" in n for n in node_types),
+            }
+    return results
+
+
+def _node_types(plan):
+    types = [plan["Node Type"]]
+    for child in plan.get("Plans", []):
+        types += _node_types(child)
+    return types
+
+
+def print_benchmark(results, baseline=None):
+    print(f"{'query':<28}{'median ms':>11}{'seq scans':>11}{'idx scans':>11}" + (f"{'before ms':>11}{'speedup':>9}" if baseline else ""))
+    for name, r in results.items():
+        line = f"{name:<28}{r['median_ms']:>11.2f}{r['seq_scans']:>11}{r['index_scans']:>11}"
+        if baseline and name in baseline:
+            before = baseline[name]["median_ms"]
+            line += f"{before:>11.2f}{before / max(r['median_ms'], 1e-6):>8.1f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status")
+    m = sub.add_parser("migrate")
+    m.add_argument("--with-movie-card", action="store_true", help="Also create the optional movie_card materialized view")
+    m.add_argument("--target", type=int, default=None)
+    r = sub.add_parser("refresh-movie-card")
+    r.add_argument("--blocking", action="store_true", help="Plain REFRESH (locks readers) instead of CONCURRENTLY")
+    b = sub.add_parser("benchmark")
+    b.add_argument("--repeats", type=int, default=5)
+    b.add_argument("--output", default=None)
+    b.add_argument("--compare", default=None, help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    engine = create_engine(DB_URI)
+    if args.command == "status":
+        status(engine)
+    elif args.command == "migrate":
+        migrate(engine, include_optional=args.with_movie_card, target=args.target)
+    elif args.command == "refresh-movie-card":
+        refresh_movie_card(engine, concurrently=not args.blocking)
+    elif args.command == "benchmark":
+        results = benchmark(engine, repeats=args.repeats)
+        baseline = None
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+        print_benchmark(results, baseline)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
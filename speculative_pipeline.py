@@ -0,0 +1,268 @@
+import time
+import queue
+import asyncio
+import threading
+
+import pipeline_tracing as tracing
+from prompt_builder import get_prompt_builder, count_tokens
+from rag_pipeline import (
+    retrieve_documents, build_semantic_prompt, run_generated_sql,
+)
+
+
+class SpeculationStats:
+    """
+    Running totals for the speculative pipeline.
+
+    `latency_saved_ms` compares each speculative request with the sequential
+    schedule (classification + chosen branch back to back) built from the stage
+    times that were actually measured. `wasted_*` counts work started for the
+    losing branch; `wasted_tokens` estimates the extra OpenAI spend.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {
+            "requests": 0, "speculated": 0, "skipped_limit": 0, "skipped_confident": 0,
+            "latency_saved_ms": 0.0, "wasted_sql_generations": 0, "wasted_retrievals": 0,
+            "cancelled_before_finish": 0, "wasted_tokens": 0,
+        }
+        self.last = {}
+
+    def record(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self.totals[key] += value
+
+    def set_last(self, **values):
+        with self._lock:
+            self.last = values
+
+    def summary(self):
+        with self._lock:
+            speculated = self.totals["speculated"]
+            return {
+                **self.totals,
+                "avg_latency_saved_ms": round(self.totals["latency_saved_ms"] / speculated, 1) if speculated else 0.0,
+                "last": dict(self.last),
+            }
+
+
+class SpeculationLimiter:
+    """Caps how many requests may speculate at once so wasted work stays bounded under load."""
+
+    def __init__(self, max_inflight=4):
+        self._semaphore = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+
+    def try_acquire(self):
+        return self._semaphore is None or self._semaphore.acquire(blocking=False)
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+async def _timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def _apredict(llm, prompt, stage_name):
+    # Cancelled calls end up in the trace with error=CancelledError
+    with tracing.stage(stage_name) as span:
+        response = await llm.apredict(prompt)
+        span.tokens(prompt, response)
+    return response
+
+
+async def _answer_text(llm, prompt, on_chunk):
+    """The semantic answer; streamed through `on_chunk` as it arrives when one is given."""
+    if on_chunk is None:
+        return await _apredict(llm, prompt, "answer")
+    with tracing.stage("answer") as span:
+        parts = []
+        async for chunk in llm.astream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                on_chunk(chunk.content)
+        response = "".join(parts)
+        span.tokens(prompt, response)
+    return response
+
+
+async def _cancel(task):
+    """Cancel `task` and report whether it was still running (i.e. work was cut short)."""
+    if task is None:
+        return False
+    if task.done():
+        return False
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return True
+
+
+async def answer_user_query_async(query, llm, engine, faiss_index, router=None, prompt_builder=None,
+                                  stats=None, limiter=None, speculate_sql=True, k=5, on_chunk=None):
+    """
+    Async equivalent of `rag_pipeline.answer_user_query`.
+
+    If the local router is confident it runs only the chosen branch. Otherwise it
+    starts the LLM classification, the FAISS retrieval and (if `speculate_sql`) the
+    SQL generation together, then cancels the branch that lost. With `on_chunk`,
+    a semantic answer is also passed to it chunk by chunk as the LLM streams it.
+    """
+    with tracing.trace("answer_user_query", query=query):
+        return await _answer(query, llm, engine, faiss_index, router, prompt_builder, stats, limiter, speculate_sql, k,
+                             on_chunk)
+
+
+async def _answer(query, llm, engine, faiss_index, router, prompt_builder, stats, limiter, speculate_sql, k, on_chunk):
+    prompt_builder = prompt_builder or get_prompt_builder(engine)
+    stats = stats or SpeculationStats()
+    stats.record(requests=1)
+    start = time.perf_counter()
+
+    decision = router.classify(query) if router is not None else None
+    if decision is not None and decision.confidence >= router.confidence_threshold:
+        stats.record(skipped_confident=1)
+        router.record("local")
+        tracing.annotate(route=decision.label, speculated=False)
+        return await _run_branch(decision.label, query, llm, engine, faiss_index, prompt_builder, k, on_chunk)
+
+    if limiter is not None and not limiter.try_acquire():
+        # Too many speculative requests in flight; fall back to the sequential schedule
+        stats.record(skipped_limit=1)
+        if router is not None:
+            router.record("llm")
+        qtype = await _apredict(llm, prompt_builder.build_classifier_prompt(query), "classify")
+        label = "structured" if "structured" in qtype.lower() else "semantic"
+        tracing.annotate(route=label, speculated=False)
+        return await _run_branch(label, query, llm, engine, faiss_index, prompt_builder, k, on_chunk)
+
+    tasks = []
+    try:
+        stats.record(speculated=1)
+        if router is not None:
+            router.record("llm")
+
+        sql_prompt = prompt_builder.build_sql_prompt(query)
+        classify_task = asyncio.create_task(_timed(_apredict(llm, prompt_builder.build_classifier_prompt(query), "classify")))
+        retrieve_task = asyncio.create_task(_timed(asyncio.to_thread(retrieve_documents, query, faiss_index, k)))
+        sql_task = asyncio.create_task(_timed(_apredict(llm, sql_prompt, "generate_sql"))) if speculate_sql else None
+        tasks = [t for t in (classify_task, retrieve_task, sql_task) if t is not None]
+
+        response, classify_ms = await classify_task
+        label = "structured" if "structured" in response.lower() else "semantic"
+        tracing.annotate(route=label, speculated=True)
+
+        if label == "structured":
+            # The worker thread still finishes its embedding call; we only stop waiting for it
+            cut_short = await _cancel(retrieve_task)
+            stats.record(wasted_retrievals=1, cancelled_before_finish=int(cut_short))
+            if sql_task is None:
+                sql_task = asyncio.create_task(_timed(_apredict(llm, sql_prompt, "generate_sql")))
+                tasks.append(sql_task)
+            sql, prepare_ms = await sql_task
+            result, finish_ms = await _timed(asyncio.to_thread(run_generated_sql, sql, engine))
+        else:
+            if sql_task is not None:
+                cut_short = await _cancel(sql_task)
+                # The prompt is billed once the request is sent, even if we stop reading the reply
+                wasted = count_tokens(sql_prompt)
+                if not cut_short:
+                    wasted += count_tokens(sql_task.result()[0])
+                stats.record(wasted_sql_generations=1, cancelled_before_finish=int(cut_short), wasted_tokens=wasted)
+            docs, prepare_ms = await retrieve_task
+            result, finish_ms = await _timed(_answer_text(llm, build_semantic_prompt(query, docs), on_chunk))
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sequential_ms = classify_ms + prepare_ms + finish_ms
+        stats.record(latency_saved_ms=max(0.0, sequential_ms - elapsed_ms))
+        stats.set_last(
+            label=label, elapsed_ms=round(elapsed_ms, 1), sequential_estimate_ms=round(sequential_ms, 1),
+            classify_ms=round(classify_ms, 1), prepare_ms=round(prepare_ms, 1), finish_ms=round(finish_ms, 1),
+        )
+        return result
+    finally:
+        try:
+            # On an error (e.g. classification failed) the other branches must not keep running unobserved
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+
+async def _run_branch(label, query, llm, engine, faiss_index, prompt_builder, k, on_chunk=None):
+    if label == "structured":
+        sql = await _apredict(llm, prompt_builder.build_sql_prompt(query), "generate_sql")
+        return await asyncio.to_thread(run_generated_sql, sql, engine)
+    docs = await asyncio.to_thread(retrieve_documents, query, faiss_index, k)
+    return await _answer_text(llm, build_semantic_prompt(query, docs), on_chunk)
+
+
+class _LoopThread:
+    """
+    One event loop on a daemon thread, shared by every blocking call.
+
+    asyncio.run would create and close a loop per question, while the LLM's
+    async HTTP client stays bound to the first loop it ran on ("Event loop is
+    closed" on the next question).
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def submit(self, coro):
+        """Schedule `coro` on the loop and return its concurrent.futures.Future."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="speculation-loop", daemon=True).start()
+        # The task starts in a copy of the caller's context, so an enclosing trace still collects its spans
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+
+_LOOP = _LoopThread()
+
+
+def answer_user_query_speculative(query, llm, engine, faiss_index, **kwargs):
+    """Blocking wrapper for callers without an event loop (Streamlit script thread, CLI)."""
+    return _LOOP.run(answer_user_query_async(query, llm, engine, faiss_index, **kwargs))
+
+
+_DONE = object()
+
+
+def answer_user_query_speculative_stream(query, llm, engine, faiss_index, **kwargs):
+    """
+    Generator version of answer_user_query_speculative, shaped like
+    rag_pipeline.answer_user_query_stream: semantic answers are yielded as text
+    chunks, structured answers once, as the DataFrame (or SQL error string).
+    """
+    chunks = queue.Queue()
+    future = _LOOP.submit(answer_user_query_async(query, llm, engine, faiss_index, on_chunk=chunks.put, **kwargs))
+    future.add_done_callback(lambda _: chunks.put(_DONE))
+    streamed = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            streamed = True
+            yield chunk
+        result = future.result()
+        if not streamed:
+            yield result
+    finally:
+        # Abandoned stream (page rerun): stop the LLM call instead of letting it finish unread
+        future.cancel()
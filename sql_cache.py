@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import inspect
+
+from sql_executor import PagedResult, clean_generated_sql
+
+
+# --- SQL Canonicalization ---
+_TOKEN_RE = re.compile(
+    r"""(?P<string>'(?:[^']|'')*')"""
+    r"""|(?P<ident>"(?:[^"]|"")*")"""
+    r"""|(?P<number>\d+(?:\.\d+)?)"""
+    r"""|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)"""
+    r"""|(?P<op><>|!=|<=|>=|::|\|\||[^\sA-Za-z0-9_])""",
+    re.DOTALL,
+)
+_CLAUSE_END = {"group", "order", "limit", "having", "offset", "union", "intersect", "except", "window", "fetch"}
+
+
+def _tokenize(sql):
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        value = match.group()
+        # Identifiers and keywords are case-insensitive; literals and quoted names are not
+        if kind == "word":
+            value = value.lower()
+        elif kind == "ident" and value[1:-1] == value[1:-1].lower() and value[1:-1] != "cast":
+            value = value[1:-1]
+        tokens.append(value)
+    return tokens
+
+
+def _sort_in_lists(tokens):
+    # IN ('b', 'a') and IN ('a', 'b') are the same filter
+    out, i = [], 0
+    while i < len(tokens):
+        if tokens[i] == "in" and i + 1 < len(tokens) and tokens[i + 1] == "(":
+            j = i + 2
+            items = []
+            while j < len(tokens) and tokens[j] != ")":
+                if tokens[j] != ",":
+                    items.append(tokens[j])
+                j += 1
+            literal_only = items and all(t.startswith("'") or t[0].isdigit() for t in items)
+            if literal_only and j < len(tokens):
+                out += ["in", "("] + [x for item in sorted(items) for x in (item, ",")][:-1] + [")"]
+                i = j + 1
+                continue
+        out.append(tokens[i])
+        i += 1
+    return out
+
+
+def _sort_where_conjuncts(tokens):
+    # Reorder top-level `a AND b AND c` in WHERE when no top-level OR makes order meaningful
+    try:
+        start = tokens.index("where") + 1
+    except ValueError:
+        return tokens
+    depth, end = 0, len(tokens)
+    for j in range(start, len(tokens)):
+        if tokens[j] == "(":
+            depth += 1
+        elif tokens[j] == ")":
+            depth -= 1
+            if depth < 0:
+                end = j
+                break
+        elif depth == 0 and tokens[j] in _CLAUSE_END:
+            end = j
+            break
+    clause = tokens[start:end]
+    conjuncts, current, depth, in_between = [], [], 0, False
+    for t in clause:
+        depth += (t == "(") - (t == ")")
+        if depth == 0 and t == "or":
+            return tokens
+        if depth == 0 and t == "between":
+            in_between = True
+        if depth == 0 and t == "and" and not in_between:
+            conjuncts.append(current)
+            current = []
+            continue
+        if depth == 0 and t == "and":
+            # This AND belongs to `x BETWEEN a AND b`
+            in_between = False
+        current.append(t)
+    conjuncts.append(current)
+    ordered = [tok for c in sorted(conjuncts, key=" ".join) for tok in c + ["and"]][:-1]
+    return tokens[:start] + ordered + tokens[end:]
+
+
+def canonicalize_sql(sql):
+    """Whitespace-, case- and literal-order-insensitive form of `sql`, used as the cache key."""
+    tokens = _tokenize(clean_generated_sql(sql))
+    tokens = _sort_in_lists(tokens)
+    tokens = _sort_where_conjuncts(tokens)
+    return " ".join(tokens)
+
+
+def referenced_tables(sql, known_tables):
+    """Known tables named anywhere in `sql`; over-matching only costs an extra invalidation."""
+    tokens = [t.strip('"') for t in _tokenize(sql)]
+    known = {t.lower(): t for t in known_tables}
+    return sorted({known[t.lower()] for t in tokens if t.lower() in known})
+
+
+# --- Table Versions ---
+class TableVersionTracker:
+    """
+    Per-table change watermarks, refreshed at most every `refresh_seconds`.
+
+    On Postgres the version of a table or materialized view is its relfilenode
+    (changes on TRUNCATE and a plain REFRESH) plus the pg_stat insert/update/delete
+    counter (changes on writes and REFRESH ... CONCURRENTLY), read from the
+    catalogs without touching the data. Other databases use max(lastupdated) for
+    tables that have such a column.
+
+    Only the first `versions()` call reads them inline; later refreshes run on a
+    background thread while callers get the previous versions.
+    """
+
+    def __init__(self, engine, refresh_seconds=30, watermark_column="lastupdated"):
+        self.engine = engine
+        self.refresh_seconds = refresh_seconds
+        inspector = inspect(engine)
+        self.tables = inspector.get_table_names()
+        if engine.dialect.name == "postgresql":
+            # movie_card and any other materialized views the generated SQL may read
+            self.tables += inspector.get_materialized_view_names()
+            self.watermark_tables = []
+        else:
+            self.watermark_tables = [
+                t for t in self.tables
+                if watermark_column in {c["name"].lower() for c in inspector.get_columns(t)}
+            ]
+        self.watermark_column = watermark_column
+        self._versions = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def versions(self):
+        with self._lock:
+            versions = self._versions
+            refresh = (versions is not None and not self._refreshing
+                       and time.time() - self._checked_at >= self.refresh_seconds)
+            if refresh:
+                self._refreshing = True
+        if versions is None:
+            return self._refresh(raise_errors=True)
+        if refresh:
+            threading.Thread(target=self._refresh, name="sql-cache-versions", daemon=True).start()
+        return versions
+
+    def _refresh(self, raise_errors=False):
+        try:
+            versions = self._read_versions()
+        except Exception as e:
+            with self._lock:
+                self._refreshing = False
+            if raise_errors:
+                raise
+            # Keep the previous versions; the next call tries again
+            print(f"Refreshing SQL cache table versions failed: {e}")
+            return self._versions
+        with self._lock:
+            self._versions, self._checked_at, self._refreshing = versions, time.time(), False
+        return versions
+
+    def _read_versions(self):
+        versions = {t: "" for t in self.tables}
+        with self.engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                rows = conn.exec_driver_sql("""
+                    SELECT c.relname, c.relfilenode, coalesce(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0)
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                    WHERE c.relkind IN ('r', 'm', 'p') AND n.nspname = current_schema()
+                """).fetchall()
+                for name, filenode, changes in rows:
+                    versions[name] = f"{filenode}:{changes}"
+            for table in self.watermark_tables:
+                quoted = f'"{table}"' if table.lower() == "cast" else table
+                latest = conn.exec_driver_sql(f"SELECT max({self.watermark_column}) FROM {quoted}").scalar()
+                versions[table] += f"@{latest}"
+        return versions
+
+
+# --- Result Cache ---
+class SQLResultCache:
+    """
+    Results of generated SQL keyed by canonical SQL and stored as Arrow tables.
+
+    Eviction is LRU bounded by `max_bytes` of Arrow memory. With `spill_dir`,
+    entries are also written as Parquet so they survive a restart; those files
+    are LRU-bounded by `max_disk_bytes`. An entry is dropped as soon as any
+    table it reads has a different version than when it was stored.
+    """
+
+    def __init__(self, version_tracker=None, max_bytes=256 * 1024 * 1024, spill_dir=None, chunk_rows=1000,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.version_tracker = version_tracker
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.chunk_rows = chunk_rows
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._files = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "disk_evictions": 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._scan_spill_dir()
+
+    @staticmethod
+    def key_for(sql):
+        return hashlib.sha1(canonicalize_sql(sql).encode("utf-8")).hexdigest()
+
+    def _current_versions(self, tables):
+        if self.version_tracker is None:
+            return {}
+        versions = self.version_tracker.versions()
+        return {t: versions.get(t, "") for t in tables}
+
+    def get(self, sql):
+        key = self.key_for(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.spill_dir:
+            entry = self._load_spilled(key)
+        if entry is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        if entry["versions"] != self._current_versions(entry["tables"]):
+            self._drop(key)
+            with self._lock:
+                self.stats["invalidations"] += 1
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return self._to_result(entry)
+
+    def put(self, sql, result):
+        if not isinstance(result, PagedResult):
+            return
+        tables = referenced_tables(sql, self.version_tracker.tables) if self.version_tracker else []
+        frame = result.to_frame()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        entry = {
+            "table": table,
+            "sql": result.sql,
+            "tables": tables,
+            "versions": self._current_versions(tables),
+            "truncated": result.truncated,
+            "total_rows": result.total_rows,
+        }
+        key = self.key_for(sql)
+        with self._lock:
+            self._store(key, entry)
+        if self.spill_dir:
+            self._spill(key, entry)
+
+    def _store(self, key, entry):
+        if entry["table"].nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)["table"].nbytes
+        self._entries[key] = entry
+        self._bytes += entry["table"].nbytes
+        while self._bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old["table"].nbytes
+            self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry["table"].nbytes
+            if self.spill_dir:
+                self._remove_file(key)
+
+    def _to_result(self, entry):
+        chunks = [batch.to_pandas() for batch in entry["table"].to_batches(max_chunksize=self.chunk_rows)]
+        return PagedResult(entry["table"].column_names, chunks, entry["sql"],
+                           truncated=entry["truncated"], total_rows=entry["total_rows"], elapsed_ms=0.0)
+
+    # --- Parquet Spill ---
+    def _path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.parquet")
+
+    def _scan_spill_dir(self):
+        """Pick up files of a previous run (oldest first) and clear temp files of interrupted writes."""
+        files = []
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(".parquet"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-len(".parquet")], stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(files):
+                self._files[key] = size
+                self._disk_bytes += size
+            self._enforce_disk_cap()
+
+    def _remove_file(self, key):
+        # Caller holds self._lock
+        size = self._files.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _enforce_disk_cap(self):
+        # Caller holds self._lock
+        while self._disk_bytes > self.max_disk_bytes and self._files:
+            self._remove_file(next(iter(self._files)))
+            self.stats["disk_evictions"] += 1
+
+    def _spill(self, key, entry):
+        metadata = {
+            "sql": entry["sql"], "tables": ",".join(entry["tables"]),
+            "versions": json.dumps(entry["versions"]),
+            "truncated": str(entry["truncated"]), "total_rows": str(entry["total_rows"]),
+        }
+        table = entry["table"].replace_schema_metadata({k: v.encode() for k, v in metadata.items()})
+        # Unique temp name: concurrent puts of the same SQL must not write into one file
+        fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, prefix=f"{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pq.write_table(table, f, compression="zstd")
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        size = os.path.getsize(self._path(key))
+        with self._lock:
+            self._disk_bytes += size - self._files.pop(key, 0)
+            self._files[key] = size
+            self._enforce_disk_cap()
+
+    def _load_spilled(self, key):
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+        try:
+            table = pq.read_table(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._remove_file(key)
+            return None
+        meta = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+        table = table.replace_schema_metadata(None)
+        tables = [t for t in meta.get("tables", "").split(",") if t]
+        entry = {
+            "table": table,
+            "sql": meta.get("sql", ""),
+            "tables": tables,
+            "versions": json.loads(meta.get("versions", "{}")),
+            "truncated": meta.get("truncated") == "True",
+            "total_rows": None if meta.get("total_rows") in (None, "None") else int(meta["total_rows"]),
+        }
+        with self._lock:
+            self._store(key, entry)
+        return entry
+
+    def summary(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "files": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+# --- Process-wide cache ---
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_sql_result_cache(engine, **kwargs):
+    """One result cache (and version tracker) per database URL."""
+    key = str(engine.url)
+    with _caches_lock:
+        if key not in _caches:
+            refresh_seconds = kwargs.pop("refresh_seconds", 30)
+            _caches[key] = SQLResultCache(TableVersionTracker(engine, refresh_seconds=refresh_seconds), **kwargs)
+        return _caches[key]
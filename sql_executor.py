@@ -0,0 +1,188 @@
+import re
+import time
+
+import pandas as pd
+from sqlalchemy.exc import OperationalError
+
+
+class UnsafeSQLError(ValueError):
+    """Raised when LLM-generated SQL is not a single read-only query."""
+
+
+# Statements (or functions) that can write, lock, or otherwise outlive the request
+FORBIDDEN_KEYWORDS = {
+    "insert", "update", "delete", "merge", "upsert", "drop", "alter", "create", "truncate",
+    "grant", "revoke", "copy", "vacuum", "analyze", "reindex", "cluster", "call", "do",
+    "lock", "set", "reset", "listen", "notify", "prepare", "execute", "deallocate",
+    "refresh", "comment", "security", "into",
+    "pg_sleep", "pg_terminate_backend", "pg_cancel_backend", "pg_read_file", "lo_import", "lo_export", "dblink",
+}
+READ_STATEMENTS = {"select", "with", "values", "table"}
+
+
+# --- Parsing & Validation ---
+def clean_generated_sql(sql):
+    """Strip markdown fences, surrounding prose markers and trailing semicolons from LLM output."""
+    sql = sql.strip()
+    fenced = re.search(r"```(?:sql|postgresql)?\s*(.*?)```", sql, re.IGNORECASE | re.DOTALL)
+    if fenced:
+        sql = fenced.group(1).strip()
+    return sql.rstrip().rstrip(";").strip()
+
+
+def _strip_literals_and_comments(sql):
+    # Remove things a keyword scan must not look inside: comments, string literals, quoted identifiers
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"\$(\w*)\$.*?\$\1\$", " '' ", sql, flags=re.DOTALL)
+    sql = re.sub(r"'(?:[^']|'')*'", " '' ", sql)
+    sql = re.sub(r'"(?:[^"]|"")*"', ' "" ', sql)
+    return sql
+
+
+def validate_read_only(sql):
+    """Return the cleaned SQL if it is a single SELECT/WITH query, otherwise raise UnsafeSQLError."""
+    sql = clean_generated_sql(sql)
+    if not sql:
+        raise UnsafeSQLError("empty query")
+
+    bare = _strip_literals_and_comments(sql)
+    if ";" in bare:
+        raise UnsafeSQLError("only a single statement is allowed")
+
+    words = re.findall(r"[a-z_][a-z0-9_]*", bare.lower())
+    if not words or words[0] not in READ_STATEMENTS:
+        raise UnsafeSQLError(f"only read-only queries are allowed, got '{words[0] if words else sql[:20]}'")
+    forbidden = sorted(FORBIDDEN_KEYWORDS.intersection(words))
+    if forbidden:
+        raise UnsafeSQLError(f"forbidden keyword(s): {', '.join(forbidden)}")
+    return sql
+
+
+def apply_row_cap(sql, max_rows):
+    """
+    Wrap the query so Postgres stops after `max_rows + 1` rows. The extra row tells us
+    the result was truncated without counting everything. Inner ORDER BY/LIMIT are kept.
+    """
+    return f"SELECT * FROM (\n{sql}\n) AS capped_result LIMIT {int(max_rows) + 1}"
+
+
+# --- Paged Result ---
+class PagedResult:
+    """
+    Bounded result of a generated query, stored as the fetched chunks.
+
+    The UI asks for one page at a time, so the full result is never rendered
+    (or concatenated) unless `to_frame` is called.
+    """
+
+    def __init__(self, columns, chunks, sql, truncated=False, total_rows=None, elapsed_ms=None):
+        self.columns = list(columns)
+        self.chunks = chunks
+        self.sql = sql
+        self.truncated = truncated
+        # Exact count when known: equal to rows fetched when not truncated, else from COUNT(*) or None
+        self.total_rows = total_rows
+        self.elapsed_ms = elapsed_ms
+        self._offsets = [0]
+        for chunk in chunks:
+            self._offsets.append(self._offsets[-1] + len(chunk))
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self) // page_size))
+
+    def page(self, number, page_size):
+        """Rows of page `number` (0-based) as a DataFrame, touching only the chunks it spans."""
+        start = number * page_size
+        stop = min(start + page_size, len(self))
+        parts = []
+        for i, chunk in enumerate(self.chunks):
+            lo, hi = self._offsets[i], self._offsets[i + 1]
+            if hi <= start or lo >= stop:
+                continue
+            parts.append(chunk.iloc[max(start, lo) - lo:min(stop, hi) - lo])
+        if not parts:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+
+    def to_frame(self):
+        if not self.chunks:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(self.chunks, ignore_index=True)
+
+    def head(self, n=5):
+        return self.page(0, n)
+
+    def summary(self):
+        fetched = len(self)
+        if not self.truncated:
+            return f"{fetched:,} rows"
+        if self.total_rows is not None:
+            return f"Showing the first {fetched:,} of {self.total_rows:,} rows (truncated)"
+        return f"Showing the first {fetched:,} rows; the result was truncated (more rows exist)"
+
+    def __repr__(self):
+        return f"<PagedResult {self.summary()}, {len(self.columns)} columns>"
+
+
+# --- Execution ---
+def _begin_read_only(conn, statement_timeout_ms):
+    if conn.dialect.name == "postgresql":
+        # Must be the first statement of the transaction; the connection is rolled back on close
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+        if statement_timeout_ms:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+
+
+def count_rows(sql, engine, statement_timeout_ms=None):
+    """COUNT(*) of a validated query, or None if it does not finish within the timeout."""
+    try:
+        with engine.connect() as conn:
+            _begin_read_only(conn, statement_timeout_ms)
+            return conn.exec_driver_sql(f"SELECT count(*) FROM (\n{sql}\n) AS counted_result").scalar()
+    except OperationalError:
+        return None
+
+
+def execute_read_only(sql, engine, max_rows=5000, statement_timeout_ms=15000, chunk_size=1000,
+                      count_truncated=True):
+    """
+    Validate and run generated SQL with a row cap, a statement timeout and a
+    server-side cursor, returning a PagedResult.
+    """
+    sql = validate_read_only(sql)
+    start = time.perf_counter()
+    chunks = []
+    with engine.connect() as conn:
+        _begin_read_only(conn, statement_timeout_ms)
+        # stream_results makes psycopg2 use a named (server-side) cursor
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).exec_driver_sql(
+            apply_row_cap(sql, max_rows)
+        )
+        columns = list(result.keys())
+        fetched = 0
+        while fetched <= max_rows:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(pd.DataFrame.from_records(rows, columns=columns))
+            fetched += len(rows)
+        result.close()
+
+    truncated = fetched > max_rows
+    if truncated:
+        # Drop the sentinel row that only told us more rows exist
+        overflow = fetched - max_rows
+        chunks[-1] = chunks[-1].iloc[:len(chunks[-1]) - overflow]
+    total_rows = None if truncated else fetched
+    if truncated and count_truncated:
+        total_rows = count_rows(sql, engine, statement_timeout_ms)
+    return PagedResult(columns, chunks, sql, truncated=truncated, total_rows=total_rows,
+                       elapsed_ms=(time.perf_counter() - start) * 1000)
@@ -0,0 +1,287 @@
+"""
+Synthetic mflix data in the normalized schema, for offline benchmarks (see load_test.py).
+
+    python synthetic_mflix.py                                   # 21,000 movies -> bench/mflix_synth.sqlite
+    python synthetic_mflix.py --movies 1000000                  # ~1M movies, ~10M child rows
+    python synthetic_mflix.py --db postgresql+psycopg2://postgres:pw@localhost/mflix_bench --replace
+
+Tables come from mflix_etl.TABLE_DDL (SERIAL / REAL[] mapped to SQLite types) and
+are filled in chunks, so memory stays flat as --movies grows. movies and its
+child tables (writers, directors, cast, genres, languages, countries, imdb,
+awards) are populated; tomatoes, comments, users and theaters are created empty.
+The movie_id / filter indexes of schema_migrations.py are created after the load.
+
+A flat FAISS index over the plots is written next to the data (--index-path),
+embedded with load_test.StubEmbeddings so the benchmark never calls OpenAI.
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from mflix_etl import TABLE_DDL, COLLECTION_TABLES, copy_frame
+from hybrid_retrieval import MFLIX_GENRES, MFLIX_LANGUAGES, MFLIX_COUNTRIES
+
+DEFAULT_DB = "sqlite:///bench/mflix_synth.sqlite"
+DEFAULT_INDEX_PATH = "bench/faiss_synth"
+
+# --- Vocabulary ---
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Akira", "Yuki", "Pierre", "Amelie", "Hans", "Greta", "Luca", "Sofia", "Ravi", "Priya",
+    "Carlos", "Lucia", "Ingmar", "Liv", "Wong", "Mei", "Ivan", "Olga", "Kenji", "Chiara",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Thompson",
+    "Kurosawa", "Tanaka", "Dubois", "Moreau", "Schmidt", "Fischer", "Rossi", "Bianchi", "Kapoor", "Sharma",
+    "Fernandez", "Bergman", "Ullmann", "Kar-wai", "Chen", "Petrov", "Ivanova", "Sato", "Romano", "Nolan",
+]
+TITLE_ADJECTIVES = [
+    "Silent", "Last", "Broken", "Golden", "Dark", "Hidden", "Lost", "Crimson", "Endless", "Frozen",
+    "Burning", "Distant", "Wild", "Quiet", "Savage", "Secret", "Midnight", "Electric", "Forgotten", "Final",
+]
+TITLE_NOUNS = [
+    "River", "Heist", "Kingdom", "Road", "Storm", "Promise", "Horizon", "City", "Garden", "Shadow",
+    "Empire", "Journey", "Harbor", "Witness", "Mirror", "Frontier", "Symphony", "Island", "Machine", "Summer",
+]
+PLOT_SUBJECTS = [
+    "a retired detective", "a young samurai", "two estranged sisters", "a small-town teacher", "a con artist",
+    "an astronaut", "a grieving widower", "a rookie cop", "a band of thieves", "a lonely robot",
+    "a family of farmers", "a jazz musician", "a runaway teenager", "a war veteran", "an ambitious lawyer",
+]
+PLOT_ACTIONS = [
+    "plans one last heist", "travels back in time", "falls in love", "seeks revenge", "uncovers a conspiracy",
+    "fights to survive", "searches for a missing child", "builds an unlikely friendship", "escapes from prison",
+    "investigates a murder", "goes on a road trip", "confronts an old enemy", "discovers a hidden talent",
+    "tries to save the family business", "is haunted by a ghost",
+]
+PLOT_SETTINGS = [
+    "in post-war Tokyo", "across the American West", "in a remote Scottish village", "on a doomed space station",
+    "in 1920s Paris", "in a crumbling mansion", "in the streets of Mumbai", "during a brutal winter",
+    "in a near-future megacity", "aboard a transatlantic liner", "in a sleepy coastal town", "in Hong Kong",
+]
+PLOT_TWISTS = [
+    "Nothing is what it seems.", "Loyalty is tested to the breaking point.", "The past refuses to stay buried.",
+    "A single choice changes everything.", "Hope survives in unexpected places.", "The truth comes at a cost.",
+]
+RATINGS = ["G", "PG", "PG-13", "R", "NOT RATED", "APPROVED", "UNRATED"]
+
+CHUNK_MOVIES = 50000
+# Distinct writers/cast members; directors come from the first quarter of the pool
+PEOPLE_POOL = 20000
+
+
+# --- Generation ---
+def _pick(rng, values, size):
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), size)]
+
+
+def _people(rng, size, pool_size):
+    """Names from a fixed pool of `pool_size` people (first x last x optional initial)."""
+    # Zipf-distributed, so a few prolific people appear in many movies
+    idx = (rng.zipf(1.1, size) - 1) % pool_size
+    first = np.asarray(FIRST_NAMES, dtype=object)[idx % len(FIRST_NAMES)]
+    last = np.asarray(LAST_NAMES, dtype=object)[(idx // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    initial = idx // (len(FIRST_NAMES) * len(LAST_NAMES))
+    middle = np.where(initial > 0, [f" {chr(65 + i % 26)}." for i in initial], "")
+    return first + middle + " " + last
+
+
+def _children(rng, movie_ids, low, high, column, values):
+    counts = rng.integers(low, high + 1, len(movie_ids))
+    frame = pd.DataFrame({"movie_id": np.repeat(movie_ids, counts), column: values(counts.sum())})
+    return frame.drop_duplicates()
+
+
+def movie_id(i):
+    # 24 hex characters, like the ObjectIds of the real collection
+    return f"{0x5a0000000000000000000000 + i:024x}"
+
+
+def generate_chunk(start, n, seed=7):
+    """Tables for movies [start, start + n), deterministic for a given seed and start."""
+    rng = np.random.default_rng([seed, start])
+    ids = np.array([movie_id(i) for i in range(start, start + n)], dtype=object)
+    numbers = np.arange(start, start + n)
+    adjectives = np.asarray(TITLE_ADJECTIVES, dtype=object)
+    nouns = np.asarray(TITLE_NOUNS, dtype=object)
+    base = len(adjectives) * len(nouns)
+    titles = (
+        "The " + adjectives[numbers % len(adjectives)] + " " + nouns[(numbers // len(adjectives)) % len(nouns)]
+        # Every later round of adjective/noun pairs gets a sequel number, so titles stay unique
+        + np.where(numbers >= base, [f" {k // base + 1}" for k in numbers], "")
+    )
+    plots = (
+        _pick(rng, PLOT_SUBJECTS, n) + " " + _pick(rng, PLOT_ACTIONS, n) + " " + _pick(rng, PLOT_SETTINGS, n)
+        + ". " + _pick(rng, PLOT_TWISTS, n)
+    )
+    plots = np.array([p[0].upper() + p[1:] for p in plots], dtype=object)
+    years = rng.integers(1910, 2016, n)
+    released = pd.to_datetime(years.astype(str)) + pd.to_timedelta(rng.integers(0, 365, n), unit="D")
+
+    tables = {
+        "movies": pd.DataFrame({
+            "_id": ids,
+            "plot": plots,
+            "runtime": rng.integers(60, 200, n).astype(float),
+            "title": titles,
+            "released": released.date,
+            "rated": _pick(rng, RATINGS, n),
+            "lastupdated": pd.Timestamp("2015-08-26"),
+            "year": years,
+            "type": "movie",
+            "num_mflix_comments": rng.poisson(2, n),
+            "metacritic": np.where(rng.random(n) < 0.3, rng.integers(20, 100, n), np.nan),
+            "year_raw": years.astype(str),
+        }),
+        "writers": _children(rng, ids, 1, 2, "writer", lambda k: _people(rng, k, PEOPLE_POOL)),
+        "directors": _children(rng, ids, 1, 1, "director", lambda k: _people(rng, k, PEOPLE_POOL // 4)),
+        "cast": _children(rng, ids, 2, 5, "cast_member", lambda k: _people(rng, k, PEOPLE_POOL)),
+        "genres": _children(rng, ids, 1, 3, "genre", lambda k: _pick(rng, MFLIX_GENRES, k)),
+        "languages": _children(rng, ids, 1, 2, "language", lambda k: _pick(rng, MFLIX_LANGUAGES[:12], k)),
+        "countries": _children(rng, ids, 1, 1, "country", lambda k: _pick(rng, MFLIX_COUNTRIES[:15], k)),
+        "imdb": pd.DataFrame({
+            "movie_id": ids,
+            "imdb_rating": np.round(np.clip(rng.normal(6.6, 1.1, n), 1.0, 9.8), 1),
+            "imdb_votes": rng.zipf(1.6, n) * 100,
+            "imdb_id": [f"tt{9000000 + i}" for i in numbers],
+        }),
+    }
+    wins = rng.poisson(1.0, n)
+    nominations = wins + rng.poisson(2.0, n)
+    tables["awards"] = pd.DataFrame({
+        "movie_id": ids, "award_wins": wins, "award_nominations": nominations,
+        "award_text": [f"{w} wins & {m} nominations." for w, m in zip(wins, nominations)],
+    })
+    return tables
+
+
+# --- Loading ---
+ALL_TABLES = [t for tables in COLLECTION_TABLES.values() for t in tables]
+
+
+def _sqlite_ddl(ddl):
+    return ddl.replace("SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY").replace("REAL[]", "BLOB")
+
+
+def create_schema(engine, replace=False):
+    existing = set(inspect(engine).get_table_names())
+    if "movies" in existing and not replace:
+        raise SystemExit(f"{engine.url.render_as_string(hide_password=True)} already has a movies table; "
+                         f"pass --replace to drop and regenerate it")
+    sqlite = engine.dialect.name == "sqlite"
+    with engine.begin() as conn:
+        for table in reversed(ALL_TABLES):
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{table}"' + ("" if sqlite else " CASCADE"))
+        for table in ALL_TABLES:
+            conn.exec_driver_sql(_sqlite_ddl(TABLE_DDL[table]) if sqlite else TABLE_DDL[table])
+
+
+def write_chunk(engine, tables):
+    if engine.dialect.name == "postgresql":
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for table, frame in tables.items():
+                copy_frame(cursor, table, frame)
+            conn.commit()
+        finally:
+            conn.close()
+        return
+    with engine.begin() as conn:
+        for table, frame in tables.items():
+            frame.to_sql(table, conn, if_exists="append", index=False, chunksize=20000)
+
+
+def create_indexes(engine):
+    from schema_migrations import MIGRATIONS, migrate
+    if engine.dialect.name == "postgresql":
+        migrate(engine)
+        return
+    # Only the plain btree migrations translate to SQLite (no pg_trgm, no materialized views)
+    with engine.begin() as conn:
+        for version, _, statements, _ in MIGRATIONS:
+            if version in (1, 3):
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+
+
+def generate(engine, n_movies, seed=7, replace=False):
+    create_schema(engine, replace=replace)
+    # tomatoes is created but left empty; nothing in the pipeline reads it
+    rows = {}
+    start = time.perf_counter()
+    for chunk_start in range(0, n_movies, CHUNK_MOVIES):
+        tables = generate_chunk(chunk_start, min(CHUNK_MOVIES, n_movies - chunk_start), seed)
+        write_chunk(engine, tables)
+        for table, frame in tables.items():
+            rows[table] = rows.get(table, 0) + len(frame)
+        print(f"  {chunk_start + len(tables['movies']):,}/{n_movies:,} movies ({time.perf_counter() - start:.0f}s)")
+    index_start = time.perf_counter()
+    create_indexes(engine)
+    print(f"🗂️  Indexes created in {time.perf_counter() - index_start:.1f}s")
+    return rows
+
+
+def build_stub_index(engine, index_path, embeddings, index_type="flat", chunk_rows=50000):
+    """Flat (or --index-type) FAISS index of "<title>. <plot>" embedded with `embeddings`."""
+    from faiss_index_builder import movie_text
+    from vector_index import MovieVectorIndex, build_faiss_index, make_id_table, SOURCE_EMBEDDED
+
+    ids, titles, parts = [], [], []
+    with engine.connect() as conn:
+        for frame in pd.read_sql(text("SELECT _id, title, plot FROM movies WHERE plot IS NOT NULL ORDER BY _id"),
+                                 conn, chunksize=chunk_rows):
+            ids.extend(frame["_id"].astype(str))
+            titles.extend(frame["title"].astype(str))
+            texts = [movie_text(t, p) for t, p in zip(frame["title"], frame["plot"])]
+            parts.append(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    vectors = np.concatenate(parts)
+    index, factory = build_faiss_index(vectors, index_type)
+    meta = {
+        "model": embeddings.model, "provider": embeddings.provider, "dim": int(vectors.shape[1]), "metric": "l2",
+        "count": index.ntotal, "index_type": index_type, "factory": factory, "params": {},
+        "sources": {"plot_embedding": 0, "embedded": len(ids)}, "built_at": time.time(),
+    }
+    id_table = make_id_table(ids, titles, [SOURCE_EMBEDDED] * len(ids), [None] * len(ids))
+    MovieVectorIndex(index, id_table, embed_query=None, meta=meta).save(index_path)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=21000)
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLAlchemy URL of the database to fill")
+    parser.add_argument("--replace", action="store_true", help="Drop an existing movies table (and its children)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--embedding-dim", type=int, default=64)
+    parser.add_argument("--no-index", action="store_true")
+    args = parser.parse_args()
+
+    from load_test import StubEmbeddings
+
+    if args.db.startswith("sqlite:///"):
+        os.makedirs(os.path.dirname(os.path.abspath(args.db[len("sqlite:///"):])), exist_ok=True)
+    if args.db == DEFAULT_DB:
+        # The default benchmark file is always ours to overwrite
+        args.replace = True
+    engine = create_engine(args.db)
+    start = time.perf_counter()
+    rows = generate(engine, args.movies, seed=args.seed, replace=args.replace)
+    print(f"✅ {', '.join(f'{t} {n:,}' for t, n in rows.items())} in {time.perf_counter() - start:.1f}s")
+    if not args.no_index:
+        index_start = time.perf_counter()
+        meta = build_stub_index(engine, args.index_path, StubEmbeddings(dim=args.embedding_dim), args.index_type)
+        print(f"✅ {meta['factory']} index of {meta['count']:,} plots saved to {args.index_path} "
+              f"in {time.perf_counter() - index_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+import os
+import json
+import math
+import struct
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text, bindparam
+
+from embedding_providers import check_index_model
+
+
+# Model used by the phase-2.2 notebook (OpenAIEmbeddings default) for indexes without metadata
+LEGACY_INDEX_MODEL = "text-embedding-ada-002"
+
+ID_TABLE_FILE = "ids.parquet"
+INDEX_FILE = "index.faiss"
+META_FILE = "index_meta.json"
+# Names the published build inside an index directory (see faiss_index_builder.swap_index_dir)
+CURRENT_FILE = "CURRENT"
+
+# id-table `source` values: where a row's vector came from
+SOURCE_STORED = 0      # movies.plot_embedding
+SOURCE_EMBEDDED = 1    # embedded by us because the movie had no stored vector
+
+
+# --- Reading plot_embedding ---
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# Binary array elements are (int32 length, float4 value) pairs, both big-endian
+_ARRAY_ELEMENT = np.dtype([("length", ">i4"), ("value", ">f4")])
+
+
+class _BinaryCopyParser:
+    """
+    File-like sink for `COPY (SELECT _id, title, plot_embedding ...) TO STDOUT (FORMAT binary)`.
+
+    Rows are parsed as psycopg2 hands over chunks, and each vector is decoded
+    with numpy straight from the wire bytes into its row of `vectors`, with no
+    Python lists or string parsing in between. Rows whose array is NULL-containing,
+    multi-dimensional or of a different length are counted in `skipped`.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.dim = vectors.shape[1]
+        self.ids, self.titles = [], []
+        self.skipped = 0
+        self._buffer = bytearray()
+        self._header_done = False
+        self._finished = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def write(self, data):
+        self._buffer += data
+        pos = self._parse(memoryview(self._buffer))
+        del self._buffer[:pos]
+        return len(data)
+
+    def _parse(self, buf):
+        pos = 0
+        if not self._header_done:
+            if len(buf) < 19:
+                return 0
+            if bytes(buf[:11]) != PG_COPY_SIGNATURE:
+                raise ValueError("not a binary COPY stream")
+            extension = struct.unpack_from(">i", buf, 15)[0]
+            if len(buf) < 19 + extension:
+                return 0
+            pos = 19 + extension
+            self._header_done = True
+        while not self._finished:
+            fields = self._read_tuple(buf, pos)
+            if fields is None:
+                break
+            if fields == "trailer":
+                self._finished = True
+                pos += 2
+                break
+            pos, values = fields
+            self._add_row(*values)
+        return pos
+
+    @staticmethod
+    def _read_tuple(buf, pos):
+        if len(buf) < pos + 2:
+            return None
+        count = struct.unpack_from(">h", buf, pos)[0]
+        if count == -1:
+            return "trailer"
+        pos += 2
+        values = []
+        for _ in range(count):
+            if len(buf) < pos + 4:
+                return None
+            length = struct.unpack_from(">i", buf, pos)[0]
+            pos += 4
+            if length == -1:
+                values.append(None)
+                continue
+            if len(buf) < pos + length:
+                return None
+            values.append(buf[pos:pos + length])
+            pos += length
+        return pos, values
+
+    def _add_row(self, movie_id, title, array):
+        row = len(self.ids)
+        if array is None or row >= len(self.vectors):
+            self.skipped += 1
+            return
+        ndim, has_null, _ = struct.unpack_from(">iii", array, 0)
+        if ndim != 1 or has_null:
+            self.skipped += 1
+            return
+        size = struct.unpack_from(">i", array, 12)[0]
+        if size != self.dim:
+            self.skipped += 1
+            return
+        self.vectors[row] = np.frombuffer(array, dtype=_ARRAY_ELEMENT, count=size, offset=20)["value"]
+        self.ids.append(bytes(movie_id).decode("utf-8"))
+        self.titles.append(bytes(title).decode("utf-8") if title is not None else "")
+
+
+def read_plot_embeddings(engine):
+    """
+    Stream every movies.plot_embedding into one contiguous float32 array.
+    Returns (ids, titles, vectors, skipped), where row i of `vectors` belongs to ids[i].
+    """
+    with engine.connect() as conn:
+        count, dim = conn.execute(text(
+            "SELECT count(*), max(array_length(plot_embedding, 1)) FROM movies WHERE plot_embedding IS NOT NULL"
+        )).one()
+    if not count:
+        return [], [], np.empty((0, 0), dtype=np.float32), 0
+
+    parser = _BinaryCopyParser(np.empty((count, dim), dtype=np.float32))
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.copy_expert(
+                "COPY (SELECT _id, title, plot_embedding FROM movies WHERE plot_embedding IS NOT NULL) "
+                "TO STDOUT WITH (FORMAT binary)",
+                parser,
+            )
+    finally:
+        raw.close()
+    # Leading rows of a C-contiguous array are still contiguous
+    return parser.ids, parser.titles, parser.vectors[:len(parser)], parser.skipped
+
+
+# --- Index Types ---
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def default_nlist(n_vectors):
+    # ~4*sqrt(n) lists, but keep at least 39 training points per list as FAISS recommends
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def default_pq_m(dim):
+    # Largest sub-quantizer count that divides dim with at least 16 dimensions per code byte
+    target = max(1, dim // 16)
+    return next(m for m in range(target, 0, -1) if dim % m == 0)
+
+
+def index_factory_string(index_type, n_vectors, dim, nlist=None, pq_m=None, pq_bits=8, hnsw_m=32):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist or default_nlist(n_vectors)},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist or default_nlist(n_vectors)},PQ{pq_m or default_pq_m(dim)}x{pq_bits}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    raise ValueError(f"unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+
+def build_faiss_index(vectors, index_type="flat", nlist=None, pq_m=None, pq_bits=8, hnsw_m=32):
+    """Train (if needed) and fill an L2 index of `index_type`. Returns (index, factory string)."""
+    import faiss
+    n_vectors, dim = vectors.shape
+    spec = index_factory_string(index_type, n_vectors, dim, nlist, pq_m, pq_bits, hnsw_m)
+    index = faiss.index_factory(dim, spec)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index, spec
+
+
+def read_index_flags(mmap):
+    """
+    faiss.read_index flags. IO_FLAG_MMAP alone only maps IVF inverted lists and
+    still copies Flat / HNSW vectors into RAM; IO_FLAG_MMAP_IFC maps the whole
+    file for every index type.
+    """
+    import faiss
+    return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply the query-time knobs that exist for this index type; others are ignored."""
+    import faiss
+    params = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, "nprobe", int(nprobe))
+    if ef_search and hasattr(index, "hnsw"):
+        params.set_index_parameter(index, "efSearch", int(ef_search))
+
+
+def _search_parameters(index, selector, widen=False):
+    # Each index family needs its own SearchParameters subclass; `widen` trades speed for
+    # recall when a selective filter leaves too few candidates in the probed lists / graph
+    import faiss
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist if widen else ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        ef = index.hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(ef * 8, 512) if widen else ef)
+    return faiss.SearchParameters(sel=selector)
+
+
+def reconstruct_rows(index, rows):
+    """Exact stored vectors for `rows`, or None when the index only keeps lossy (PQ) codes."""
+    import faiss
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if not isinstance(faiss.downcast_index(ivf), faiss.IndexIVFFlat):
+            return None
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+
+
+# --- Index Files ---
+class MovieVectorIndex:
+    """
+    FAISS index over movie vectors plus a compact id table (row -> _id, title).
+
+    Drop-in for the LangChain FAISS store as far as `rag_pipeline` is concerned:
+    `similarity_search` returns Documents with the plot as page_content and
+    `_id`/`title` metadata. Plots are looked up in Postgres for the hits only,
+    so nothing but ids and titles is kept in memory.
+
+    With `mmap=True` the index file is memory-mapped read-only: loading is
+    near-instant and worker processes share the OS page cache instead of each
+    holding a private copy.
+    """
+
+    def __init__(self, index, id_table, embed_query, engine=None, meta=None):
+        self.index = index
+        self.id_table = id_table
+        # Arrow arrays; hits are converted to Python strings one at a time
+        self._ids = id_table.column("_id").combine_chunks()
+        self._titles = id_table.column("title").combine_chunks()
+        self.embed_query = embed_query
+        self.engine = engine
+        self.meta = meta or {}
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def movie_id(self, row):
+        return self._ids[row].as_py()
+
+    def title(self, row):
+        return self._titles[row].as_py() or ""
+
+    @classmethod
+    def load(cls, path, embedding_model, engine=None, mmap=False, nprobe=None, ef_search=None):
+        import faiss
+        path = resolve_index_dir(path)
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = faiss.read_index(os.path.join(path, INDEX_FILE), read_index_flags(mmap))
+        set_search_params(index, nprobe, ef_search)
+        id_table = pq.read_table(os.path.join(path, ID_TABLE_FILE), memory_map=mmap)
+        embed_query = embedding_model.embed_query if embedding_model is not None else None
+        return cls(index, id_table, embed_query, engine=engine, meta=meta)
+
+    def save(self, path):
+        import faiss
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE))
+        pq.write_table(self.id_table, os.path.join(path, ID_TABLE_FILE), compression="zstd")
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def search_vectors(self, vectors, k=5, mask=None):
+        """
+        k nearest rows for each query vector. `mask` (bool per row) restricts the
+        search to those rows inside FAISS, instead of over-fetching and filtering.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if mask is None:
+            return self.index.search(vectors, k)
+        candidates = np.flatnonzero(mask)
+        if len(candidates) <= self.EXACT_SEARCH_MAX_CANDIDATES and not self._is_ivf():
+            return self._search_candidates(vectors, k, candidates)
+
+        import faiss
+        # IDSelectorBitmap reads bit i of the little-endian packed mask; `bitmap` must outlive the search
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        distances, rows = self.index.search(vectors, k, params=_search_parameters(self.index, selector))
+        if (rows >= 0).sum(axis=1).min() < min(k, len(candidates)):
+            distances, rows = self.index.search(vectors, k, params=_search_parameters(self.index, selector, widen=True))
+        return distances, rows
+
+    # Below this many candidates an exact scan of just those vectors beats a filtered graph walk
+    EXACT_SEARCH_MAX_CANDIDATES = 2048
+
+    def _is_ivf(self):
+        import faiss
+        return faiss.try_extract_index_ivf(self.index) is not None
+
+    def _search_candidates(self, vectors, k, candidates):
+        stored = self.index.reconstruct_batch(candidates)
+        distances = ((vectors[:, None, :] - stored[None, :, :]) ** 2).sum(axis=2)
+        order = np.argsort(distances, axis=1)[:, :k]
+        rows = np.full((len(vectors), k), -1, dtype=np.int64)
+        out = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        rows[:, :order.shape[1]] = candidates[order]
+        out[:, :order.shape[1]] = np.take_along_axis(distances, order, axis=1)
+        return out, rows
+
+    def similarity_search_with_score(self, query, k=5, mask=None):
+        from langchain_core.documents import Document
+        distances, rows = self.search_vectors(np.asarray([self.embed_query(query)]), k, mask=mask)
+        hits = [(self.movie_id(int(r)), self.title(int(r)), float(d)) for r, d in zip(rows[0], distances[0]) if r >= 0]
+        plots = self._plots([movie_id for movie_id, _, _ in hits])
+        return [
+            (Document(page_content=plots.get(movie_id, title), metadata={"_id": movie_id, "title": title}), d)
+            for movie_id, title, d in hits
+        ]
+
+    def similarity_search(self, query, k=5, mask=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, mask=mask)]
+
+    def movie_ids(self):
+        return self._ids.to_pylist()
+
+    def _plots(self, movie_ids):
+        if self.engine is None or not movie_ids:
+            return {}
+        query = text("SELECT _id, COALESCE(plot, fullplot) FROM movies WHERE _id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        )
+        with self.engine.connect() as conn:
+            return {str(i): p for i, p in conn.execute(query, {"ids": movie_ids}) if p}
+
+
+def make_id_table(ids, titles, sources, hashes):
+    return pa.table({
+        "_id": pa.array(ids, pa.string()),
+        "title": pa.array(titles, pa.string()),
+        "source": pa.array(sources, pa.int8()),
+        # Content hash of "<title>. <plot>" for embedded rows, so rebuilds can reuse their vectors
+        "content_hash": pa.array(hashes, pa.string()),
+    })
+
+
+def resolve_index_dir(path):
+    """
+    Directory with the published index files under `path`: the build named in
+    `path/CURRENT`, or `path` itself for indexes saved before builds were versioned.
+    """
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return path
+    return os.path.join(path, name) if name else path
+
+
+def is_vector_index_dir(path):
+    return os.path.exists(os.path.join(resolve_index_dir(path), ID_TABLE_FILE))
+
+
+def load_vector_index(path, embedding_model, engine=None, **load_options):
+    """
+    Load `path` as a MovieVectorIndex, or as a LangChain FAISS store if it was built that way.
+    `load_options` (mmap, nprobe, ef_search) only apply to MovieVectorIndex.
+    Raises EmbeddingModelMismatch if the index was built with another embedding model.
+    """
+    path = resolve_index_dir(path)
+    if is_vector_index_dir(path):
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            check_index_model(json.load(f).get("model"), embedding_model, path)
+        return MovieVectorIndex.load(path, embedding_model, engine=engine, **load_options)
+    manifest_path = os.path.join(path, "manifest.json")
+    index_model = LEGACY_INDEX_MODEL
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            index_model = json.load(f).get("model", LEGACY_INDEX_MODEL)
+    check_index_model(index_model, embedding_model, path)
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(path, embedding_model, allow_dangerous_deserialization=True)
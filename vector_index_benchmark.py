@@ -0,0 +1,181 @@
+"""
+Recall / latency / memory comparison of FAISS index types for the movie vectors.
+
+    python vector_index_benchmark.py                              # vectors of the current faiss_movie_index
+    python vector_index_benchmark.py --source db                  # movies.plot_embedding
+    python vector_index_benchmark.py --synthetic 1000000 --dim 1536 --output bench.json
+    python vector_index_benchmark.py --nprobe 4 16 64 --ef-search 32 64 128
+
+Every configuration is written to disk and loaded back (memory-mapped unless
+--no-mmap) before it is measured. Recall@k is measured against exact flat
+search. Latency is per single query, which is what the app issues. "load MB" is
+the process RSS growth from loading the index (the private copy; near zero when
+memory-mapped), "RSS MB" the growth after running the queries, which for a
+mapped index counts the file pages touched (shared page cache).
+"""
+import os
+import gc
+import json
+import time
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+import psutil
+
+from vector_index import (
+    MovieVectorIndex, read_plot_embeddings, build_faiss_index, set_search_params, reconstruct_rows,
+    is_vector_index_dir, read_index_flags,
+)
+from config import DB_URI, FAISS_INDEX_PATH
+
+
+# --- Vectors ---
+def synthetic_vectors(n, dim, clusters=200, seed=7):
+    """Clustered unit vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def load_vectors(source, index_path=FAISS_INDEX_PATH):
+    if source == "db":
+        from sqlalchemy import create_engine
+        return read_plot_embeddings(create_engine(DB_URI))[2]
+    if not is_vector_index_dir(index_path):
+        raise SystemExit(f"{index_path} is not a column-built index; use --source db or --synthetic")
+    index = MovieVectorIndex.load(index_path, embedding_model=None).index
+    vectors = reconstruct_rows(index, np.arange(index.ntotal))
+    if vectors is None:
+        raise SystemExit(f"{index_path} is PQ-compressed; use --source db or --synthetic")
+    return vectors
+
+
+def make_queries(vectors, n_queries, seed=11):
+    # Perturbed copies of indexed vectors, so every query has real near neighbours
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    noise = 0.05 * rng.standard_normal(picked.shape).astype(np.float32) * np.abs(picked).mean()
+    return np.ascontiguousarray(picked + noise, dtype=np.float32)
+
+
+# --- Measurement ---
+def _rss_mb():
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(f[f >= 0]) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def measure(index, queries, truth, k):
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, rows = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = rows[0]
+    return {
+        f"recall_at_{k}": round(recall_at_k(found, truth), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def benchmark(vectors, configs, n_queries=500, k=5, mmap=True):
+    import faiss
+
+    queries = make_queries(vectors, n_queries)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    del exact
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="vector_index_bench_")
+    try:
+        for index_type, build_params, search_sweep in configs:
+            start = time.perf_counter()
+            built, factory = build_faiss_index(vectors, index_type, **build_params)
+            build_s = time.perf_counter() - start
+            path = os.path.join(workdir, f"{index_type}.faiss")
+            faiss.write_index(built, path)
+            del built
+            gc.collect()
+
+            rss_before = _rss_mb()
+            start = time.perf_counter()
+            index = faiss.read_index(path, read_index_flags(mmap))
+            load_ms = (time.perf_counter() - start) * 1000
+            load_mb = round(_rss_mb() - rss_before, 1)
+            for search_params in search_sweep:
+                set_search_params(index, **search_params)
+                row = {
+                    "index_type": index_type, "factory": factory, **search_params,
+                    "build_s": round(build_s, 2), "load_ms": round(load_ms, 2), "load_mb": load_mb,
+                    "file_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+                    **measure(index, queries, truth, k),
+                }
+                row["rss_mb"] = round(_rss_mb() - rss_before, 1)
+                results.append(row)
+                print(format_row(row, k))
+            del index
+            gc.collect()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def default_configs(nprobes, ef_searches, nlist=None, pq_m=None, hnsw_m=32):
+    return [
+        ("flat", {}, [{}]),
+        ("ivf_flat", {"nlist": nlist}, [{"nprobe": n} for n in nprobes]),
+        ("ivf_pq", {"nlist": nlist, "pq_m": pq_m}, [{"nprobe": n} for n in nprobes]),
+        ("hnsw", {"hnsw_m": hnsw_m}, [{"ef_search": e} for e in ef_searches]),
+    ]
+
+
+HEADER = f"{'index':<26}{'knob':>12}{'recall':>8}{'p50 ms':>9}{'p99 ms':>9}{'build s':>9}{'load ms':>9}{'file MB':>9}{'load MB':>9}{'RSS MB':>8}"
+
+
+def format_row(row, k):
+    knob = f"nprobe={row['nprobe']}" if "nprobe" in row else f"ef={row['ef_search']}" if "ef_search" in row else "-"
+    return (f"{row['factory']:<26}{knob:>12}{row[f'recall_at_{k}']:>8.3f}{row['p50_ms']:>9.3f}{row['p99_ms']:>9.3f}"
+            f"{row['build_s']:>9.2f}{row['load_ms']:>9.2f}{row['file_mb']:>9.1f}{row['load_mb']:>9.1f}{row['rss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["index", "db"], default="index")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--no-mmap", action="store_true", help="Read indexes fully into RAM")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic, args.dim) if args.synthetic else load_vectors(args.source)
+    print(f"{len(vectors):,} vectors x {vectors.shape[1]} dims, {args.queries} queries, "
+          f"{'mmap' if not args.no_mmap else 'in-memory'} loading\n")
+    print(HEADER)
+    configs = default_configs(args.nprobe, args.ef_search, args.nlist, args.pq_m, args.hnsw_m)
+    results = benchmark(vectors, configs, n_queries=args.queries, k=args.k, mmap=not args.no_mmap)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(vectors), "dim": int(vectors.shape[1]), "k": args.k,
+                       "mmap": not args.no_mmap, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()